@@ -13,9 +13,45 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    from app import logs
+    logs.init_app(app)
+
+    from app import profiling
+    profiling.init_app(app)
+
+    from app import database
+    database.init_app(app)
+
     db.init_app(app)
     csrf.init_app(app)
 
+    from app import epos_client
+    epos_client.init_app(app)
+
+    from app.customer_mirror import customer_mirror
+    customer_mirror.init_app(app)
+
+    from app import rate_limit
+    rate_limit.init_app(app)
+
+    from app import email_service
+    email_service.init_app(app)
+
+    from app import campaigns
+    campaigns.init_app(app)
+
+    from app import housekeeping
+    housekeeping.init_app(app)
+
+    from app import metrics
+    metrics.init_app(app)
+
+    from app.passes import pass_builder
+    pass_builder.init_app(app)
+
+    from app.static_assets import static_assets
+    static_assets.init_app(app)
+
     from app.auth import bp as auth_bp
     app.register_blueprint(auth_bp)
 
@@ -25,7 +61,7 @@ def create_app(config_class=Config):
     from app.wallet import bp as wallet_bp
     app.register_blueprint(wallet_bp)
 
-    with app.app_context():
-        db.create_all()
+    from app import startup
+    startup.init_app(app)
 
     return app
@@ -1,5 +1,4 @@
 import datetime
-import hashlib
 import secrets
 import logging
 from flask import Blueprint, render_template, request, redirect, url_for, session, current_app, flash
@@ -8,12 +7,13 @@ from wtforms import StringField, SubmitField
 from wtforms.validators import DataRequired, Email
 
 from app import db
-from app.models import MagicLinkToken, RateLimit
+from app.models import MagicLinkToken, UserAgent
 from app.epos_client import EposNowClient
 from app.email_service import send_magic_link
+from app import magic_links
+from app.backpressure import UpstreamUnavailable
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 bp = Blueprint('auth', __name__)
 
@@ -27,26 +27,8 @@ class EmailForm(FlaskForm):
     submit = SubmitField('Send Magic Link')
 
 def check_rate_limit(key, limit, period_seconds=3600):
-    """Checks and increments a rate limit counter in the database."""
-    now = datetime.datetime.utcnow()
-    period_start = now - datetime.timedelta(seconds=period_seconds)
-    
-    rate_limit = RateLimit.query.filter(
-        RateLimit.key == key,
-        RateLimit.window_start >= period_start
-    ).first()
-
-    if rate_limit and rate_limit.count >= limit:
-        return False
-    
-    if rate_limit:
-        rate_limit.count += 1
-    else:
-        rate_limit = RateLimit(key=key, count=1, window_start=now)
-        db.session.add(rate_limit)
-    
-    db.session.commit()
-    return True
+    """Checks and increments a rate limit counter using the configured backend."""
+    return current_app.extensions['rate_limiter'].hit(key, limit, period_seconds)
 
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -57,29 +39,33 @@ def login():
 
         # Rate limiting
         is_dev = current_app.debug
-        email_limit = 500 if is_dev else RATE_LIMIT_EMAIL_HOUR
-        ip_limit = 2000 if is_dev else RATE_LIMIT_IP_HOUR
+        email_limit = 500 if is_dev else current_app.config.get('RATE_LIMIT_EMAIL_HOUR', RATE_LIMIT_EMAIL_HOUR)
+        ip_limit = 2000 if is_dev else current_app.config.get('RATE_LIMIT_IP_HOUR', RATE_LIMIT_IP_HOUR)
 
         if not check_rate_limit(f'email:{email}', email_limit) or \
            not check_rate_limit(f'ip:{ip_address}', ip_limit):
-            logging.warning(f'Rate limit exceeded for email {email} or IP {ip_address}')
+            logger.warning('Rate limit exceeded for email %s or IP %s', email, ip_address,
+                           extra={'event': 'login.rate_limited'})
             # Still show the same page to prevent user enumeration
             return redirect(url_for('auth.check_inbox'))
 
         # Generate token
-        token = secrets.token_urlsafe(32)
-        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
-        expires_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=MAGIC_LINK_EXPIRATION_MINUTES)
-
-        new_token = MagicLinkToken(
-            email=email,
-            token_hash=token_hash,
-            expires_at=expires_at,
-            request_ip=ip_address,
-            user_agent=request.user_agent.string
-        )
-        db.session.add(new_token)
-        db.session.commit()
+        if current_app.config['MAGIC_LINK_MODE'] == 'signed':
+            # Self-contained token; nothing is stored until it is redeemed.
+            token = magic_links.issue_token(email, MAGIC_LINK_EXPIRATION_MINUTES * 60, current_app.config['SECRET_KEY'])
+        else:
+            token = secrets.token_urlsafe(32)
+            expires_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=MAGIC_LINK_EXPIRATION_MINUTES)
+
+            new_token = MagicLinkToken(
+                email=email,
+                token_digest=magic_links.token_digest(token),
+                expires_at=expires_at,
+                request_ip=ip_address,
+                user_agent_id=UserAgent.id_for(request.user_agent.string)
+            )
+            db.session.add(new_token)
+            db.session.commit()
 
         # Send email with magic link
         magic_link_url = url_for('auth.verify_link', token=token, _external=True)
@@ -87,8 +73,7 @@ def login():
         # Send email with magic link via MailJet
         send_magic_link(email, magic_link_url)
         
-        # Log for debugging purposes
-        logging.info(f'Generated magic link for {email}: {magic_link_url}')
+        logger.info('Issued magic link for %s', email, extra={'event': 'login.link_issued'})
 
         return redirect(url_for('auth.check_inbox'))
 
@@ -98,40 +83,57 @@ def login():
 def check_inbox():
     return render_template('check_inbox.html')
 
-@bp.route('/login/verify/<token>')
-def verify_link(token):
-    token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
-    magic_token = MagicLinkToken.query.filter_by(token_hash=token_hash).first()
-
+def redeem_database_token(token):
+    """Looks up a stored token and marks it used. Returns the email, or None if invalid."""
+    magic_token = MagicLinkToken.query.filter_by(token_digest=magic_links.token_digest(token)).first()
     if not magic_token or not magic_token.is_valid():
-        logging.warning(f'Invalid or expired magic link token used.')
-        flash('This magic link is invalid or has expired.', 'danger')
-        return redirect(url_for('auth.login'))
+        return None
 
     # Mark token as used
     magic_token.used_at = datetime.datetime.utcnow()
     db.session.commit()
+    return magic_token.email
+
+@bp.route('/login/verify/<token>')
+def verify_link(token):
+    # Signed links stay valid after switching MAGIC_LINK_MODE, so dispatch on the token's shape.
+    if magic_links.is_signed_token(token):
+        email = magic_links.redeem_token(token, current_app.config['SECRET_KEY'])
+    else:
+        email = redeem_database_token(token)
+
+    if not email:
+        logger.warning('Invalid or expired magic link token used.', extra={'event': 'login.invalid_link'})
+        flash('This magic link is invalid or has expired.', 'danger')
+        return redirect(url_for('auth.login'))
 
     # Log the user in. Fetch customer data from EPOS Now to populate the session.
     session.clear()
-    session['user_email'] = magic_token.email
+    session['user_email'] = email
     session.permanent = True
     current_app.permanent_session_lifetime = datetime.timedelta(days=14)
 
     try:
         epos_client = EposNowClient()
-        customer = epos_client.get_customer_by_email(magic_token.email)
-        print(customer)
+        customer = epos_client.get_customer_by_email(email)
         if customer:
             session['customer_id'] = customer.get('Id')
             session['customer_name'] = f"{customer.get('Forename', '')} {customer.get('Surname', '')}".strip()
-            logging.info(f"Existing customer '{session['customer_name']}' logged in.")
+            logger.info('Existing customer %s logged in.', session['customer_id'], extra={'event': 'login.success'})
         else:
-            logging.warning(f"New user with email {magic_token.email} logged in. No profile found in EPOS Now.")
+            logger.warning('New user with email %s logged in. No profile found in EPOS Now.', email,
+                           extra={'event': 'login.new_user'})
             session['customer_id'] = None
             session['customer_name'] = 'New User'
+    except UpstreamUnavailable as e:
+        # Fails fast while EPOS is down. customer_id stays unset, so the dashboard looks the
+        # customer up by email once EPOS is back instead of offering to create a profile.
+        logger.warning('Skipped EPOS customer lookup at login for %s: %s', email, e)
+        flash('Your loyalty account is temporarily unavailable. Please check back shortly.', 'warning')
+        session['customer_id'] = None
+        session['customer_name'] = 'User'
     except Exception as e:
-        logging.error(f'Failed to fetch EPOS customer data for {magic_token.email}: {e}')
+        logger.error('Failed to fetch EPOS customer data for %s: %s', email, e)
         flash('Could not retrieve your customer profile at this time. Please try again later.', 'warning')
         # Allow login even if EPOS lookup fails, user will be treated as new.
         session['customer_id'] = None
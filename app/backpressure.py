@@ -0,0 +1,214 @@
+import threading
+import time
+from collections import deque
+
+
+class UpstreamUnavailable(Exception):
+    """The upstream was not called because it could not take the call; retry after `retry_after` seconds."""
+
+    def __init__(self, name, retry_after, message):
+        super().__init__(message)
+        self.name = name
+        self.retry_after = retry_after
+
+
+class UpstreamSaturated(UpstreamUnavailable):
+    """Raised when no upstream slot frees up before the caller's wait deadline."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(name, retry_after, f'{name} is saturated; retry after {retry_after}s.')
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(name, retry_after, f'{name} circuit is open; retry after {retry_after}s.')
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the calls in flight to an upstream from one process. Up to `max_waiting`
+    further callers queue for at most `timeout` seconds; anyone beyond that, or
+    still waiting at the deadline, gets UpstreamSaturated straight away, so a slow
+    upstream ties up a bounded number of worker threads.
+
+        with limiter.slot():
+            response = session.get(url)
+
+    max_concurrency <= 0 disables the limit.
+    """
+
+    def __init__(self, name, max_concurrency=8, max_waiting=16, timeout=1.0, retry_after=5):
+        self.name = name
+        self.rejected = 0
+        self._cond = threading.Condition(threading.Lock())
+        self.configure(max_concurrency, max_waiting, timeout, retry_after)
+
+    def configure(self, max_concurrency=None, max_waiting=None, timeout=None, retry_after=None):
+        with self._cond:
+            if max_concurrency is not None:
+                self.max_concurrency = max_concurrency
+            if max_waiting is not None:
+                self.max_waiting = max_waiting
+            if timeout is not None:
+                self.timeout = timeout
+            if retry_after is not None:
+                self.retry_after = retry_after
+            self.in_flight = 0
+            self.waiting = 0
+            self._cond.notify_all()
+
+    def acquire(self):
+        with self._cond:
+            if self.max_concurrency <= 0:
+                self.in_flight += 1
+                return
+            if self.in_flight >= self.max_concurrency:
+                if self.waiting >= self.max_waiting:
+                    self.rejected += 1
+                    raise UpstreamSaturated(self.name, self.retry_after)
+                deadline = time.monotonic() + self.timeout
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.max_concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            raise UpstreamSaturated(self.name, self.retry_after)
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._cond.notify()
+
+    def slot(self):
+        return _Slot(self)
+
+    def stats(self):
+        return {'in_flight': self.in_flight, 'waiting': self.waiting, 'rejected': self.rejected}
+
+
+class _Slot:
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def __enter__(self):
+        self.limiter.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.limiter.release()
+
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that is failing or too slow. Outcomes from the last
+    `window` seconds are kept; once there are at least `min_calls`, a failure rate
+    of `failure_rate` or a rate of calls slower than `slow_call_seconds` of
+    `slow_call_rate` opens the circuit. An open circuit rejects calls with
+    CircuitOpen for `open_seconds`, then lets `half_open_probes` calls through:
+    if they succeed the circuit closes, if one fails it opens again.
+
+        breaker.before_call()
+        ...call the upstream...
+        breaker.record(failed, seconds)   # or breaker.cancel() if it was never called
+
+    `on_transition(old_state, new_state)` is called on every change of state.
+    """
+
+    def __init__(self, name, failure_rate=0.5, slow_call_seconds=5.0, slow_call_rate=0.8, min_calls=10,
+                 window=30.0, open_seconds=30.0, half_open_probes=1, enabled=True, on_transition=None,
+                 clock=time.monotonic):
+        self.name = name
+        self.on_transition = on_transition
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.configure(failure_rate, slow_call_seconds, slow_call_rate, min_calls, window, open_seconds,
+                       half_open_probes, enabled)
+
+    def configure(self, failure_rate=None, slow_call_seconds=None, slow_call_rate=None, min_calls=None,
+                  window=None, open_seconds=None, half_open_probes=None, enabled=None):
+        with self._lock:
+            for name, value in (('failure_rate', failure_rate), ('slow_call_seconds', slow_call_seconds),
+                                ('slow_call_rate', slow_call_rate), ('min_calls', min_calls), ('window', window),
+                                ('open_seconds', open_seconds), ('half_open_probes', half_open_probes),
+                                ('enabled', enabled)):
+                if value is not None:
+                    setattr(self, name, value)
+            self.state = CLOSED
+            self.opened_at = None
+            self.probes = 0
+            self._outcomes = deque()  # (recorded_at, failed, slow)
+
+    def _transition(self, state):
+        # Called with the lock held.
+        old, self.state = self.state, state
+        self._outcomes.clear()
+        self.probes = 0
+        self.opened_at = self._clock() if state == OPEN else None
+        if self.on_transition is not None:
+            self.on_transition(old, state)
+
+    def before_call(self):
+        """Raises CircuitOpen if the call must not be made."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN:
+                remaining = self.opened_at + self.open_seconds - self._clock()
+                if remaining > 0:
+                    raise CircuitOpen(self.name, max(1, int(remaining + 0.999)))
+                self._transition(HALF_OPEN)
+            if self.probes >= self.half_open_probes:
+                raise CircuitOpen(self.name, 1)
+            self.probes += 1
+
+    def record(self, failed, seconds):
+        if not self.enabled:
+            return
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN)
+                else:
+                    self.probes -= 1
+                    self._outcomes.append((self._clock(), False, False))
+                    if len(self._outcomes) >= self.half_open_probes:
+                        self._transition(CLOSED)
+                return
+            if self.state == OPEN:
+                return  # a call made before the circuit opened
+            now = self._clock()
+            self._outcomes.append((now, failed, slow))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for _, f, _ in self._outcomes if f)
+            slow_calls = sum(1 for _, _, s in self._outcomes if s)
+            if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate:
+                self._transition(OPEN)
+
+    def cancel(self):
+        """Releases a half-open probe that never reached the upstream."""
+        with self._lock:
+            if self.state == HALF_OPEN and self.probes > 0:
+                self.probes -= 1
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = sum(1 for _, f, _ in self._outcomes if f)
+            return {'state': self.state, 'calls': calls, 'failures': failures}
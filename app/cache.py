@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheEntry:
+    __slots__ = ('value', 'stored_at', 'fresh_until', 'stale_until')
+
+    def __init__(self, value, stored_at, ttl, stale_ttl, age=0.0):
+        self.value = value
+        self.stored_at = stored_at - age  # when the value itself was produced
+        self.fresh_until = stored_at + ttl
+        self.stale_until = self.fresh_until + stale_ttl
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache whose entries are fresh for `ttl` seconds and may then
+    be served stale for a further `stale_ttl` seconds while the caller revalidates.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, stale_ttl=0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, maxsize=None, ttl=None, stale_ttl=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            if stale_ttl is not None:
+                self.stale_ttl = stale_ttl
+            self._data.clear()
+
+    def lookup(self, key):
+        """
+        Returns (value, is_stale), or (None, False) on a miss.
+        Entries past their stale window are dropped.
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or now >= entry.stale_until:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None, False
+            self._data.move_to_end(key)
+            if now < entry.fresh_until:
+                self.hits += 1
+                return entry.value, False
+            self.stale_hits += 1
+            return entry.value, True
+
+    def get(self, key, default=None):
+        value, _ = self.lookup(key)
+        return default if value is None else value
+
+    def stored_at(self, key):
+        """Returns the clock reading at which `key`'s value was produced (stored, less its age), or None."""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry.stored_at if entry else None
+
+    def set(self, key, value, age=0.0):
+        """Stores `value`, which was already `age` seconds old; it is still fresh for `ttl` from now."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = CacheEntry(value, self._clock(), self.ttl, self.stale_ttl, age)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def begin_refresh(self, key):
+        """Claims the revalidation of `key`; False if another caller already has it."""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,265 @@
+"""
+Bulk magic-link campaigns.
+
+    flask send-campaign customers.csv --rate 20 --connections 4
+
+Reads one email per line (the first CSV column; blank lines and lines starting
+with '#' are skipped) without loading the file into memory. Each batch of
+addresses gets its MagicLinkToken rows in a single multi-row insert (nothing
+is stored in MAGIC_LINK_MODE=signed). The batch is then sent over a pool of
+SMTP connections that stay open for the whole run, with sends paced to `--rate`
+messages per second.
+
+After every batch, the number of input lines done is saved to a progress file.
+Re-running the same command resumes after the last finished batch, so a batch
+interrupted mid-send may be sent twice. Addresses that could not be delivered
+are appended to a `.failed` file beside the input.
+"""
+import datetime
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app, url_for
+from flask.cli import with_appcontext
+
+from app import db, magic_links
+from app.email_service import SMTPConnection, build_magic_link_message, is_transient, smtp_settings
+from app.models import MagicLinkToken, UserAgent
+
+logger = logging.getLogger(__name__)
+
+
+def read_emails(lines, skip=0):
+    """Yields (line_number, email) for the lines after `skip`, lower-cased, skipping anything that isn't an address."""
+    for line_number, line in enumerate(lines, 1):
+        if line_number <= skip:
+            continue
+        email = line.split(',', 1)[0].strip().strip('"').lower()
+        if email and not email.startswith('#') and '@' in email:
+            yield line_number, email
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def issue_links(emails, expires_in_seconds, label):
+    """Returns (email, token) for each address; in database mode their tokens are inserted in one statement."""
+    config = current_app.config
+    if config['MAGIC_LINK_MODE'] == 'signed':
+        return [(email, magic_links.issue_token(email, expires_in_seconds, config['SECRET_KEY'])) for email in emails]
+
+    now = datetime.datetime.utcnow()
+    expires_at = now + datetime.timedelta(seconds=expires_in_seconds)
+    user_agent_id = UserAgent.id_for(label)
+    links, rows = [], []
+    for email in emails:
+        token = secrets.token_urlsafe(32)
+        links.append((email, token))
+        rows.append({'email': email, 'token_digest': magic_links.token_digest(token), 'created_at': now,
+                     'expires_at': expires_at, 'request_ip': 'campaign', 'user_agent_id': user_agent_id})
+    db.session.execute(MagicLinkToken.__table__.insert(), rows)
+    db.session.commit()
+    return links
+
+
+class Throttle:
+    """Spaces calls to acquire() at least 1/rate seconds apart across threads. rate <= 0 means no limit."""
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = self._clock()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            self._sleep(slot - now)
+
+
+class CampaignSender:
+    """
+    Sends messages from a fixed pool of threads, each keeping one SMTPConnection
+    open across batches. Transient failures are retried with exponential backoff.
+    """
+
+    def __init__(self, settings, connections=4, rate=0, max_retries=3, retry_backoff=1.0):
+        self.settings = settings
+        self.throttle = Throttle(rate)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._executor = ThreadPoolExecutor(max_workers=max(1, connections), thread_name_prefix='campaign-smtp')
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = SMTPConnection(**self.settings)
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _send(self, item):
+        recipient_email, message = item
+        connection = self._connection()
+        attempt = 0
+        while True:
+            self.throttle.acquire()
+            try:
+                connection.send(recipient_email, message)
+                return True
+            except Exception as e:
+                connection.close()
+                if attempt >= self.max_retries or not is_transient(e):
+                    logger.error('Campaign email to %s failed after %d attempts: %s', recipient_email, attempt + 1, e)
+                    return False
+                attempt += 1
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+    def send(self, items):
+        """Sends (recipient, message) pairs; returns the recipients that could not be delivered."""
+        results = self._executor.map(self._send, items)
+        return [recipient for (recipient, _), sent in zip(items, results) if not sent]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for connection in self._connections:
+            connection.close()
+
+
+class Progress:
+    """The number of input lines finished, kept in a JSON file so an interrupted run can resume."""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        return state.get('lines', 0) if state.get('source') == self.source else 0
+
+    def save(self, lines, stats):
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'source': self.source, 'lines': lines, 'stats': stats}, f)
+        os.replace(temporary, self.path)  # never leave a half-written progress file
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def run_campaign(lines, sender, progress, batch_size, expires_in_seconds, base_url, label, failed_file=None,
+                 report=None):
+    """Issues and sends links for every address after the saved progress; returns the run's counters."""
+    start = time.monotonic()
+    stats = {'sent': 0, 'failed': 0, 'batches': 0}
+    resume_from = progress.load()
+    done_through = resume_from
+    for batch in batched(read_emails(lines, skip=resume_from), batch_size):
+        emails = list(dict.fromkeys(email for _, email in batch))
+        links = issue_links(emails, expires_in_seconds, label)
+        with current_app.test_request_context(base_url=base_url):
+            messages = [(email, build_magic_link_message(email, url_for('auth.verify_link', token=token,
+                                                                         _external=True)))
+                        for email, token in links]
+        failed = sender.send(messages)
+        if failed and failed_file:
+            with open(failed_file, 'a') as f:
+                f.writelines(f'{email}\n' for email in failed)
+
+        stats['batches'] += 1
+        stats['sent'] += len(messages) - len(failed)
+        stats['failed'] += len(failed)
+        done_through = batch[-1][0]
+        progress.save(done_through, stats)
+        if report:
+            report(stats, time.monotonic() - start)
+    stats['resumed_from_line'] = resume_from
+    stats['lines'] = done_through
+    stats['seconds'] = round(time.monotonic() - start, 3)
+    return stats
+
+
+def _rate(count, seconds):
+    return count / seconds if seconds > 0 else 0.0
+
+
+@click.command('send-campaign')
+@click.argument('emails_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--base-url', default=None, help='Public URL of the portal for the links (default PORTAL_URL).')
+@click.option('--batch-size', type=int, default=None, help='Addresses per token insert and send batch.')
+@click.option('--connections', type=int, default=None, help='SMTP connections kept open in parallel.')
+@click.option('--rate', type=float, default=None, help='Messages per second across all connections (0: unlimited).')
+@click.option('--expires-hours', type=float, default=None, help='How long the links stay valid.')
+@click.option('--restart', is_flag=True, help='Ignore saved progress and start from the first line.')
+@with_appcontext
+def send_campaign_command(emails_file, base_url, batch_size, connections, rate, expires_hours, restart):
+    """Send a magic login link to every address in EMAILS_FILE."""
+    config = current_app.config
+    base_url = base_url or config['PORTAL_URL']
+    if not base_url:
+        raise click.UsageError('Set PORTAL_URL or pass --base-url so the links point at the portal.')
+    if not config['MAIL_USERNAME'] or not config['MAIL_PASSWORD']:
+        raise click.UsageError('MailJet API keys not configured. Cannot send email.')
+
+    progress = Progress(f'{emails_file}.progress', os.path.abspath(emails_file))
+    if restart:
+        progress.clear()
+    sender = CampaignSender(
+        smtp_settings(config),
+        connections=connections or config['CAMPAIGN_SMTP_CONNECTIONS'],
+        rate=config['CAMPAIGN_SEND_RATE'] if rate is None else rate,
+        max_retries=config['MAIL_MAX_RETRIES'],
+        retry_backoff=config['MAIL_RETRY_BACKOFF'],
+    )
+
+    def report(stats, seconds):
+        click.echo(f"batch {stats['batches']}: {stats['sent']} sent, {stats['failed']} failed, "
+                   f"{_rate(stats['sent'], seconds):.1f} msg/s")
+
+    expires_in = int((expires_hours or config['CAMPAIGN_LINK_EXPIRY_HOURS']) * 3600)
+    try:
+        with open(emails_file, encoding='utf-8') as lines:
+            stats = run_campaign(lines, sender, progress, batch_size or config['CAMPAIGN_BATCH_SIZE'], expires_in,
+                                 base_url, f'campaign:{os.path.basename(emails_file)}',
+                                 failed_file=f'{emails_file}.failed', report=report)
+    finally:
+        sender.close()
+
+    if stats['resumed_from_line']:
+        click.echo(f"Resumed after line {stats['resumed_from_line']}.")
+    click.echo(f"Sent {stats['sent']} links ({stats['failed']} failed) in {stats['seconds']:.1f}s, "
+               f"{_rate(stats['sent'], stats['seconds']):.1f} msg/s.")
+    if stats['failed']:
+        click.echo(f'Undelivered addresses were appended to {emails_file}.failed')
+
+
+def init_app(app):
+    app.cli.add_command(send_campaign_command)
@@ -0,0 +1,141 @@
+"""
+Loyalty card codes rendered straight from their module matrix.
+
+A symbology turns the card number into rows of dark/light modules; the matrix
+is then written out as a single stroked SVG path (one `h` segment per run of
+dark modules) or as a 1-bit greyscale PNG. Neither output needs PIL.
+
+    render_code('9000000001', 'code128', 'svg')
+"""
+import functools
+import hashlib
+import struct
+import zlib
+
+from app import metrics
+
+CODE_CACHE_SIZE = 256
+MIMETYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+
+def card_digest(card_number):
+    """A stable, non-reversible identifier for a card number, safe to put in URLs."""
+    return hashlib.sha256(str(card_number).encode('utf-8')).hexdigest()[:32]
+
+
+def _qr_matrix(data):
+    import qrcode  # deferred, like every rendering dependency, to keep boot fast
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def _code128_matrix(data):
+    import barcode
+
+    modules = barcode.get('code128', str(data)).build()[0]
+    quiet_zone = [False] * 10
+    return [quiet_zone + [module == '1' for module in modules] + quiet_zone]
+
+
+class Symbology:
+    """
+    How one kind of code is drawn. `scale` is the pixel size of a module, and
+    linear codes are stretched to `bar_height` modules tall.
+    """
+
+    def __init__(self, name, matrix, wallet_format, scale, bar_height=None):
+        self.name = name
+        self.matrix = matrix
+        self.wallet_format = wallet_format  # py_pkpass BarcodeFormat member name
+        self.scale = scale
+        self.bar_height = bar_height
+
+
+SYMBOLOGIES = {
+    'qr': Symbology('qr', _qr_matrix, 'QR', scale=10),
+    'code128': Symbology('code128', _code128_matrix, 'CODE128', scale=2, bar_height=40),
+}
+
+
+def get_symbology(name):
+    try:
+        return SYMBOLOGIES[name]
+    except KeyError:
+        raise ValueError(f'Unknown code symbology: {name}')
+
+
+def _rows(symbology, matrix):
+    """The matrix with linear codes repeated to their bar height."""
+    if symbology.bar_height:
+        return matrix * symbology.bar_height
+    return matrix
+
+
+def _runs(row):
+    """Yields (start, length) for each run of dark modules in a row."""
+    x, width = 0, len(row)
+    while x < width:
+        if row[x]:
+            start = x
+            while x < width and row[x]:
+                x += 1
+            yield start, x - start
+        else:
+            x += 1
+
+
+def matrix_to_svg(matrix, scale, bar_height=None):
+    width = len(matrix[0])
+    height = bar_height or len(matrix)
+    # Each run is a horizontal stroke through the middle of its row; a linear
+    # code is a single row whose stroke is as thick as the bars are tall.
+    stroke = height if bar_height else 1
+    path = []
+    for y, row in enumerate(matrix):
+        cursor = None
+        for start, length in _runs(row):
+            if cursor is None:
+                path.append(f'M{start} {y + stroke / 2:g}h{length}')
+            else:
+                path.append(f'm{start - cursor} 0h{length}')
+            cursor = start + length
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+        f'width="{width * scale}" height="{height * scale}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="#fff"/>'
+        f'<path stroke="#000" stroke-width="{stroke}" d="{"".join(path)}"/></svg>'
+    ).encode('utf-8')
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def matrix_to_png(rows, scale):
+    """A 1-bit greyscale PNG, each module `scale` pixels square, written directly with zlib."""
+    width = len(rows[0]) * scale
+    row_bytes = (width + 7) // 8
+    raw = bytearray()
+    for row in rows:
+        bits = ''.join(('0' if module else '1') * scale for module in row).ljust(row_bytes * 8, '1')
+        scanline = b'\x00' + int(bits, 2).to_bytes(row_bytes, 'big')  # filter type 0
+        raw += scanline * scale
+    header = struct.pack('>IIBBBBB', width, len(rows) * scale, 1, 0, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header) +
+            _png_chunk(b'IDAT', zlib.compress(bytes(raw), 9)) + _png_chunk(b'IEND', b''))
+
+
+@functools.lru_cache(maxsize=CODE_CACHE_SIZE)
+def render_code(data, symbology='qr', fmt='svg'):
+    """Renders `data` as an SVG or PNG code. Cached, since card numbers never change."""
+    if fmt not in MIMETYPES:
+        raise ValueError(f'Unsupported code format: {fmt}')
+    spec = get_symbology(symbology)
+    with metrics.CODE_RENDER_SECONDS.time(symbology=symbology, format=fmt):
+        matrix = spec.matrix(data)
+        if fmt == 'svg':
+            return matrix_to_svg(matrix, spec.scale, spec.bar_height)
+        return matrix_to_png(_rows(spec, matrix), spec.scale)
@@ -0,0 +1,197 @@
+"""
+A local read replica of EPOS Now customers.
+
+`flask sync-customers --full` pages through every customer into the
+MirroredCustomer table; plain `flask sync-customers` re-fetches the rows synced
+longest ago. Live lookups and writes made through EposNowClient are mirrored as
+they happen, which is how customers created in the till show up between full
+loads. With CUSTOMER_MIRROR_ENABLED, get_customer_by_email answers from rows no
+older than CUSTOMER_MIRROR_MAX_STALENESS seconds and calls EPOS only on a miss.
+"""
+import datetime
+import json
+import logging
+import time
+
+import click
+import requests
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+
+from app import db
+from app.models import MirroredCustomer
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(email):
+    return (email or '').strip().lower()
+
+
+class CustomerMirror:
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.max_staleness = 900
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config['CUSTOMER_MIRROR_ENABLED']
+        self.max_staleness = app.config['CUSTOMER_MIRROR_MAX_STALENESS']
+        app.extensions['customer_mirror'] = self
+        app.cli.add_command(sync_customers_command)
+
+    def _run(self, func, *args):
+        # Lookups also come from the EPOS background loop and revalidation threads,
+        # which have no app context. Never push a second one onto a request's thread:
+        # its teardown would remove the request's session.
+        if has_app_context():
+            return func(*args)
+        with self.app.app_context():
+            return func(*args)
+
+    def lookup(self, email):
+        """
+        (record, seconds since it was synced) for `email` if the mirrored record is
+        fresh enough, otherwise (None, None).
+        """
+        return self._fresh_record(MirroredCustomer.email == _normalize(email))
+
+    def lookup_id(self, customer_id):
+        """Like lookup, for an EPOS Id."""
+        return self._fresh_record(MirroredCustomer.id == int(customer_id))
+
+    def _fresh_record(self, criterion):
+        if not self.enabled or self.app is None:
+            return None, None
+        try:
+            return self._run(self._lookup, criterion)
+        except Exception as e:
+            logger.warning('Customer mirror lookup failed: %s', e)
+            return None, None
+
+    def _lookup(self, criterion):
+        now = datetime.datetime.utcnow()
+        cutoff = now - datetime.timedelta(seconds=self.max_staleness)
+        row = (MirroredCustomer.query.filter(criterion, MirroredCustomer.synced_at >= cutoff)
+               .order_by(MirroredCustomer.id).first())
+        if row is None:
+            return None, None
+        return json.loads(row.record), max(0.0, (now - row.synced_at).total_seconds())
+
+    def store(self, records):
+        """Writes through customer records fetched or saved live."""
+        if not self.enabled or self.app is None:
+            return
+        try:
+            self._run(upsert_customers, records)
+        except Exception as e:
+            if has_app_context():  # otherwise _run's own context already discarded the session
+                db.session.rollback()
+            logger.warning('Could not mirror customer records: %s', e)
+
+    def forget(self, emails):
+        """Drops rows whose EPOS state is unknown, e.g. after a failed update."""
+        if not self.enabled or self.app is None:
+            return
+        try:
+            self._run(self._forget, [_normalize(email) for email in emails])
+        except Exception as e:
+            if has_app_context():  # otherwise _run's own context already discarded the session
+                db.session.rollback()
+            logger.warning('Could not drop mirrored customers: %s', e)
+
+    def _forget(self, emails):
+        MirroredCustomer.query.filter(MirroredCustomer.email.in_(emails)).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def upsert_customers(records, synced_at=None):
+    """Inserts or updates mirror rows for `records` in one transaction. Returns the rows written."""
+    synced_at = synced_at or datetime.datetime.utcnow()
+    records = [r for r in records if isinstance(r, dict) and r.get('Id') is not None]
+    if not records:
+        return 0
+    existing = {row.id: row for row in MirroredCustomer.query.filter(
+        MirroredCustomer.id.in_([r['Id'] for r in records]))}
+    for record in records:
+        row = existing.get(record['Id'])
+        if row is None:
+            row = MirroredCustomer(id=record['Id'])
+            db.session.add(row)
+        consent = record.get('MarketingConsent') or {}
+        row.email = _normalize(record.get('EmailAddress'))
+        row.forename = record.get('Forename')
+        row.surname = record.get('Surname')
+        row.card_number = None if record.get('CardNumber') is None else str(record['CardNumber'])
+        row.current_points = record.get('CurrentPoints') or 0
+        row.marketing_email = bool(consent.get('Email'))
+        row.marketing_text = bool(consent.get('Text'))
+        row.record = json.dumps(record)
+        row.synced_at = synced_at
+    db.session.commit()
+    return len(records)
+
+
+def full_sync(client):
+    """Pages through every EPOS customer, then drops mirror rows for customers that no longer exist."""
+    started = datetime.datetime.utcnow()
+    stats = {'pages': 0, 'upserted': 0, 'removed': 0}
+    page = 1
+    while True:
+        customers = client.list_customers(page)
+        if not customers:
+            break
+        stats['pages'] += 1
+        stats['upserted'] += upsert_customers(customers, synced_at=datetime.datetime.utcnow())
+        page += 1
+    stats['removed'] = (MirroredCustomer.query.filter(MirroredCustomer.synced_at < started)
+                        .delete(synchronize_session=False))
+    db.session.commit()
+    return stats
+
+
+def incremental_sync(client, batch_size, min_age):
+    """Re-fetches up to `batch_size` rows last synced more than `min_age` seconds ago, stalest first."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=min_age)
+    ids = [row.id for row in db.session.query(MirroredCustomer.id)
+           .filter(MirroredCustomer.synced_at < cutoff)
+           .order_by(MirroredCustomer.synced_at).limit(batch_size)]
+    stats = {'refreshed': 0, 'removed': 0}
+    for customer_id in ids:
+        try:
+            customer = client.fetch_customer_by_id(customer_id)
+        except requests.exceptions.RequestException as e:
+            logger.warning('Stopping incremental customer sync: %s', e)
+            break
+        if customer is None:
+            MirroredCustomer.query.filter_by(id=customer_id).delete(synchronize_session=False)
+            db.session.commit()
+            stats['removed'] += 1
+        else:
+            stats['refreshed'] += upsert_customers([customer])
+    return stats
+
+
+@click.command('sync-customers')
+@click.option('--full', is_flag=True, help='Page through every EPOS customer instead of refreshing the stalest rows.')
+@click.option('--batch-size', type=int, default=None, help='Rows refreshed by an incremental run.')
+@with_appcontext
+def sync_customers_command(full, batch_size):
+    """Mirror EPOS Now customers into the local database."""
+    from app.epos_client import EposNowClient
+
+    start = time.monotonic()
+    client = EposNowClient()
+    config = current_app.config
+    if full:
+        stats = full_sync(client)
+    else:
+        stats = incremental_sync(client, batch_size or config['CUSTOMER_MIRROR_SYNC_BATCH'],
+                                 config['CUSTOMER_MIRROR_REFRESH_AGE'])
+    stats['seconds'] = round(time.monotonic() - start, 3)
+    logger.info('Customer sync finished: %s', stats)
+    click.echo(', '.join(f'{name}={value}' for name, value in stats.items()))
+
+
+customer_mirror = CustomerMirror()
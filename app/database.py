@@ -0,0 +1,67 @@
+"""
+Engine tuning for the configured database backend.
+
+SQLite (the default) is switched to WAL so readers no longer block the writer
+and concurrent logins from several gunicorn workers queue on busy_timeout
+instead of failing with "database is locked". Connections are pooled per worker
+so the pragmas are paid once per connection rather than once per request.
+"""
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+
+# Connection pragmas, overridden from the app config by init_app.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+}
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS suited to the backend in SQLALCHEMY_DATABASE_URI."""
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    pool_size = config['DATABASE_POOL_SIZE']
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:') or pool_size <= 0:
+            return {}  # Flask-SQLAlchemy's StaticPool / NullPool defaults
+        return {
+            'poolclass': QueuePool,
+            'pool_size': pool_size,
+            'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+            # Pooled connections move between a worker's threads, one at a time.
+            'connect_args': {'check_same_thread': False, 'timeout': config['SQLITE_BUSY_TIMEOUT'] / 1000},
+        }
+    return {
+        'pool_size': pool_size,
+        'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+        'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            if value is not None and value != '':
+                cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def init_app(app):
+    """Fills in SQLALCHEMY_ENGINE_OPTIONS unless they were set explicitly, and applies SQLite pragmas on connect."""
+    if not app.config.get('SQLALCHEMY_ENGINE_OPTIONS'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    SQLITE_PRAGMAS.update(
+        journal_mode=app.config['SQLITE_JOURNAL_MODE'],
+        synchronous=app.config['SQLITE_SYNCHRONOUS'],
+        busy_timeout=app.config['SQLITE_BUSY_TIMEOUT'],
+    )
+    if not event.contains(Engine, 'connect', _set_sqlite_pragmas):
+        event.listen(Engine, 'connect', _set_sqlite_pragmas)
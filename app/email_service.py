@@ -1,30 +1,257 @@
+import atexit
+import heapq
+import itertools
 import os
+import queue
 import smtplib
 import logging
+import threading
+import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-# MailJet SMTP Configuration
-MJ_SMTP_HOST = 'in-v3.mailjet.com'
-MJ_SMTP_PORT = 587
-MJ_APIKEY_PUBLIC = os.environ.get('MJ_APIKEY_PUBLIC')
-MJ_APIKEY_PRIVATE = os.environ.get('MJ_APIKEY_PRIVATE')
+from app import metrics
 
+# MailJet SMTP host and credentials live in Config (MAIL_SERVER, MAIL_USERNAME, ...).
 FROM_EMAIL = 'loyalty@hotelsinternational.co.uk'
 FROM_NAME = 'Hotels International'
 
 from flask import current_app
 
-def send_magic_link(recipient_email, magic_link):
-    """Sends a magic link email using MailJet's SMTP server."""
-    if current_app.debug:
-        logging.info(f'Magic link for {recipient_email}: {magic_link}')
-        return True
+logger = logging.getLogger(__name__)
+
+# SMTP replies in this range are temporary and worth retrying (RFC 5321 4yz).
+TRANSIENT_SMTP_CODES = range(400, 500)
+
+
+class SMTPConnection:
+    """An authenticated SMTP session that is opened on first use and kept open between sends."""
+
+    def __init__(self, host, port, username, password, use_tls=True, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._server = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()  # Secure the connection
+        if self.username:
+            server.login(self.username, self.password)
+        self._server = server
+
+    def send(self, recipient_email, message):
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            if self._server is None:
+                self._connect()
+            try:
+                self._server.sendmail(FROM_EMAIL, recipient_email, message)
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped an idle session; reconnect once and resend.
+                self._connect()
+                self._server.sendmail(FROM_EMAIL, recipient_email, message)
+            outcome = 'sent'
+        finally:
+            metrics.SMTP_SEND_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+def is_transient(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code in TRANSIENT_SMTP_CODES
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code in TRANSIENT_SMTP_CODES for code, _ in error.recipients.values())
+    return isinstance(error, (smtplib.SMTPServerDisconnected, OSError))
+
+
+class MailQueue:
+    """
+    Outbound mail queue drained by a background thread. The thread keeps one
+    SMTPConnection open and sends queued messages back to back over it. A message
+    that fails transiently is set aside until its backoff has passed, so messages
+    behind it keep going out in the meantime.
+    """
+
+    def __init__(self, maxsize=10000, max_retries=3, retry_backoff=1.0, idle_timeout=60, drain_timeout=10.0):
+        self.maxsize = maxsize
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.idle_timeout = idle_timeout
+        self.drain_timeout = drain_timeout
+        self.smtp_settings = None
+        self._queue = queue.Queue(maxsize)
+        self._retries = []  # heap of (not_before, sequence, item)
+        self._sequence = itertools.count()
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.last_latency = None
+        self.total_latency = 0.0
+
+    def configure(self, smtp_settings, maxsize=None, max_retries=None, retry_backoff=None, drain_timeout=None):
+        self.smtp_settings = smtp_settings
+        if maxsize is not None and maxsize != self.maxsize:
+            self.maxsize = maxsize
+            self._queue = queue.Queue(maxsize)
+        if max_retries is not None:
+            self.max_retries = max_retries
+        if retry_backoff is not None:
+            self.retry_backoff = retry_backoff
+        if drain_timeout is not None:
+            self.drain_timeout = drain_timeout
+
+    def enqueue(self, recipient_email, message):
+        """Queues a message for delivery; returns False if the queue is full."""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((recipient_email, message, time.monotonic(), 0))
+            return True
+        except queue.Full:
+            logger.error('Mail queue is full (%d); dropping email to %s.', self.maxsize, recipient_email)
+            with self._lock:
+                self.failed += 1
+            return False
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            # Threads do not survive a fork, so each gunicorn worker starts its own.
+            if self._thread is None or self._thread_pid != pid or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+                self._thread.start()
+                self._thread_pid = pid
+
+    def _next(self):
+        """The next message to send: a retry whose backoff has passed, else the next queued one, else None."""
+        with self._lock:
+            if self._retries and self._retries[0][0] <= time.monotonic():
+                return heapq.heappop(self._retries)[2]
+            wait = self._retries[0][0] - time.monotonic() if self._retries else self.idle_timeout
+        try:
+            return self._queue.get(timeout=max(0, min(wait, self.idle_timeout)))
+        except queue.Empty:
+            return None
+
+    def _run(self):
+        settings = self.smtp_settings
+        connection = SMTPConnection(**settings)
+        while True:
+            item = self._next()
+            if item is None:
+                if not self._retries:
+                    connection.close()  # don't hold an idle session open against the server
+                continue
+            if settings is not self.smtp_settings:
+                connection.close()
+                settings = self.smtp_settings
+                connection = SMTPConnection(**settings)
+            if not self._deliver(connection, *item):
+                self._queue.task_done()
 
-    if not MJ_APIKEY_PUBLIC or not MJ_APIKEY_PRIVATE:
-        logging.error('MailJet API keys not configured. Cannot send email.')
+    def _deliver(self, connection, recipient_email, message, enqueued_at, attempt):
+        """Sends one message. Returns True if it was set aside for a retry, i.e. is still unfinished."""
+        try:
+            connection.send(recipient_email, message)
+        except Exception as e:
+            connection.close()
+            if attempt >= self.max_retries or not is_transient(e):
+                with self._lock:
+                    self.failed += 1
+                logger.error('Failed to send email to %s after %d attempts: %s', recipient_email, attempt + 1, e)
+                return False
+            not_before = time.monotonic() + self.retry_backoff * 2 ** attempt
+            with self._lock:
+                self.retried += 1
+                heapq.heappush(self._retries, (not_before, next(self._sequence),
+                                               (recipient_email, message, enqueued_at, attempt + 1)))
+            return True
+        latency = time.monotonic() - enqueued_at
+        with self._lock:
+            self.sent += 1
+            self.last_latency = latency
+            self.total_latency += latency
+        logger.info('Successfully sent email to %s.', recipient_email, extra={'event': 'mail.sent'})
         return False
 
+    def join(self, timeout=None):
+        """Waits until every queued message has been handled (for tests and shutdown)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def drain(self):
+        """At exit, gives queued messages up to drain_timeout seconds to go out before the process stops."""
+        if self._thread_pid != os.getpid() or not self._queue.unfinished_tasks:
+            return
+        pending = self._queue.unfinished_tasks
+        if not self.join(self.drain_timeout):
+            logger.error('Mail queue not drained at shutdown; %d of %d emails not sent.',
+                         self._queue.unfinished_tasks, pending)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': self._queue.qsize() + len(self._retries),
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'last_latency': self.last_latency,
+                'avg_latency': self.total_latency / self.sent if self.sent else None,
+            }
+
+
+mail_queue = MailQueue()
+# create_app imports this after app.logs, and atexit runs handlers last in first out, so the drain still logs.
+atexit.register(mail_queue.drain)
+
+metrics.Gauge('loyalty_mail_queue', 'Mail queue depth, delivery counters and latency in seconds.', ('stat',),
+              collect=lambda: {(name,): value for name, value in mail_queue.stats().items() if value is not None})
+
+
+def init_app(app):
+    mail_queue.configure(
+        smtp_settings=smtp_settings(app.config),
+        maxsize=app.config['MAIL_QUEUE_MAXSIZE'],
+        max_retries=app.config['MAIL_MAX_RETRIES'],
+        retry_backoff=app.config['MAIL_RETRY_BACKOFF'],
+        drain_timeout=app.config['MAIL_DRAIN_TIMEOUT'],
+    )
+    app.extensions['mail_queue'] = mail_queue
+
+
+def smtp_settings(config):
+    return {
+        'host': config['MAIL_SERVER'],
+        'port': config['MAIL_PORT'],
+        'username': config['MAIL_USERNAME'],
+        'password': config['MAIL_PASSWORD'],
+        'use_tls': config['MAIL_USE_TLS'],
+    }
+
+
+def build_magic_link_message(recipient_email, magic_link):
+    """Builds the magic link email and returns it serialized, ready for sendmail."""
     # Create the email message
     msg = MIMEMultipart('alternative')
     msg['Subject'] = 'Loyalty Login Link'
@@ -43,14 +270,35 @@ def send_magic_link(recipient_email, magic_link):
     # The email client will try to render the last part first
     msg.attach(part1)
     msg.attach(part2)
+    return msg.as_string()
+
+
+def send_magic_link(recipient_email, magic_link):
+    """
+    Sends a magic link email using MailJet's SMTP server. With MAIL_QUEUE_ENABLED
+    the message is handed to the background mail queue and this returns immediately.
+    """
+    if current_app.debug:
+        # Development only: the link is the way in, so it is logged unredacted.
+        logger.info('Magic link for %s: %s', recipient_email, magic_link, extra={'unredacted': True})
+        return True
+
+    config = current_app.config
+    if not config['MAIL_USERNAME'] or not config['MAIL_PASSWORD']:
+        logger.error('MailJet API keys not configured. Cannot send email.')
+        return False
 
+    message = build_magic_link_message(recipient_email, magic_link)
+    if config['MAIL_QUEUE_ENABLED']:
+        return mail_queue.enqueue(recipient_email, message)
+
+    connection = SMTPConnection(**smtp_settings(config))
     try:
-        with smtplib.SMTP(MJ_SMTP_HOST, MJ_SMTP_PORT) as server:
-            server.starttls()  # Secure the connection
-            server.login(MJ_APIKEY_PUBLIC, MJ_APIKEY_PRIVATE)
-            server.sendmail(FROM_EMAIL, recipient_email, msg.as_string())
-            logging.info(f'Successfully sent magic link email to {recipient_email}.')
+        connection.send(recipient_email, message)
+        logger.info('Successfully sent magic link email to %s.', recipient_email, extra={'event': 'mail.sent'})
         return True
     except Exception as e:
-        logging.error(f'Failed to send magic link email to {recipient_email}: {e}')
+        logger.error('Failed to send magic link email to %s: %s', recipient_email, e)
         return False
+    finally:
+        connection.close()
@@ -0,0 +1,181 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import copy
+import functools
+import os
+import threading
+import weakref
+
+from app import logs
+from app.backpressure import UpstreamSaturated
+from app.epos_client import TRANSPORT_SETTINGS, EposNowClient, normalize_email, upstream_limiter
+
+# In-flight lookups per event loop, shared by every client instance on that loop.
+_inflight_by_loop = weakref.WeakKeyDictionary()
+
+
+class _BlockingCalls:
+    """
+    The threads EPOS calls from the event loop run on. There are exactly as many
+    as upstream_limiter can hold (EPOS_MAX_CONCURRENCY running plus EPOS_QUEUE_SIZE
+    waiting), so every call reaches the limiter and its wait deadline at once.
+    A call beyond that is refused with UpstreamSaturated, as the limiter would,
+    instead of queueing unseen in front of it. One pool per process.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._key = None
+        self._active = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _capacity(self):
+        if upstream_limiter.max_concurrency <= 0:
+            return None  # no limit configured; don't add one here
+        return upstream_limiter.max_concurrency + upstream_limiter.max_waiting
+
+    def _get_executor(self, capacity):
+        key = (os.getpid(), capacity)
+        if self._key != key:
+            old = self._executor if self._key is not None and self._key[0] == key[0] else None
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=capacity or 32,
+                                                                   thread_name_prefix='epos-call')
+            self._key, self._active = key, 0
+            self._generation += 1
+            if old is not None:
+                old.shutdown(wait=False)
+        return self._executor
+
+    def _release(self, generation):
+        with self._lock:
+            if generation == self._generation:  # not a call from a pool since replaced
+                self._active -= 1
+
+    def submit(self, func, *args):
+        """Runs func(*args) on the pool with the caller's contextvars (the request ID); returns an asyncio future."""
+        capacity = self._capacity()
+        with self._lock:
+            executor = self._get_executor(capacity)
+            if capacity is not None and self._active >= capacity:
+                upstream_limiter.rejected += 1
+                raise UpstreamSaturated(upstream_limiter.name, upstream_limiter.retry_after)
+            self._active += 1
+        call = functools.partial(contextvars.copy_context().run, func, *args)
+        future = asyncio.get_running_loop().run_in_executor(executor, call)
+        generation = self._generation
+        future.add_done_callback(lambda _: self._release(generation))
+        return future
+
+
+blocking_calls = _BlockingCalls()
+
+
+class AsyncEposNowClient:
+    """
+    Async counterpart of EposNowClient with the same customer methods.
+
+    Calls run on the pooled blocking transport in a worker thread, so they share
+    connections, timeouts, retries and the customer cache with the sync client.
+    Concurrent get_customer_by_email (or get_customer_by_id) calls for the same
+    customer on one event loop share a single upstream request.
+    """
+
+    def __init__(self, client=None, **kwargs):
+        self._client = client or EposNowClient(**kwargs)
+
+    async def get_customer_by_email(self, email, fresh=False):
+        return await self._single_flight(('email', normalize_email(email), fresh),
+                                         self._client.get_customer_by_email, email, fresh)
+
+    async def get_customer_by_id(self, customer_id, fresh_after=None, fresh=False):
+        return await self._single_flight(('id', int(customer_id), fresh_after, fresh),
+                                         self._client.get_customer_by_id, customer_id, fresh_after, fresh)
+
+    async def update_customer(self, data):
+        return await blocking_calls.submit(self._client.update_customer, data)
+
+    async def create_customer(self, data):
+        return await blocking_calls.submit(self._client.create_customer, data)
+
+    async def _single_flight(self, key, func, *args):
+        inflight = _inflight_by_loop.setdefault(asyncio.get_running_loop(), {})
+        future = inflight.get(key)
+        if future is None:
+            future = blocking_calls.submit(func, *args)
+            inflight[key] = future
+            future.add_done_callback(lambda _: inflight.pop(key, None))
+        # Shield so one caller being cancelled doesn't cancel the call for the others,
+        # and copy so callers never share (and mutate) the same record.
+        return copy.deepcopy(await asyncio.shield(future))
+
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def get_background_loop():
+    """The event loop behind CoalescingEposNowClient, one per process (restarted after fork)."""
+    global _loop, _loop_pid
+    pid = os.getpid()
+    if _loop is not None and _loop_pid == pid:
+        return _loop
+    with _loop_lock:
+        if _loop is None or _loop_pid != pid:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='epos-loop', daemon=True).start()
+            _loop, _loop_pid = loop, pid
+        return _loop
+
+
+async def _with_request_id(coro, request_id):
+    # Runs as its own task, so the ID is set in that task's context and copied into the call's thread.
+    logs.request_id_var.set(request_id)
+    return await coro
+
+
+def result_timeout():
+    """The longest a call can legitimately take: the limiter's wait plus every attempt's connect and read timeouts."""
+    attempts = TRANSPORT_SETTINGS['EPOS_MAX_RETRIES'] + 1
+    per_attempt = TRANSPORT_SETTINGS['EPOS_CONNECT_TIMEOUT'] + TRANSPORT_SETTINGS['EPOS_READ_TIMEOUT']
+    return upstream_limiter.timeout + attempts * per_attempt + TRANSPORT_SETTINGS['EPOS_RETRY_BACKOFF'] * 2 ** attempts
+
+
+class CoalescingEposNowClient:
+    """
+    Blocking facade over AsyncEposNowClient for existing sync views. Every call
+    runs on one background loop per process, so identical lookups from concurrent
+    requests (a double click, the dashboard and wallet opening together) are coalesced.
+    Other EposNowClient methods are passed straight through.
+    """
+
+    def __init__(self, **kwargs):
+        self._client = EposNowClient(**kwargs)
+        self._async = AsyncEposNowClient(self._client)
+
+    def _run(self, coro):
+        future = asyncio.run_coroutine_threadsafe(_with_request_id(coro, logs.current_request_id()),
+                                                  get_background_loop())
+        try:
+            return future.result(timeout=result_timeout())
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            upstream_limiter.rejected += 1
+            raise UpstreamSaturated(upstream_limiter.name, upstream_limiter.retry_after)
+
+    def get_customer_by_email(self, email, fresh=False):
+        return self._run(self._async.get_customer_by_email(email, fresh))
+
+    def get_customer_by_id(self, customer_id, fresh_after=None, fresh=False):
+        return self._run(self._async.get_customer_by_id(customer_id, fresh_after, fresh))
+
+    def update_customer(self, data):
+        return self._client.update_customer(data)
+
+    def create_customer(self, data):
+        return self._client.create_customer(data)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Replies that blame a record in the array. Other 4xx (401, 403, 404, 408, 429, ...) are about the
+# request as a whole, so bisecting would only multiply them.
+RECORD_ERRORS = (400, 409, 422)
+
+
+class CustomerBatchWriter:
+    """
+    Accumulates customer updates and creates and sends them to EPOS Now as array
+    requests of up to `batch_size` records. A batch is flushed when it is full,
+    when its oldest record has waited `flush_interval` seconds, or on flush()/close().
+
+    update() and create() return a Future per record that resolves to the record
+    the API returned for it, or raises the error for that record. When EPOS rejects
+    a chunk with a 400, 409 or 422, the chunk is split in half and retried so that
+    only the offending records fail; other errors fail the whole chunk, as does a
+    create response that does not list one record per request.
+
+        with CustomerBatchWriter(EposNowClient()) as writer:
+            futures = [writer.update(record) for record in records]
+        failed = [f for f in futures if f.exception()]
+    """
+
+    def __init__(self, client, batch_size=100, flush_interval=5.0):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.calls = 0
+        self._pending = {'update': [], 'create': []}
+        self._oldest = {'update': None, 'create': None}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._timer = threading.Thread(target=self._flush_on_interval, name='epos-batch', daemon=True)
+        self._timer.start()
+
+    def update(self, record):
+        return self._add('update', record)
+
+    def create(self, record):
+        return self._add('create', record)
+
+    def _add(self, kind, record):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('CustomerBatchWriter is closed.')
+            pending = self._pending[kind]
+            pending.append((record, future))
+            if self._oldest[kind] is None:
+                self._oldest[kind] = time.monotonic()
+                self._wakeup.notify()
+            batch = self._take(kind) if len(pending) >= self.batch_size else None
+        if batch:
+            self._send(kind, batch)
+        return future
+
+    def _take(self, kind):
+        batch, self._pending[kind] = self._pending[kind], []
+        self._oldest[kind] = None
+        return batch
+
+    def flush(self):
+        """Sends everything queued so far."""
+        with self._lock:
+            batches = {kind: self._take(kind) for kind in self._pending}
+        for kind, batch in batches.items():
+            for start in range(0, len(batch), self.batch_size):
+                self._send(kind, batch[start:start + self.batch_size])
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _flush_on_interval(self):
+        while True:
+            due = []
+            with self._lock:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                waits = []
+                for kind, oldest in self._oldest.items():
+                    if oldest is None:
+                        continue
+                    if now - oldest >= self.flush_interval:
+                        due.append((kind, self._take(kind)))
+                    else:
+                        waits.append(self.flush_interval - (now - oldest))
+                if not due:
+                    self._wakeup.wait(timeout=min(waits) if waits else None)
+            for kind, batch in due:
+                self._send(kind, batch)
+
+    def _send(self, kind, batch):
+        records = [record for record, _ in batch]
+        with self._lock:
+            self.calls += 1
+        try:
+            if kind == 'update':
+                results = self.client.update_customers(records)
+            else:
+                results = self.client.create_customers(records)
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status in RECORD_ERRORS and len(batch) > 1:
+                # One bad record rejects the whole array; bisect to isolate it.
+                middle = len(batch) // 2
+                self._send(kind, batch[:middle])
+                self._send(kind, batch[middle:])
+                return
+            self._fail(batch, e)
+            return
+        except Exception as e:
+            self._fail(batch, e)
+            return
+
+        # The API answers with the records in request order.
+        aligned = isinstance(results, list) and len(results) == len(batch)
+        if not aligned and kind == 'create':
+            # Without the created records there are no Ids, so nothing can be reported as created.
+            count = len(results) if isinstance(results, list) else 0
+            self._fail(batch, RuntimeError(f'EPOS returned {count} records for {len(batch)} created customers.'))
+            return
+        for i, (record, future) in enumerate(batch):
+            future.set_result(results[i] if aligned else record)
+
+    def _fail(self, batch, error):
+        logger.error('EPOS batch of %d customer records failed: %s', len(batch), error)
+        for _, future in batch:
+            future.set_exception(error)
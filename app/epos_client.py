@@ -1,54 +1,323 @@
 import os
+import re
+import copy
+import time
+import datetime
+import threading
 import requests
 import logging
 import base64
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from flask import render_template
+
+from app import metrics
+from app.backpressure import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, ConcurrencyLimiter,
+                              UpstreamSaturated, UpstreamUnavailable)
+from app.cache import TTLCache
+from app.customer_mirror import customer_mirror
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://api.eposnowhq.com/api/v4'
+
+# Transport defaults, overridden from the app config by init_app.
+TRANSPORT_SETTINGS = {
+    'EPOS_BASE_URL': DEFAULT_BASE_URL,
+    'EPOS_CONNECT_TIMEOUT': 3.05,
+    'EPOS_READ_TIMEOUT': 10.0,
+    'EPOS_POOL_SIZE': 10,
+    'EPOS_MAX_RETRIES': 2,
+    'EPOS_RETRY_BACKOFF': 0.3,
+}
+
+_transport_lock = threading.Lock()
+_transport = None
+_transport_pid = None
+
+# Customer records keyed by normalized email, shared by every client in the process.
+customer_cache = TTLCache(maxsize=1024, ttl=60, stale_ttl=300)
+
+# Bounds the EPOS calls in flight per process so a slow API cannot occupy every worker thread.
+upstream_limiter = ConcurrencyLimiter('EPOS Now')
+
+EPOS_CIRCUIT_TRANSITIONS = metrics.Counter('loyalty_epos_circuit_transitions_total',
+                                           'EPOS circuit breaker state changes.', ('from_state', 'to_state'))
+
+
+def _circuit_transition(old, new):
+    EPOS_CIRCUIT_TRANSITIONS.inc(from_state=old, to_state=new)
+    log = logger.info if new == CLOSED else logger.warning
+    log('EPOS Now circuit %s -> %s', old, new, extra={'event': 'epos.circuit'})
+
+
+# Fails EPOS calls fast while the API is down or too slow, for every client in the process.
+upstream_circuit = CircuitBreaker('EPOS Now', on_transition=_circuit_transition)
+
+metrics.Gauge('loyalty_epos_circuit_state', 'EPOS circuit breaker state (1 for the current state).', ('state',),
+              collect=lambda: {(state,): int(upstream_circuit.state == state) for state in (CLOSED, OPEN, HALF_OPEN)})
+
+metrics.Gauge('loyalty_epos_concurrency', 'EPOS calls in flight, queued, and rejected for saturation.', ('stat',),
+              collect=lambda: {(name,): value for name, value in upstream_limiter.stats().items()})
+
+metrics.Gauge('loyalty_customer_cache', 'Customer cache size and hit/miss counters.', ('stat',),
+              collect=lambda: {(name,): value for name, value in customer_cache.stats().items()})
+
+
+def init_app(app):
+    """Applies the EPOS transport and customer cache settings from the Flask config."""
+    configure_transport(**{name: app.config.get(name) for name in TRANSPORT_SETTINGS})
+    customer_cache.configure(
+        maxsize=app.config.get('CUSTOMER_CACHE_SIZE'),
+        ttl=app.config.get('CUSTOMER_CACHE_TTL'),
+        stale_ttl=app.config.get('CUSTOMER_CACHE_STALE_TTL'),
+    )
+    upstream_limiter.configure(
+        max_concurrency=app.config.get('EPOS_MAX_CONCURRENCY'),
+        max_waiting=app.config.get('EPOS_QUEUE_SIZE'),
+        timeout=app.config.get('EPOS_QUEUE_TIMEOUT'),
+        retry_after=app.config.get('EPOS_RETRY_AFTER'),
+    )
+    upstream_circuit.configure(
+        enabled=app.config.get('EPOS_CIRCUIT_ENABLED'),
+        failure_rate=app.config.get('EPOS_CIRCUIT_FAILURE_RATE'),
+        slow_call_seconds=app.config.get('EPOS_CIRCUIT_SLOW_CALL_SECONDS'),
+        slow_call_rate=app.config.get('EPOS_CIRCUIT_SLOW_CALL_RATE'),
+        min_calls=app.config.get('EPOS_CIRCUIT_MIN_CALLS'),
+        window=app.config.get('EPOS_CIRCUIT_WINDOW'),
+        open_seconds=app.config.get('EPOS_CIRCUIT_OPEN_SECONDS'),
+        half_open_probes=app.config.get('EPOS_CIRCUIT_HALF_OPEN_PROBES'),
+    )
+    app.register_error_handler(UpstreamUnavailable, _unavailable_response)
+
+
+def _unavailable_response(error):
+    logger.warning('Shedding request: %s', error, extra={'event': 'epos.unavailable'})
+    return (render_template('degraded.html', outage=isinstance(error, CircuitOpen)), 503,
+            {'Retry-After': str(int(error.retry_after))})
+
+
+def upstream_available():
+    """False while the circuit is open, i.e. EPOS calls are being failed fast."""
+    return upstream_circuit.state != OPEN
+
+
+def _is_failure(status):
+    # Client errors (404, 400) are answers, not outages; throttling is treated as an outage.
+    return status == 'error' or status == 429 or status >= 500
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def _id_key(customer_id):
+    # Tuples never collide with the email keys sharing the cache.
+    return ('id', int(customer_id))
+
+
+def configure_transport(**settings):
+    """Updates the transport settings; unset (None) values keep their defaults."""
+    for name, value in settings.items():
+        if name not in TRANSPORT_SETTINGS:
+            raise KeyError(f'Unknown EPOS transport setting: {name}')
+        if value is not None:
+            TRANSPORT_SETTINGS[name] = value
+    reset_transport()
+
+
+def reset_transport():
+    """Closes the shared session so the next request builds a fresh pool."""
+    global _transport, _transport_pid
+    with _transport_lock:
+        if _transport is not None:
+            _transport.close()
+        _transport = None
+        _transport_pid = None
+
+
+def get_transport():
+    """
+    Returns the process-wide pooled session used for all EPOS Now calls.
+    The session is rebuilt after a fork so gunicorn workers never share sockets.
+    """
+    global _transport, _transport_pid
+    pid = os.getpid()
+    if _transport is not None and _transport_pid == pid:
+        return _transport
+    with _transport_lock:
+        if _transport is None or _transport_pid != pid:
+            _transport = _build_session()
+            _transport_pid = pid
+        return _transport
+
+
+def _build_session():
+    # Only idempotent GETs are retried; a replayed PUT/POST could duplicate writes.
+    retry = Retry(
+        total=TRANSPORT_SETTINGS['EPOS_MAX_RETRIES'],
+        backoff_factor=TRANSPORT_SETTINGS['EPOS_RETRY_BACKOFF'],
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=TRANSPORT_SETTINGS['EPOS_POOL_SIZE'],
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Content-Type': 'application/json'})
+    return session
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class EposNowClient:
-    def __init__(self, api_key=None, api_secret=None):
+    def __init__(self, api_key=None, api_secret=None, base_url=None):
         self.api_key = api_key or os.environ.get('EPOS_API_KEY')
         self.api_secret = api_secret or os.environ.get('EPOS_API_SECRET')
-        self.base_url = 'https://api.eposnowhq.com/api/v4'
+        self.base_url = base_url or TRANSPORT_SETTINGS['EPOS_BASE_URL']
         self.access_token = self._generate_access_token()
+        self.headers = {'Authorization': f'Basic {self.access_token}'}
+        self.timeout = (TRANSPORT_SETTINGS['EPOS_CONNECT_TIMEOUT'], TRANSPORT_SETTINGS['EPOS_READ_TIMEOUT'])
 
     def _generate_access_token(self):
         if not self.api_key or not self.api_secret:
-            logging.error('EPOS Now API key or secret not configured.')
+            logger.error('EPOS Now API key or secret not configured.')
             raise ValueError('EPOS Now API credentials are not set.')
-        
+
         token_string = f"{self.api_key}:{self.api_secret}"
         return base64.b64encode(token_string.encode('utf-8')).decode('utf-8')
 
     def _make_request(self, method, endpoint, **kwargs):
-        headers = {
-            'Authorization': f'Basic {self.access_token}',
-            'Content-Type': 'application/json'
-        }
         url = f'{self.base_url}/{endpoint}'
+        kwargs.setdefault('timeout', self.timeout)
+        # Label by route shape (Customer/{id}), not by the id itself.
+        endpoint_label = re.sub(r'/\d+', '/{id}', endpoint)
+        start = time.perf_counter()
+        sent = None
+        status = 'error'
         try:
-            response = requests.request(method, url, headers=headers, **kwargs)
+            upstream_circuit.before_call()
+            with upstream_limiter.slot():
+                sent = time.perf_counter()
+                response = get_transport().request(method, url, headers=self.headers, **kwargs)
+            status = response.status_code
             response.raise_for_status()
             if response.status_code == 204 or not response.content:
                 return None
             return response.json()
         except requests.exceptions.HTTPError as e:
-            logging.error(f'HTTP error calling EPOS Now API: {e.response.status_code} {e.response.text}')
+            logger.error('HTTP error calling EPOS Now API: %s %s', e.response.status_code, e.response.text)
             raise
         except requests.exceptions.RequestException as e:
-            logging.error(f'Error calling EPOS Now API: {e}')
+            logger.error('Error calling EPOS Now API: %s', e)
+            raise
+        except CircuitOpen:
+            status = 'circuit_open'
             raise
+        except UpstreamSaturated:
+            status = 'saturated'
+            upstream_circuit.cancel()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if sent is not None:
+                upstream_circuit.record(_is_failure(status), time.perf_counter() - sent)
+            metrics.EPOS_REQUEST_SECONDS.observe(elapsed, method=method, endpoint=endpoint_label, status=status)
+            logger.info('EPOS %s %s -> %s in %.3fs', method, endpoint_label, status, elapsed,
+                        extra={'event': 'epos.request'})
+
+    def get_customer_by_email(self, email, fresh=False):
+        """
+        Fetches a customer by their email address.
+        Served from the customer cache when possible; a stale entry is returned
+        immediately and revalidated in the background. On a cache miss the local
+        customer mirror is tried before calling EPOS Now. With `fresh`, both are
+        skipped: callers that write the record back must not start from a stale copy.
+        """
+        key = normalize_email(email)
+        return self._get_cached(key, lambda: customer_mirror.lookup(key), lambda: self._fetch_customer_by_email(key),
+                                fresh=fresh)
+
+    def get_customer_by_id(self, customer_id, fresh_after=None, fresh=False):
+        """
+        Fetches a customer by their EPOS Id, or None if there is no such customer.
+        Cached like get_customer_by_email. A record fetched before `fresh_after`
+        (a time.time() timestamp, e.g. when the profile was last saved) is
+        refetched from EPOS Now.
+        """
+        customer_id = int(customer_id)
+        return self._get_cached(_id_key(customer_id), lambda: customer_mirror.lookup_id(customer_id),
+                                lambda: self.fetch_customer_by_id(customer_id), fresh_after, fresh)
+
+    def _get_cached(self, key, mirrored, fetch, fresh_after=None, fresh=False):
+        if not fresh:
+            customer, is_stale = customer_cache.lookup(key)
+            if customer is not None and (fresh_after is None or self._stored_at(key).timestamp() >= fresh_after):
+                if is_stale and customer_cache.begin_refresh(key):
+                    threading.Thread(target=self._revalidate, args=(key, fetch), daemon=True).start()
+                return copy.deepcopy(customer)
+
+        # Skip the mirror too when the caller needs something newer than the cache holds.
+        customer, age = mirrored() if fresh_after is None and not fresh else (None, None)
+        if customer is not None:
+            # Cached as old as the mirror row, so fetched_at reports when it was really synced.
+            self._remember(customer, age)
+            return copy.deepcopy(customer)
+
+        customer = fetch()
+        self._remember(customer)
+        customer_mirror.store([customer])
+        return copy.deepcopy(customer)
 
-    def get_customer_by_email(self, email):
-        """Fetches a customer by their email address."""
+    def fetched_at(self, email=None, customer_id=None):
+        """
+        When the customer record served for `email` or `customer_id` was fetched
+        from EPOS Now, as a local datetime. Records not held in the cache were
+        fetched just now.
+        """
+        return self._stored_at(normalize_email(email) if customer_id is None else _id_key(customer_id))
+
+    def _stored_at(self, key):
+        stored_at = customer_cache.stored_at(key)
+        now = datetime.datetime.now()
+        if stored_at is None:
+            return now
+        return now - datetime.timedelta(seconds=max(0.0, time.monotonic() - stored_at))
+
+    def _revalidate(self, key, fetch):
+        try:
+            customer = fetch()
+            if customer:
+                self._remember(customer)
+                customer_mirror.store([customer])
+            else:
+                customer_cache.delete(key)
+        except Exception as e:
+            logger.warning('Background refresh of cached customer failed: %s', e)
+        finally:
+            customer_cache.end_refresh(key)
+
+    def _remember(self, customer, age=0.0):
+        """Caches a record, fetched `age` seconds ago, under both its email and its Id."""
+        if not isinstance(customer, dict):
+            return
+        if customer.get('EmailAddress'):
+            customer_cache.set(normalize_email(customer['EmailAddress']), copy.deepcopy(customer), age)
+        if customer.get('Id') is not None:
+            customer_cache.set(_id_key(customer['Id']), copy.deepcopy(customer), age)
+
+    def _fetch_customer_by_email(self, email):
         endpoint = 'Customer/GetByEmail'
         try:
             # The API might return a list or a single object. Let's assume a list.
             customers = self._make_request(
                 'GET',
                 endpoint,
-                params={'email': email}   # 👈 THIS is the key change
+                params={'email': email}
             )
 
             if not customers:
@@ -65,31 +334,80 @@ class EposNowClient:
         """
         Updates a customer's details. The API requires the full customer object.
         The API expects an array of customers for this endpoint.
+        Returns the saved record, as echoed back by the API when it does.
         """
-        endpoint = 'Customer'
         try:
             # The API expects a list of customers, even for a single update.
-            return self._make_request('PUT', endpoint, json=[data])
+            response_data = self.update_customers([data])
+            if isinstance(response_data, list) and len(response_data) == 1:
+                return response_data[0]
+            return data
         except Exception as e:
             customer_id = data.get('Id', 'N/A')
-            logging.error(f'Failed to update customer {customer_id}: {e}')
+            logger.error('Failed to update customer %s: %s', customer_id, e)
             raise
 
+    def update_customers(self, records):
+        """
+        Updates several customers in one PUT and returns the API's response list.
+        Each record must be a full customer object.
+        """
+        endpoint = 'Customer'
+        try:
+            response_data = self._make_request('PUT', endpoint, json=list(records))
+        except Exception:
+            for record in records:
+                customer_cache.delete(normalize_email(record.get('EmailAddress')))
+                if record.get('Id') is not None:
+                    customer_cache.delete(_id_key(record['Id']))
+            customer_mirror.forget([record.get('EmailAddress') for record in records])
+            raise
+        # Write through: prefer the records echoed back by the API over what we sent.
+        if isinstance(response_data, list) and len(response_data) == len(records):
+            saved = response_data
+        else:
+            saved = records
+        for record in saved:
+            self._remember(record)
+        customer_mirror.store(saved)
+        return response_data
+
     def create_customer(self, data):
         """
         Creates a new customer.
         The EPOS Now API expects an array of customers for this endpoint.
         """
-        endpoint = 'Customer'
         try:
             # The API expects a list of customers, even for a single creation.
-            response_data = self._make_request('POST', endpoint, json=[data])
+            created = self.create_customers([data])
             # The response is also a list containing the created customer(s).
-            if response_data and isinstance(response_data, list):
-                return response_data[0]
-            return None
+            return created[0] if created else None
         except Exception as e:
-            logging.error(f'Failed to create customer: {e}')
+            logger.error('Failed to create customer: %s', e)
             raise
 
+    def create_customers(self, records):
+        """Creates several customers in one POST and returns the created records."""
+        endpoint = 'Customer'
+        response_data = self._make_request('POST', endpoint, json=list(records))
+        if not response_data or not isinstance(response_data, list):
+            return []
+        for record in response_data:
+            self._remember(record)
+        customer_mirror.store(response_data)
+        return response_data
+
+    def fetch_customer_by_id(self, customer_id):
+        """Fetches a customer by their EPOS Id straight from EPOS Now, bypassing the cache and mirror."""
+        try:
+            return self._make_request('GET', f'Customer/{int(customer_id)}')
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 404:
+                return None
+            raise
+
+    def list_customers(self, page=1):
+        """Returns one page of all customers, in Id order; an empty list past the last page."""
+        return self._make_request('GET', 'Customer', params={'page': page}) or []
+
 
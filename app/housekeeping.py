@@ -0,0 +1,137 @@
+import datetime
+import logging
+import os
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app import db
+from app.models import MagicLinkToken, MirroredCustomer, RateLimit, UsedToken, UserAgent, user_agent_ids
+
+logger = logging.getLogger(__name__)
+
+
+def _purge_in_batches(model, condition, batch_size, key=None):
+    """
+    Deletes matching rows `batch_size` at a time, committing after each batch so
+    no single transaction holds the table lock for long. Returns the rows deleted.
+    """
+    key = model.id if key is None else key
+    deleted = 0
+    while True:
+        ids = [row[0] for row in db.session.query(key).filter(condition).limit(batch_size)]
+        if not ids:
+            return deleted
+        db.session.query(model).filter(key.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+
+
+def purge_magic_link_tokens(retention_seconds, batch_size):
+    """Removes tokens that expired, or were used, more than `retention_seconds` ago."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=retention_seconds)
+    # Two purges rather than one OR, which SQLite answers with a full scan for every batch.
+    expired = _purge_in_batches(MagicLinkToken, MagicLinkToken.expires_at < cutoff, batch_size)
+    return expired + _purge_in_batches(MagicLinkToken, MagicLinkToken.used_at < cutoff, batch_size)
+
+
+def purge_used_tokens(batch_size):
+    """Removes redeemed signed tokens once they have expired and can no longer be replayed."""
+    return _purge_in_batches(UsedToken, UsedToken.expires_at < datetime.datetime.utcnow(), batch_size,
+                             key=UsedToken.token_digest)
+
+
+def purge_rate_limits(max_period_seconds, batch_size):
+    """Removes rate-limit windows too old to affect any check."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_period_seconds)
+    return _purge_in_batches(RateLimit, RateLimit.window_start < cutoff, batch_size)
+
+
+def purge_user_agents(batch_size):
+    """Removes user agents no remaining token refers to."""
+    referenced = db.exists().where(MagicLinkToken.user_agent_id == UserAgent.id)
+    deleted = _purge_in_batches(UserAgent, ~referenced, batch_size)
+    if deleted:
+        user_agent_ids.clear()
+    return deleted
+
+
+def ensure_indexes():
+    """Creates indexes declared on the models that an older database is missing."""
+    for table in (MagicLinkToken.__table__, RateLimit.__table__, UsedToken.__table__, MirroredCustomer.__table__,
+                  UserAgent.__table__):
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
+def run_housekeeping(config):
+    """Runs every purge and returns the rows reclaimed per table plus the time taken."""
+    start = time.monotonic()
+    batch_size = config['HOUSEKEEPING_BATCH_SIZE']
+    stats = {
+        'magic_link_tokens': purge_magic_link_tokens(config['HOUSEKEEPING_TOKEN_RETENTION'], batch_size),
+        'rate_limits': purge_rate_limits(config['HOUSEKEEPING_RATE_LIMIT_RETENTION'], batch_size),
+        'used_tokens': purge_used_tokens(batch_size),
+    }
+    stats['user_agents'] = purge_user_agents(batch_size)  # after the tokens that referenced them
+    stats['seconds'] = round(time.monotonic() - start, 3)
+    logger.info('Housekeeping reclaimed %s', stats)
+    return stats
+
+
+@click.command('housekeeping')
+@click.option('--batch-size', type=int, default=None, help='Rows deleted per transaction.')
+@with_appcontext
+def housekeeping_command(batch_size):
+    """Purge expired magic-link tokens, redeemed signed tokens and stale rate-limit windows."""
+    config = dict(current_app.config)
+    if batch_size:
+        config['HOUSEKEEPING_BATCH_SIZE'] = batch_size
+    ensure_indexes()
+    stats = run_housekeeping(config)
+    click.echo(f"Deleted {stats['magic_link_tokens']} magic link tokens, {stats['used_tokens']} used signed tokens "
+               f"and {stats['rate_limits']} rate limit windows, plus {stats['user_agents']} unused user agents, "
+               f"in {stats['seconds']}s.")
+
+
+class Scheduler:
+    """Runs housekeeping every HOUSEKEEPING_INTERVAL seconds on a daemon thread in each worker."""
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config['HOUSEKEEPING_INTERVAL']
+        self.last_stats = None
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            # Started on first request rather than at import so forked workers each get one.
+            if self._thread_pid != pid:
+                self._thread = threading.Thread(target=self._run, name='housekeeping', daemon=True)
+                self._thread.start()
+                self._thread_pid = pid
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.last_stats = run_housekeeping(self.app.config)
+            except Exception as e:
+                logger.error('Scheduled housekeeping failed: %s', e)
+
+
+def init_app(app):
+    app.cli.add_command(housekeeping_command)
+    if app.config['HOUSEKEEPING_INTERVAL'] > 0:
+        scheduler = Scheduler(app)
+        app.extensions['housekeeping'] = scheduler
+        app.before_request(scheduler.ensure_started)
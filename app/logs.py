@@ -0,0 +1,228 @@
+"""
+Non-blocking, structured logging.
+
+Log calls only filter the record and put it on a bounded queue; a listener
+thread per process does the formatting (JSON or text), redaction and I/O. If
+the queue is full, records are dropped and counted rather than blocking the request.
+
+Records carry the current request ID (from X-Request-ID, or generated), and
+high-volume events can be sampled by tagging them:
+
+    logger.info('EPOS %s %s -> %s', method, endpoint, status, extra={'event': 'epos.request'})
+
+with LOG_SAMPLE_RATES='epos.request=0.1' keeping one in ten.
+"""
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+from app import metrics
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_VALID_REQUEST_ID = re.compile(r'^[\w.-]{1,64}$')
+
+# Carries the request ID to threads and event loops working on a request's behalf,
+# which have no Flask request context of their own.
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+EMAIL_RE = re.compile(r'([\w.+-])[\w.+-]*@([\w-]+(?:\.[\w-]+)+)')
+TOKEN_URL_RE = re.compile(r'(/login/verify/)[^\s\'"?#]+')
+SECRET_RE = re.compile(r'(?i)\b(token|secret|password|authorization)(["\']?\s*[:=]\s*["\']?)[^\s,"\'}]+')
+
+# Attributes every LogRecord has; anything else came in through `extra`.
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+LOG_RECORDS_DROPPED = metrics.Counter('loyalty_log_records_dropped_total', 'Log records dropped because the queue was full.')
+
+
+def redact(text):
+    """Masks email addresses, magic-link tokens and secret-looking values."""
+    text = TOKEN_URL_RE.sub(r'\1[redacted]', text)
+    text = SECRET_RE.sub(r'\1\2[redacted]', text)
+    return EMAIL_RE.sub(r'\1***@\2', text)
+
+
+def parse_sample_rates(value):
+    """Parses 'event=rate,event=rate' into a dict."""
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, rate = item.split('=', 1)
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """Runs on the calling thread: stamps the request ID and drops sampled-out events."""
+
+    def __init__(self, sample_rates=None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+
+    def filter(self, record):
+        rate = self.sample_rates.get(getattr(record, 'event', None))
+        if rate is not None and random.random() >= rate:
+            return False
+        if not hasattr(record, 'request_id'):
+            record.request_id = current_request_id()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def __init__(self, redact_values=True):
+        super().__init__()
+        self.redact_values = redact_values
+
+    def format(self, record):
+        clean = self.redact_values and not getattr(record, 'unredacted', False)
+        message = record.getMessage()
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact(message) if clean else message,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS and name != 'unredacted' and value is not None:
+                entry[name] = redact(str(value)) if clean and isinstance(value, str) else value
+        text = record.exc_text or (self.formatException(record.exc_info) if record.exc_info else None)
+        if text:
+            entry['exception'] = redact(text) if clean else text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, redact_values=True):
+        super().__init__('%(asctime)s - %(levelname)s - %(request_id)s - %(name)s - %(message)s')
+        self.redact_values = redact_values
+
+    def format(self, record):
+        if not hasattr(record, 'request_id') or record.request_id is None:
+            record.request_id = '-'
+        text = super().format(record)
+        if self.redact_values and not getattr(record, 'unredacted', False):
+            return redact(text)
+        return text
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Block rather than raise when the queue is full: the thread is draining it.
+        self.queue.put(self._sentinel)
+
+
+class AsyncHandler(QueueHandler):
+    """
+    Queues records for a listener thread that writes them with `target`. The
+    queue and listener are created per process, so gunicorn workers forked from
+    a preloaded master start their own.
+    """
+
+    def __init__(self, target, maxsize=10000):
+        super().__init__(None)
+        self.target = target
+        self.maxsize = maxsize
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid != pid:
+                self.queue = queue.Queue(self.maxsize)
+                self.listener = _Listener(self.queue, self.target, respect_handler_level=True)
+                self.listener.start()
+                self._pid = pid
+
+    def prepare(self, record):
+        # Unlike QueueHandler.prepare, leave msg % args to the listener thread.
+        # Exceptions are rendered now, while the traceback is still live.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    def flush(self):
+        """Waits until everything queued so far has been written."""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener.start()
+
+    def close(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self._pid = None
+        super().close()
+
+
+def current_request_id():
+    return g.get('request_id') if has_request_context() else request_id_var.get()
+
+
+def _assign_request_id():
+    incoming = request.headers.get(REQUEST_ID_HEADER, '')
+    g.request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+
+
+def _echo_request_id(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers[REQUEST_ID_HEADER] = request_id
+    return response
+
+
+_handler = None
+
+
+def configure_logging(config, stream=None):
+    """Installs the async handler on the root logger, replacing one installed earlier."""
+    global _handler
+    formatter_class = JSONFormatter if config['LOG_FORMAT'] == 'json' else TextFormatter
+    target = logging.StreamHandler(stream or sys.stderr)
+    target.setFormatter(formatter_class(redact_values=config['LOG_REDACT']))
+
+    handler = AsyncHandler(target, maxsize=config['LOG_QUEUE_SIZE'])
+    handler.addFilter(ContextFilter(parse_sample_rates(config['LOG_SAMPLE_RATES'])))
+
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+        _handler.close()
+    root.addHandler(handler)
+    root.setLevel(config['LOG_LEVEL'])
+    _handler = handler
+    return handler
+
+
+@atexit.register
+def _flush_at_exit():
+    if _handler is not None:
+        _handler.close()
+
+
+def init_app(app):
+    configure_logging(app.config)
+    app.before_request(_assign_request_id)
+    app.after_request(_echo_request_id)
@@ -0,0 +1,83 @@
+"""
+Stateless magic-link tokens, used when MAGIC_LINK_MODE is 'signed'.
+
+A token is `<payload>.<mac>`: the payload carries the expiry and the email, and
+the MAC is an HMAC-SHA256 over it keyed from SECRET_KEY. Issuing one touches no
+table. Redeeming one inserts its digest into UsedToken; the primary key makes
+that insert the atomic single-use check.
+"""
+import base64
+import binascii
+import datetime
+import hashlib
+import hmac
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import UsedToken
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _signing_key(secret_key):
+    # Derived, so a MAC over a token can never double as any other use of SECRET_KEY.
+    return hmac.new(str(secret_key).encode('utf-8'), b'magic-link-token', hashlib.sha256).digest()
+
+
+def _mac(secret_key, payload):
+    return _b64encode(hmac.new(_signing_key(secret_key), payload.encode('ascii'), hashlib.sha256).digest())
+
+
+def token_digest(token):
+    """The raw 32-byte sha256 stored for a token; half the size of its hex form, in the row and the index."""
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+
+def is_signed_token(token):
+    """Database tokens are plain token_urlsafe strings and never contain a '.'."""
+    return '.' in token
+
+
+def issue_token(email, expires_in_seconds, secret_key):
+    expires = int(time.time()) + int(expires_in_seconds)
+    payload = _b64encode(f'{expires}:{email}'.encode('utf-8'))
+    return f'{payload}.{_mac(secret_key, payload)}'
+
+
+def read_token(token, secret_key):
+    """Returns (email, expires_at) for an authentic, unexpired token, otherwise None."""
+    payload, _, mac = token.partition('.')
+    try:
+        # Bytes, since compare_digest rejects non-ASCII str; a link may carry anything after /verify/.
+        if not payload or not hmac.compare_digest(mac.encode('utf-8'), _mac(secret_key, payload).encode('ascii')):
+            return None
+        expires, _, email = _b64decode(payload).decode('utf-8').partition(':')
+        expires = int(expires)
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        return None
+    if not email or expires <= time.time():
+        return None
+    return email, datetime.datetime.utcfromtimestamp(expires)
+
+
+def redeem_token(token, secret_key):
+    """Checks a signed token and marks it used in one step. Returns the email, or None if invalid or already used."""
+    claims = read_token(token, secret_key)
+    if claims is None:
+        return None
+    email, expires_at = claims
+    db.session.add(UsedToken(token_digest=token_digest(token), expires_at=expires_at))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return None
+    return email
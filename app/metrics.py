@@ -0,0 +1,351 @@
+"""
+Process-local metrics exposed in the Prometheus text format at /metrics.
+
+Under gunicorn each worker has its own registry. When METRICS_DIR is set, every
+worker periodically writes a snapshot of its registry to that directory, and the
+worker answering /metrics merges all snapshots, so a scrape sees the whole pool.
+Counters and histograms are summed; gauges are summed as well (e.g. queue depth
+across workers). A worker's snapshot is removed when it exits (gunicorn's
+child_exit hook), and snapshots not refreshed for STALE_INTERVALS flush
+intervals are ignored, so dead workers never linger in the totals.
+
+/metrics answers only requests carrying `Authorization: Bearer <METRICS_TOKEN>`;
+without a token configured it is served in debug and testing only.
+"""
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, g, request, abort, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._values.items()]
+        return {'type': self.type, 'help': self.documentation, 'labelnames': list(self.labelnames),
+                'samples': samples}
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A gauge set directly, or computed at snapshot time by `collect` (returns {labels tuple: value})."""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def snapshot(self):
+        if self.collect is not None:
+            values = self.collect()
+            with self._lock:
+                self._values = {tuple(str(v) for v in key): value for key, value in values.items()}
+        return super().snapshot()
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def snapshot(self):
+        data = super().snapshot()
+        data['buckets'] = list(self.buckets)
+        return data
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+# --- Hot-path metrics -------------------------------------------------------
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'loyalty_http_request_duration_seconds', 'Time spent handling a request.', ('endpoint', 'method', 'status'))
+EPOS_REQUEST_SECONDS = Histogram(
+    'loyalty_epos_request_duration_seconds', 'EPOS Now API call latency.', ('method', 'endpoint', 'status'))
+SMTP_SEND_SECONDS = Histogram(
+    'loyalty_smtp_send_duration_seconds', 'Time to hand one message to the SMTP server.', ('outcome',))
+DB_QUERIES_PER_REQUEST = Histogram(
+    'loyalty_db_queries_per_request', 'SQL statements executed per request.', ('endpoint',), buckets=COUNT_BUCKETS)
+DB_QUERY_SECONDS_PER_REQUEST = Histogram(
+    'loyalty_db_query_duration_seconds_per_request', 'Total SQL time per request.', ('endpoint',))
+CODE_RENDER_SECONDS = Histogram(
+    'loyalty_code_render_duration_seconds', 'Loyalty code render time (cache misses).', ('symbology', 'format'))
+PASS_BUILD_SECONDS = Histogram('loyalty_pass_build_duration_seconds', 'Signed wallet pass build time (cache misses).')
+
+
+# --- Multi-worker snapshots ---------------------------------------------------
+
+# Snapshots older than this many flush intervals belong to workers that are gone.
+STALE_INTERVALS = 5
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f'metrics_{pid}.json')
+
+
+def write_snapshot(directory):
+    """Atomically writes this process's registry to `directory`."""
+    path = _snapshot_path(directory, os.getpid())
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(REGISTRY.snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def remove_snapshot(directory, pid):
+    """Deletes an exited worker's snapshot; called from gunicorn's child_exit hook."""
+    try:
+        os.unlink(_snapshot_path(directory, pid))
+    except FileNotFoundError:
+        pass
+
+
+def merged_snapshot(directory, max_age=None):
+    """Merges every worker snapshot in `directory` written within `max_age` seconds into one."""
+    merged = {}
+    now = time.time()
+    for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+        try:
+            if max_age is not None and now - os.path.getmtime(path) > max_age:
+                continue  # a worker that exited without its snapshot being removed
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue  # a worker is mid-write or has just been removed
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for labels, value in metric['samples']:
+                key = tuple(labels)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = value
+                elif metric['type'] == 'histogram':
+                    target['samples'][key] = [[a + b for a, b in zip(current[0], value[0])],
+                                              current[1] + value[1], current[2] + value[2]]
+                else:
+                    target['samples'][key] = current + value
+    for metric in merged.values():
+        metric['samples'] = [[list(key), value] for key, value in metric['samples'].items()]
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _le(bound):
+    return f'le="{bound}"'
+
+
+def render_text(snapshot):
+    lines = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        names = metric['labelnames']
+        for values, value in sorted(metric['samples'], key=lambda s: s[0]):
+            if metric['type'] == 'histogram':
+                counts, total, count = value
+                for bound, bucket_count in zip(metric['buckets'], counts):
+                    lines.append(f'{name}_bucket{_labels(names, values, _le(bound))} {bucket_count}')
+                lines.append(f"{name}_bucket{_labels(names, values, _le('+Inf'))} {count}")
+                lines.append(f'{name}_sum{_labels(names, values)} {total}')
+                lines.append(f'{name}_count{_labels(names, values)} {count}')
+            else:
+                lines.append(f'{name}{_labels(names, values)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- Flask integration --------------------------------------------------------
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token and not (current_app.debug or current_app.testing):
+        abort(404)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    directory = current_app.config.get('METRICS_DIR')
+    if directory:
+        write_snapshot(directory)
+        snapshot = merged_snapshot(directory, STALE_INTERVALS * current_app.config['METRICS_FLUSH_INTERVAL'])
+    else:
+        snapshot = REGISTRY.snapshot()
+    return Response(render_text(snapshot), mimetype='text/plain; version=0.0.4')
+
+
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_query_seconds = 0.0
+
+
+def _record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    endpoint = request.endpoint or 'unknown'
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint,
+                                 method=request.method, status=response.status_code)
+    DB_QUERIES_PER_REQUEST.observe(g.get('db_queries', 0), endpoint=endpoint)
+    DB_QUERY_SECONDS_PER_REQUEST.observe(g.get('db_query_seconds', 0.0), endpoint=endpoint)
+    return response
+
+
+class Flusher:
+    """
+    Writes this worker's snapshot every METRICS_FLUSH_INTERVAL seconds on a daemon
+    thread, so an idle worker's snapshot stays fresh and is not taken for a dead one.
+    """
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            # Started on first request rather than at import so forked workers each get one.
+            if self._thread_pid != pid:
+                threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+                self._thread_pid = pid
+
+    def _run(self):
+        while True:
+            try:
+                write_snapshot(self.directory)
+            except OSError:
+                pass  # the directory is gone; the next scrape's write will say so
+            time.sleep(self.interval)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+    if has_request_context() and 'metrics_start' in g:
+        g.db_queries += 1
+        g.db_query_seconds += elapsed
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute is skipped when a statement raises; drop its start time.
+    connection = exception_context.connection
+    starts = connection.info.get('metrics_query_start') if connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def init_app(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    directory = app.config.get('METRICS_DIR')
+    app.register_blueprint(bp)
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        flusher = Flusher(directory, app.config['METRICS_FLUSH_INTERVAL'])
+        app.extensions['metrics_flusher'] = flusher
+        app.before_request(flusher.ensure_started)
+
+    # Listen on the Engine class so every engine is counted, however it is created.
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
@@ -0,0 +1,143 @@
+"""
+In-place upgrades for databases created with an older schema.
+
+Each step reads the live schema first, so running again is a no-op. They run
+from create_schema, i.e. `flask init-db` or a boot with AUTO_CREATE_SCHEMA.
+
+- magic_link_token: hex `token_hash` becomes a binary `token_digest`, and the
+  inline `user_agent` string becomes a reference into user_agent.
+- used_token: hex `token_digest` becomes binary.
+- rate_limit: the (key) index of the original schema and the (key, window_start)
+  one are replaced by the covering (key, window_start, count) one, which
+  ensure_indexes creates.
+
+A table is rebuilt by renaming it aside, creating the new one and copying rows
+over in batches, all in one transaction, so a failed upgrade leaves the old
+table as it was.
+"""
+import logging
+import time
+
+from sqlalchemy import MetaData, String, Table, inspect, select, text
+
+from app import db
+from app.models import MagicLinkToken, UsedToken, UserAgent
+
+logger = logging.getLogger(__name__)
+
+OBSOLETE_INDEXES = {'rate_limit': ['ix_rate_limit_key', 'ix_rate_limit_key_window_start']}
+
+
+def _hex_to_digest(value):
+    try:
+        digest = bytes.fromhex(value)
+    except (TypeError, ValueError):
+        return None
+    return digest if len(digest) == 32 else None
+
+
+class _UserAgentIds:
+    """Looks up or inserts user_agent rows on the migration's connection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        table = UserAgent.__table__
+        self.ids = {value: id for id, value in connection.execute(select(table.c.id, table.c.value))}
+
+    def __call__(self, value):
+        value = (value or '')[:200]
+        if value not in self.ids:
+            result = self.connection.execute(UserAgent.__table__.insert().values(value=value))
+            self.ids[value] = result.inserted_primary_key[0]
+        return self.ids[value]
+
+
+def _magic_link_token_rows(connection):
+    user_agent_id = _UserAgentIds(connection)
+
+    def convert(row):
+        digest = _hex_to_digest(row['token_hash'])
+        if digest is None:
+            return None  # not a sha256 hex digest, so no link could ever match it
+        return {'id': row['id'], 'email': row['email'], 'token_digest': digest, 'created_at': row['created_at'],
+                'expires_at': row['expires_at'], 'used_at': row['used_at'], 'request_ip': row['request_ip'],
+                'user_agent_id': user_agent_id(row['user_agent'])}
+    return convert
+
+
+def _used_token_rows(connection):
+    def convert(row):
+        digest = _hex_to_digest(row['token_digest'])
+        return None if digest is None else {'token_digest': digest, 'expires_at': row['expires_at']}
+    return convert
+
+
+def _rebuild(connection, table, key, make_converter, batch_size):
+    """Recreates `table` from the model and copies the old rows through the converter. Returns rows copied."""
+    old_name = f'{table.name}_pre_migration'
+    inspector = inspect(connection)
+    # Index names are global in SQLite and PostgreSQL; free them for the new table.
+    for index in inspector.get_indexes(table.name):
+        if 'duplicates_constraint' not in index:
+            connection.execute(text(f'DROP INDEX {index["name"]}'))
+    if connection.dialect.name == 'postgresql':
+        constraints = [inspector.get_pk_constraint(table.name)] + inspector.get_unique_constraints(table.name)
+        for constraint in constraints:
+            if constraint.get('name'):
+                connection.execute(text(f'ALTER INDEX {constraint["name"]} RENAME TO {constraint["name"]}_old'))
+    connection.execute(text(f'ALTER TABLE {table.name} RENAME TO {old_name}'))
+    table.create(bind=connection)
+
+    old = Table(old_name, MetaData(), autoload_with=connection)
+    convert = make_converter(connection)
+    copied, last = 0, None
+    while True:
+        query = select(old).order_by(old.c[key]).limit(batch_size)
+        if last is not None:
+            query = query.where(old.c[key] > last)
+        rows = connection.execute(query).mappings().all()
+        if not rows:
+            break
+        last = rows[-1][key]
+        converted = [row for row in map(convert, rows) if row is not None]
+        if converted:
+            connection.execute(table.insert(), converted)
+        copied += len(converted)
+    old.drop(bind=connection)
+    return copied
+
+
+def _columns(inspector, table_name):
+    return {column['name']: column for column in inspector.get_columns(table_name)}
+
+
+def migrate_schema(batch_size=5000):
+    """Brings tables from an older schema up to date. Returns {table: rows copied} for the tables rebuilt."""
+    migrated = {}
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        tables = set(inspector.get_table_names())
+
+        if 'magic_link_token' in tables and 'token_hash' in _columns(inspector, 'magic_link_token'):
+            start = time.monotonic()
+            migrated['magic_link_token'] = _rebuild(connection, MagicLinkToken.__table__, 'id',
+                                                    _magic_link_token_rows, batch_size)
+            logger.info('Migrated %d magic link tokens in %.1fs', migrated['magic_link_token'],
+                        time.monotonic() - start)
+
+        if 'used_token' in tables:
+            digest_column = _columns(inspector, 'used_token').get('token_digest')
+            if digest_column is not None and isinstance(digest_column['type'], String):
+                migrated['used_token'] = _rebuild(connection, UsedToken.__table__, 'token_digest',
+                                                  _used_token_rows, batch_size)
+                logger.info('Migrated %d used tokens', migrated['used_token'])
+
+        for table_name, names in OBSOLETE_INDEXES.items():
+            if table_name not in tables:
+                continue
+            existing = {index['name'] for index in inspect(connection).get_indexes(table_name)}
+            for name in names:
+                if name in existing:
+                    connection.execute(text(f'DROP INDEX {name}'))
+                    logger.info('Dropped obsolete index %s', name)
+    return migrated
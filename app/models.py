@@ -1,21 +1,90 @@
 import datetime
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
 from app import db
+from app.cache import TTLCache
+
+# value -> user_agent.id, per process. Housekeeping only deletes agents no token refers to, and the
+# token each lookup is for outlives HOUSEKEEPING_TOKEN_RETENTION (a day), so a five-minute entry
+# cannot point at a row another worker has purged.
+user_agent_ids = TTLCache(maxsize=1024, ttl=300)
+
+class UserAgent(db.Model):
+    """Each distinct User-Agent string once; tokens point at it instead of repeating it on every row."""
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(200), nullable=False, unique=True)
+
+    @classmethod
+    def id_for(cls, value):
+        """The id of the row for `value`, inserting (and committing) it on first sight."""
+        value = (value or '')[:200]
+        agent_id = user_agent_ids.get(value)
+        if agent_id is not None:
+            return agent_id
+        agent_id = db.session.query(cls.id).filter_by(value=value).scalar()
+        if agent_id is None:
+            agent = cls(value=value)
+            db.session.add(agent)
+            try:
+                db.session.commit()
+                agent_id = agent.id
+            except IntegrityError:
+                db.session.rollback()  # another worker inserted it first
+                agent_id = db.session.query(cls.id).filter_by(value=value).scalar()
+        user_agent_ids.set(value, agent_id)
+        return agent_id
+
+# A new or dropped table starts the ids over.
+event.listen(UserAgent.__table__, 'after_create', lambda *args, **kwargs: user_agent_ids.clear())
+event.listen(UserAgent.__table__, 'after_drop', lambda *args, **kwargs: user_agent_ids.clear())
 
 class MagicLinkToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), nullable=False, index=True)
-    token_hash = db.Column(db.String(128), nullable=False, unique=True)
+    token_digest = db.Column(db.LargeBinary(32), nullable=False, unique=True)  # raw sha256 of the token
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    expires_at = db.Column(db.DateTime, nullable=False)
-    used_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True) # housekeeping purges by expiry
+    used_at = db.Column(db.DateTime, nullable=True, index=True)  # and by use, as a separate purge
     request_ip = db.Column(db.String(45), nullable=False)
-    user_agent = db.Column(db.String(200), nullable=False)
+    user_agent_id = db.Column(db.Integer, db.ForeignKey('user_agent.id'), index=True)  # indexed for the purge
+    agent = db.relationship(UserAgent)
+
+    @property
+    def user_agent(self):
+        return self.agent.value if self.agent is not None else None
 
     def is_valid(self):
         return self.used_at is None and self.expires_at > datetime.datetime.utcnow()
 
 class RateLimit(db.Model):
+    __table_args__ = (
+        # Covers the per-key window lookup: key, window_start, count and the rowid id are all
+        # in the index, so the check never reads the table.
+        db.Index('ix_rate_limit_key_window_start_count', 'key', 'window_start', 'count'),
+        db.Index('ix_rate_limit_window_start', 'window_start'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    key = db.Column(db.String(120), nullable=False, index=True) # e.g., 'email:user@example.com' or 'ip:127.0.0.1'
+    key = db.Column(db.String(120), nullable=False) # e.g., 'email:user@example.com' or 'ip:127.0.0.1'
     count = db.Column(db.Integer, default=1)
     window_start = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+class UsedToken(db.Model):
+    """Redeemed signed magic links. A row only needs to outlive its token, so housekeeping drops expired ones."""
+    token_digest = db.Column(db.LargeBinary(32), primary_key=True)  # raw sha256 of the token; the insert is the check
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class MirroredCustomer(db.Model):
+    """Local copy of an EPOS Now customer, kept current by `flask sync-customers`."""
+    id = db.Column(db.Integer, primary_key=True)  # the EPOS customer Id
+    email = db.Column(db.String(120), nullable=False, index=True)  # normalized
+    forename = db.Column(db.String(120))
+    surname = db.Column(db.String(120))
+    card_number = db.Column(db.String(64))
+    current_points = db.Column(db.Integer, default=0)
+    marketing_email = db.Column(db.Boolean, default=False)
+    marketing_text = db.Column(db.Boolean, default=False)
+    record = db.Column(db.Text, nullable=False)  # the full JSON record; EPOS updates need every field
+    synced_at = db.Column(db.DateTime, nullable=False, index=True)
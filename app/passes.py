@@ -0,0 +1,201 @@
+import io
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from app import metrics
+from app.cache import TTLCache
+from app.codes import get_symbology
+
+logger = logging.getLogger(__name__)
+
+PASS_ASSETS = ('icon.png', 'icon@2x.png', 'logo.png')
+
+
+class PassSigningError(Exception):
+    """Raised when a pass cannot be signed, e.g. because certificates are missing."""
+
+
+class _Signer:
+    """Parsed signing material, loaded once per process."""
+
+    def __init__(self, cert_pem, key_pem, wwdr_pem, password):
+        from cryptography import x509
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+        self.cert = x509.load_pem_x509_certificate(cert_pem)
+        self.key = load_pem_private_key(key_pem, password=password.encode('utf-8') if password else None)
+        self.wwdr_cert = x509.load_pem_x509_certificate(wwdr_pem)
+
+    def sign(self, manifest):
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.serialization import pkcs7
+
+        return (
+            pkcs7.PKCS7SignatureBuilder()
+            .set_data(manifest.encode('utf-8'))
+            .add_signer(self.cert, self.key, hashes.SHA256())
+            .add_certificate(self.wwdr_cert)
+            .sign(serialization.Encoding.DER, [pkcs7.PKCS7Options.DetachedSignature])
+        )
+
+
+# The signer living in this process; pool workers get theirs from _init_worker.
+_worker_signer = None
+
+
+def _init_worker(cert_pem, key_pem, wwdr_pem, password):
+    global _worker_signer
+    _worker_signer = _Signer(cert_pem, key_pem, wwdr_pem, password)
+
+
+def _sign_manifest(manifest):
+    return _worker_signer.sign(manifest)
+
+
+class PassBuilder:
+    """
+    Builds signed Apple Wallet passes. Assets and signing material are read once
+    in init_app, finished passes are cached, and signing runs in a process pool
+    when PASS_SIGNING_WORKERS > 0.
+    """
+
+    def __init__(self):
+        self.assets = {}
+        self.signing_material = None
+        self.signing_error = None
+        self.cache = TTLCache(maxsize=512, ttl=3600)
+        self.workers = 0
+        self.timeout = 10
+        self.barcode_format = 'CODE128'
+        self._signer = None
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.pass_type_id = app.config['PASS_TYPE_ID']
+        self.team_id = app.config['PASS_TEAM_ID']
+        self.organization_name = app.config['PASS_ORGANIZATION_NAME']
+        self.workers = app.config['PASS_SIGNING_WORKERS']
+        self.barcode_format = get_symbology(app.config['PASS_BARCODE_SYMBOLOGY']).wallet_format
+        self.timeout = app.config['PASS_SIGNING_TIMEOUT']
+        self.cache.configure(maxsize=app.config['PASS_CACHE_SIZE'], ttl=app.config['PASS_CACHE_TTL'])
+
+        images_dir = os.path.join(app.static_folder, 'images')
+        self.assets = {}
+        for name in PASS_ASSETS:
+            with open(os.path.join(images_dir, name), 'rb') as f:
+                self.assets[name] = f.read()
+
+        self.shutdown()
+        self._signer = None
+        self.signing_material = None
+        self.signing_error = None
+        try:
+            self.signing_material = (
+                _read_file(app.config['PASS_CERT_PATH']),
+                _read_file(app.config['PASS_KEY_PATH']),
+                _read_file(app.config['PASS_WWDR_CERT_PATH']),
+                app.config['PASS_CERT_PASSWORD'],
+            )
+        except OSError as e:
+            self.signing_error = str(e)
+            logger.warning('Wallet pass signing is unavailable: %s', e)
+
+        app.extensions['pass_builder'] = self
+
+    def warm(self):
+        """
+        Parses the signing material (importing cryptography) and returns the signer.
+        Runs on the first build, or up front from the gunicorn preload warm-up.
+        """
+        if self._signer is not None:
+            return self._signer
+        if self.signing_material is None:
+            raise PassSigningError(self.signing_error or 'Pass signing is not configured.')
+        with self._lock:
+            if self._signer is None:
+                try:
+                    self._signer = _Signer(*self.signing_material)
+                except ValueError as e:
+                    self.signing_error = str(e)
+                    raise PassSigningError(f'Invalid pass signing material: {e}')
+        return self._signer
+
+    def build(self, customer):
+        """Returns the signed .pkpass bytes for `customer`, from cache when unchanged."""
+        key = (str(customer['CardNumber']), customer.get('CurrentPoints', 0), customer.get('Forename', ''))
+        pass_bytes = self.cache.get(key)
+        if pass_bytes is None:
+            with metrics.PASS_BUILD_SECONDS.time():
+                pass_bytes = self._create(*key)
+            self.cache.set(key, pass_bytes)
+        return pass_bytes
+
+    def _create(self, card_number, points, forename):
+        from py_pkpass.models import Pass, StoreCard, Barcode, BarcodeFormat
+
+        signer = self.warm()
+        card = StoreCard()
+        card.addPrimaryField('name', forename, 'Member Name')
+        card.addSecondaryField('points', str(points), 'Points')
+
+        pass_obj = Pass(
+            card,
+            passTypeIdentifier=self.pass_type_id,
+            organizationName=self.organization_name,
+            teamIdentifier=self.team_id,
+        )
+        pass_obj.serialNumber = card_number
+        pass_obj.description = f'{self.organization_name} loyalty card'
+        pass_obj.barcode = Barcode(card_number, getattr(BarcodeFormat, self.barcode_format), altText=card_number)
+        for name, data in self.assets.items():
+            pass_obj.addFile(name, io.BytesIO(data))
+
+        pass_json = pass_obj._createPassJson()
+        manifest = pass_obj._createManifest(pass_json)
+        signature = self._sign(signer, manifest)
+
+        buf = io.BytesIO()
+        pass_obj._createZip(pass_json, manifest, signature, zip_file=buf)
+        return buf.getvalue()
+
+    def _sign(self, signer, manifest):
+        executor = self._get_executor()
+        if executor is None:
+            return signer.sign(manifest)
+        return executor.submit(_sign_manifest, manifest).result(timeout=self.timeout)
+
+    def _get_executor(self):
+        if self.workers <= 0:
+            return None
+        pid = os.getpid()
+        with self._lock:
+            # A pool inherited through fork belongs to the parent; start our own.
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=self.signing_material,
+                )
+                self._executor_pid = pid
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._executor_pid = None
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+pass_builder = PassBuilder()
@@ -0,0 +1,238 @@
+"""
+On-demand cProfile of individual requests.
+
+A request is profiled when PROFILE_ENABLED is set, when it falls in the
+PROFILE_SAMPLE_RATE sample, or when it carries a valid X-Profile-Token header
+(from `flask profile-token`). Each profile is written to PROFILE_DIR as a
+`.prof` file (pstats format) with a `.json` summary beside it; only the newest
+PROFILE_MAX_FILES are kept. The summary splits the request's wall time into
+EPOS Now calls, database, code rendering, pass building and templates.
+
+    flask profile-report --endpoint main.dashboard
+"""
+import cProfile
+import datetime
+import glob
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import time
+from collections import defaultdict
+
+import click
+from flask import current_app, g, has_app_context, request
+from flask.cli import with_appcontext
+
+logger = logging.getLogger(__name__)
+
+TOKEN_HEADER = 'X-Profile-Token'
+
+# Time under these functions (cumulative) is attributed to the category; they never call each other.
+# cProfile only sees the request thread: lookups made through CoalescingEposNowClient run
+# _make_request on the event loop's threads, so its wait for them (_run) is counted instead.
+CATEGORIES = {
+    'epos': [('app/epos_client.py', '_make_request'), ('app/epos_async.py', '_run')],
+    'database': [('sqlalchemy/engine/base.py', '_execute_context'), ('sqlalchemy/engine/base.py', '_commit_impl')],
+    'codes': [('app/codes.py', 'render_code')],
+    'passes': [('app/passes.py', 'build')],
+    'templates': [('flask/templating.py', '_render')],
+}
+
+
+def _signing_key(secret_key):
+    return hmac.new(str(secret_key).encode('utf-8'), b'request-profile', hashlib.sha256).digest()
+
+
+def _mac(secret_key, expires):
+    return hmac.new(_signing_key(secret_key), str(expires).encode('ascii'), hashlib.sha256).hexdigest()
+
+
+def issue_token(secret_key, expires_in_seconds):
+    expires = int(time.time()) + int(expires_in_seconds)
+    return f'{expires}.{_mac(secret_key, expires)}'
+
+
+def token_is_valid(token, secret_key):
+    expires, _, mac = (token or '').partition('.')
+    try:
+        if not expires.isdecimal() or int(expires) <= time.time():
+            return False
+        # Bytes: compare_digest raises on non-ASCII str, and the header is client-controlled.
+        return hmac.compare_digest(mac.encode('utf-8'), _mac(secret_key, int(expires)).encode('ascii'))
+    except (UnicodeError, ValueError, TypeError):
+        return False
+
+
+def categorize(stats):
+    """Seconds spent under each category's functions, from a pstats.Stats."""
+    totals = dict.fromkeys(CATEGORIES, 0.0)
+    for (filename, _, funcname), (_, _, _, cumulative, _) in stats.stats.items():
+        filename = filename.replace(os.sep, '/')
+        for category, roots in CATEGORIES.items():
+            if any(funcname == name and filename.endswith(suffix) for suffix, name in roots):
+                totals[category] += cumulative
+    return totals
+
+
+def _trigger(config):
+    if config['PROFILE_ENABLED']:
+        return 'config'
+    if config['PROFILE_ALLOW_TOKEN'] and TOKEN_HEADER in request.headers:
+        if token_is_valid(request.headers[TOKEN_HEADER], config['SECRET_KEY']):
+            return 'token'
+    rate = config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        return 'sample'
+    return None
+
+
+def _start_profile():
+    trigger = _trigger(current_app.config)
+    if trigger is None:
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return  # another profiler is already active in this process
+    g.profile = (profiler, trigger, time.perf_counter())
+
+
+def _finish_profile(response):
+    state = g.pop('profile', None)
+    if state is None:
+        return response
+    profiler, trigger, start = state
+    profiler.disable()
+    duration = time.perf_counter() - start
+    try:
+        write_profile(profiler, {
+            'endpoint': request.endpoint or 'unknown',
+            'rule': request.url_rule.rule if request.url_rule else None,  # never the raw path, which may hold a token
+            'method': request.method,
+            'status': response.status_code,
+            'request_id': g.get('request_id'),
+            'trigger': trigger,
+            'duration_ms': round(duration * 1000, 3),
+        })
+    except OSError as e:
+        logger.warning('Could not write request profile: %s', e)
+    return response
+
+
+def _discard_profile(exc):
+    # after_request is skipped when an exception propagates; never leave the profiler running.
+    state = g.pop('profile', None) if has_app_context() else None
+    if state is not None:
+        state[0].disable()
+
+
+def write_profile(profiler, meta):
+    """Writes `<name>.prof` and `<name>.json`, then trims PROFILE_DIR to PROFILE_MAX_FILES profiles."""
+    config = current_app.config
+    directory = config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    stats = pstats.Stats(profiler)
+    meta['categories_ms'] = {name: round(seconds * 1000, 3) for name, seconds in categorize(stats).items()}
+    meta['created'] = datetime.datetime.utcnow().isoformat(timespec='milliseconds')
+    # Names sort oldest first across workers: millisecond timestamp, then pid.
+    name = f"{time.time_ns() // 1_000_000:013d}-{os.getpid()}-{meta['endpoint']}"
+    base = os.path.join(directory, name)
+    stats.dump_stats(base + '.prof')
+    with open(base + '.json', 'w') as f:
+        json.dump(meta, f)
+    _trim(directory, config['PROFILE_MAX_FILES'])
+    return base
+
+
+def _trim(directory, keep):
+    summaries = sorted(glob.glob(os.path.join(directory, '*.json')))
+    for summary in summaries[:max(len(summaries) - keep, 0)]:
+        for path in (summary, summary[:-len('.json')] + '.prof'):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass  # trimmed by another worker
+
+
+def load_profiles(directory, endpoint=None, last=None):
+    """Profile summaries in PROFILE_DIR, oldest first, each with the path of its `.prof` file."""
+    profiles = []
+    for summary in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        try:
+            with open(summary) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if endpoint and meta.get('endpoint') != endpoint:
+            continue
+        meta['profile'] = summary[:-len('.json')] + '.prof'
+        profiles.append(meta)
+    return profiles[-last:] if last else profiles
+
+
+def summarize(profiles):
+    """Per endpoint: request count, mean and max milliseconds, and mean milliseconds per category."""
+    grouped = defaultdict(list)
+    for meta in profiles:
+        grouped[meta['endpoint']].append(meta)
+    rows = []
+    for endpoint, items in grouped.items():
+        durations = [meta['duration_ms'] for meta in items]
+        categories = {name: sum(meta['categories_ms'].get(name, 0.0) for meta in items) / len(items)
+                      for name in CATEGORIES}
+        categories['other'] = max(sum(durations) / len(items) - sum(categories.values()), 0.0)
+        rows.append({'endpoint': endpoint, 'count': len(items), 'mean_ms': sum(durations) / len(items),
+                     'max_ms': max(durations), 'categories_ms': categories})
+    return sorted(rows, key=lambda row: row['mean_ms'] * row['count'], reverse=True)
+
+
+@click.command('profile-token')
+@click.option('--ttl', type=int, default=900, help='Seconds the token stays valid.')
+@with_appcontext
+def profile_token_command(ttl):
+    """Print a token for the X-Profile-Token header, which profiles the request it is sent with."""
+    click.echo(issue_token(current_app.config['SECRET_KEY'], ttl))
+
+
+@click.command('profile-report')
+@click.option('--endpoint', default=None, help='Only profiles of this endpoint, e.g. main.dashboard.')
+@click.option('--last', type=int, default=None, help='Only the newest N profiles.')
+@click.option('--top', type=int, default=25, help='Functions to list.')
+@click.option('--sort', 'sort_key', type=click.Choice(['cumulative', 'tottime', 'ncalls']), default='cumulative')
+@with_appcontext
+def profile_report_command(endpoint, last, top, sort_key):
+    """Summarize the request profiles in PROFILE_DIR."""
+    profiles = load_profiles(current_app.config['PROFILE_DIR'], endpoint, last)
+    if not profiles:
+        click.echo('No profiles recorded.')
+        return
+
+    names = list(CATEGORIES) + ['other']
+    click.echo(f"{'endpoint':<28}{'count':>6}{'mean ms':>10}{'max ms':>10}" + ''.join(f'{n:>11}' for n in names))
+    for row in summarize(profiles):
+        click.echo(f"{row['endpoint']:<28}{row['count']:>6}{row['mean_ms']:>10.1f}{row['max_ms']:>10.1f}"
+                   + ''.join(f"{row['categories_ms'][n]:>11.1f}" for n in names))
+
+    files = [meta['profile'] for meta in profiles if os.path.exists(meta['profile'])]
+    if files:
+        out = io.StringIO()
+        stats = pstats.Stats(*files, stream=out)
+        stats.strip_dirs().sort_stats(sort_key).print_stats(top)
+        click.echo(f'\nTop {top} functions across {len(files)} profiles, by {sort_key}:')
+        click.echo(out.getvalue())
+
+
+def init_app(app):
+    app.cli.add_command(profile_token_command)
+    app.cli.add_command(profile_report_command)
+    config = app.config
+    if config['PROFILE_ENABLED'] or config['PROFILE_SAMPLE_RATE'] or config['PROFILE_ALLOW_TOKEN']:
+        app.before_request(_start_profile)
+        app.after_request(_finish_profile)
+        app.teardown_request(_discard_profile)
@@ -0,0 +1,149 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+from app import db
+from app.models import RateLimit
+
+
+class MemoryRateLimiter:
+    """
+    Per-process sliding-window counter. Each key keeps the counts of the current
+    and previous fixed windows and weights the previous one by how much of it
+    still overlaps the sliding window, so a check is O(1) with two integers per key.
+    Keys idle for more than two periods are evicted, and at most `max_keys` are kept.
+    """
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._windows = OrderedDict()  # (key, period) -> [window_index, current, previous, last_seen]
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, period_seconds):
+        now = self._clock()
+        index, offset = divmod(now, period_seconds)
+        with self._lock:
+            self._evict_idle(now)
+            state = self._windows.get((key, period_seconds))
+            if state is None:
+                state = [index, 0, 0, now]
+                self._windows[(key, period_seconds)] = state
+            elif state[0] != index:
+                # Roll forward; anything older than the previous window no longer counts.
+                state[2] = state[1] if index - state[0] == 1 else 0
+                state[1] = 0
+                state[0] = index
+            self._windows.move_to_end((key, period_seconds))
+            state[3] = now
+
+            estimate = state[2] * (1 - offset / period_seconds) + state[1]
+            if estimate >= limit:
+                return False
+            state[1] += 1
+
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+            return True
+
+    def _evict_idle(self, now):
+        # Entries are in last-use order, so idle ones collect at the front.
+        while self._windows:
+            (_, period), state = next(iter(self._windows.items()))
+            if now - state[3] < 2 * period:
+                break
+            self._windows.popitem(last=False)
+
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+
+    def __len__(self):
+        return len(self._windows)
+
+
+class DatabaseRateLimiter:
+    """Fixed windows stored in the RateLimit table; shared by every worker using the database."""
+
+    def hit(self, key, limit, period_seconds):
+        now = datetime.datetime.utcnow()
+        period_start = now - datetime.timedelta(seconds=period_seconds)
+
+        # Only columns of the covering index, so the lookup never touches the table.
+        window = db.session.query(RateLimit.id, RateLimit.count).filter(
+            RateLimit.key == key,
+            RateLimit.window_start >= period_start
+        ).first()
+
+        if window and window.count >= limit:
+            return False
+
+        if window:
+            RateLimit.query.filter_by(id=window.id).update({RateLimit.count: RateLimit.count + 1},
+                                                           synchronize_session=False)
+        else:
+            db.session.add(RateLimit(key=key, count=1, window_start=now))
+
+        db.session.commit()
+        return True
+
+    def reset(self):
+        pass
+
+
+class RedisRateLimiter:
+    """
+    The same sliding-window estimate as MemoryRateLimiter, kept in Redis so that
+    all gunicorn workers (and hosts) share one budget. Requires the `redis` package.
+    """
+
+    # Check and increment in one script, so concurrent hits from several workers
+    # cannot all pass the check before any of them has counted.
+    HIT_SCRIPT = """
+    local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+    local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+    if previous * tonumber(ARGV[2]) + current >= tonumber(ARGV[1]) then
+        return 0
+    end
+    redis.call('INCR', KEYS[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATE_LIMIT_BACKEND=redis requires the redis package (pip install redis).')
+        self._redis = redis.Redis.from_url(url)
+        self._hit = self._redis.register_script(self.HIT_SCRIPT)
+        self.prefix = prefix
+
+    def hit(self, key, limit, period_seconds):
+        index, offset = divmod(time.time(), period_seconds)
+        current_key = f'{self.prefix}{period_seconds}:{key}:{int(index)}'
+        previous_key = f'{self.prefix}{period_seconds}:{key}:{int(index) - 1}'
+        weight = 1 - offset / period_seconds
+        return bool(self._hit(keys=[current_key, previous_key], args=[limit, repr(weight), int(2 * period_seconds)]))
+
+    def reset(self):
+        for key in self._redis.scan_iter(f'{self.prefix}*'):
+            self._redis.delete(key)
+
+
+def create_rate_limiter(config):
+    backend = config['RATE_LIMIT_BACKEND']
+    if backend == 'memory':
+        return MemoryRateLimiter(max_keys=config['RATE_LIMIT_MAX_KEYS'])
+    if backend == 'database':
+        return DatabaseRateLimiter()
+    if backend == 'redis':
+        if not config['RATE_LIMIT_STORAGE_URL']:
+            raise ValueError('RATE_LIMIT_BACKEND=redis requires RATE_LIMIT_STORAGE_URL.')
+        return RedisRateLimiter(config['RATE_LIMIT_STORAGE_URL'])
+    raise ValueError(f'Unknown RATE_LIMIT_BACKEND: {backend}')
+
+
+def init_app(app):
+    app.extensions['rate_limiter'] = create_rate_limiter(app.config)
@@ -1,13 +1,26 @@
-from flask import Blueprint, render_template, session, redirect, url_for, flash, request
+from flask import Blueprint, render_template, session, redirect, url_for, flash, request, abort, Response, current_app
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, BooleanField
 from wtforms.validators import DataRequired, Optional
-import qrcode
-import io
-import base64
 import datetime
+import hashlib
+import json
+import time
 
-from app.epos_client import EposNowClient
+from app.backpressure import UpstreamUnavailable
+from app.epos_async import CoalescingEposNowClient
+from app.epos_client import upstream_available
+from app.codes import MIMETYPES, SYMBOLOGIES, card_digest, render_code
+
+# Code image URLs are keyed by a digest of the card number, so they can be cached forever.
+CODE_CACHE_MAX_AGE = 365 * 24 * 3600
+
+# Fields kept in the session so the summary can still be shown while EPOS Now is unreachable.
+LAST_KNOWN_FIELDS = ('Id', 'CardNumber', 'CurrentPoints', 'Forename', 'Surname')
+
+# Templates whose markup the dashboard ETag covers, so a deploy that changes them invalidates it.
+DASHBOARD_TEMPLATES = ('base.html', 'dashboard.html')
+_template_fingerprint = None
 
 bp = Blueprint('main', __name__)
 
@@ -19,35 +32,91 @@ class ProfileForm(FlaskForm):
     marketing_text = BooleanField('Receive text marketing')
     submit = SubmitField('Update Profile')
 
+def template_fingerprint():
+    global _template_fingerprint
+    if _template_fingerprint is None:
+        digest = hashlib.sha256()
+        for name in DASHBOARD_TEMPLATES:
+            source, _, _ = current_app.jinja_env.loader.get_source(current_app.jinja_env, name)
+            digest.update(source.encode('utf-8'))
+        _template_fingerprint = digest.hexdigest()[:16]
+    return _template_fingerprint
+
+def dashboard_etag(customer, customer_name):
+    """A validator over everything the summary view shows, so an unchanged balance can be answered with a 304."""
+    displayed = {
+        'points': customer.get('CurrentPoints', 0),
+        'card': customer.get('CardNumber'),
+        'name': customer_name,
+        'forename': customer.get('Forename'),
+        'surname': customer.get('Surname'),
+        'consent': customer.get('MarketingConsent'),
+        'code': (current_app.config['DASHBOARD_CODE_SYMBOLOGY'], current_app.config['DASHBOARD_CODE_FORMAT']),
+        'templates': template_fingerprint(),
+        # The page links static files by content hash, so a changed stylesheet changes the page.
+        'static': current_app.extensions['static_assets'].version,
+    }
+    return hashlib.sha256(json.dumps(displayed, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+
 @bp.before_request
 def require_login():
     if 'user_email' not in session and request.endpoint != 'static':
         if request.blueprint != 'auth':
             return redirect(url_for('auth.login'))
 
+def load_customer(epos_client, fresh_after=None, fresh=False):
+    """
+    The logged-in customer's EPOS record, fetched by the Id stored at login.
+    Sessions without one (new users, older sessions) fall back to the email.
+    Pass `fresh` to read it live, e.g. before writing it back.
+    """
+    if session.get('customer_id'):
+        return epos_client.get_customer_by_id(session['customer_id'], fresh_after, fresh)
+    customer = epos_client.get_customer_by_email(session['user_email'], fresh)
+    if customer:
+        session['customer_id'] = customer.get('Id')
+        session['customer_name'] = f"{customer.get('Forename', '')} {customer.get('Surname', '')}".strip()
+    return customer
+
+def remember_last_known(customer, fetched_at):
+    snapshot = {field: customer.get(field) for field in LAST_KNOWN_FIELDS}
+    snapshot['FetchedAt'] = int(fetched_at.timestamp()) // 60 * 60  # minutes, as displayed
+    if session.get('last_known_customer') != snapshot:
+        session['last_known_customer'] = snapshot
+
+def code_url_for(customer):
+    if not customer or not customer.get('CardNumber'):
+        return None
+    card_number = str(customer['CardNumber'])
+    if session.get('card_number') != card_number:
+        session['card_number'] = card_number
+    return url_for('main.loyalty_code', symbology=current_app.config['DASHBOARD_CODE_SYMBOLOGY'],
+                   digest=card_digest(card_number), fmt=current_app.config['DASHBOARD_CODE_FORMAT'])
+
+def format_points(customer):
+    points_raw = customer.get('CurrentPoints', 0) if customer else 0
+    return f"£{(points_raw or 0) / 100:.2f}"
+
 @bp.route('/')
 @bp.route('/dashboard', methods=['GET', 'POST'])
 def dashboard():
     if 'user_email' not in session:
         return redirect(url_for('auth.login'))
 
-    epos_client = EposNowClient()
-    customer = epos_client.get_customer_by_email(session['user_email'])
-    customer_id = customer.get('Id') if customer else None
+    epos_client = CoalescingEposNowClient()
 
+    if request.method == 'POST':
+        form = ProfileForm()
+        if not form.validate_on_submit():
+            # Nothing to save, so nothing to fetch: show the form again with its errors.
+            return render_template('dashboard.html', customer=None, form=form, show_edit_form=True,
+                                   has_profile=bool(session.get('customer_id')))
 
-    form_data = {}
-    if customer:
-        form_data = {
-            'forename': customer.get('Forename'),
-            'surname': customer.get('Surname'),
-            'phone': customer.get('ContactNumber'),
-            'marketing_email': customer.get('MarketingConsent', {}).get('Email'),
-            'marketing_text': customer.get('MarketingConsent', {}).get('Text')
-        }
-    form = ProfileForm(data=form_data)
-
-    if form.validate_on_submit():
+        # The PUT replaces the whole record, so it must start from the live one: a cached or
+        # mirrored copy would write back an old CurrentPoints and erase points earned since.
+        customer = load_customer(epos_client, fresh=True)
+        # Taken before the write, so the record it returns (cached by the client) counts as fresh.
+        saved_at = time.time()
         try:
             if customer:  # Existing customer, so update
                 # The API requires the full customer object for updates.
@@ -61,9 +130,9 @@ def dashboard():
                         'Text': form.marketing_text.data
                     }
                 })
-                epos_client.update_customer(updated_customer_data)
+                saved = epos_client.update_customer(updated_customer_data)
                 flash('Your profile has been updated successfully!', 'success')
-                session['customer_name'] = f"{updated_customer_data['Forename']} {updated_customer_data['Surname']}"
+                session['customer_name'] = f"{saved.get('Forename', '')} {saved.get('Surname', '')}".strip()
             else:  # New customer, so create
                 new_customer_data = {
                     'Forename': form.forename.data,
@@ -81,44 +150,103 @@ def dashboard():
                 flash('Welcome! Your profile has been created.', 'success')
                 session['customer_name'] = f"{new_customer_data['Forename']} {new_customer_data['Surname']}"
 
+            # The redirected page is served from the record the write returned. Only a
+            # worker whose cached copy predates the save goes back to EPOS for it.
+            session['profile_saved_at'] = saved_at
             return redirect(url_for('main.dashboard'))
         except Exception as e:
             flash('There was an error saving your profile.', 'danger')
+    else:
+        try:
+            customer = load_customer(epos_client, session.get('profile_saved_at'))
+        except UpstreamUnavailable:
+            # EPOS is down or saturated: show what this session last saw rather than an error.
+            if not session.get('last_known_customer'):
+                raise
+            return degraded_dashboard(session['last_known_customer'])
+        form_data = {}
+        if customer:
+            form_data = {
+                'forename': customer.get('Forename'),
+                'surname': customer.get('Surname'),
+                'phone': customer.get('ContactNumber'),
+                'marketing_email': customer.get('MarketingConsent', {}).get('Email'),
+                'marketing_text': customer.get('MarketingConsent', {}).get('Text')
+            }
+        form = ProfileForm(data=form_data)
 
     # Show the edit form only if 'edit=true' is in the URL, or if it's a new customer.
     show_edit_form = request.args.get('edit') == 'true' or not customer
 
-    points_raw = customer.get('CurrentPoints', 0) if customer else 0
-    points_balance = f"£{points_raw / 100:.2f}"
+    code_url = code_url_for(customer)
+    degraded = not upstream_available()
+
+    # Only the plain summary view is cacheable: forms carry a CSRF token and
+    # flashed messages must be rendered (and consumed) exactly once.
+    etag = None
+    if request.method == 'GET' and customer and not show_edit_form and not degraded and not session.get('_flashes'):
+        etag = dashboard_etag(customer, session.get('customer_name'))
+        if request.if_none_match.contains_weak(etag):
+            return _private_revalidate(Response(status=304), etag)
+
     last_updated = None
     if customer:
-        last_updated = datetime.datetime.now().strftime('%d %b %Y, %H:%M')
-
-    qr_code_data = None
-    if customer and customer.get('CardNumber'):
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(customer['CardNumber'])
-        qr.make(fit=True)
-
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        buf = io.BytesIO()
-        img.save(buf)
-        buf.seek(0)
-        
-        img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-        qr_code_data = f'data:image/png;base64,{img_base64}'
-
-
-    return render_template('dashboard.html', 
-                           customer=customer, 
-                           form=form, 
-                           points_balance=points_balance,
-                           last_updated=last_updated,
-                           show_edit_form=show_edit_form, 
-                           qr_code_data=qr_code_data)
+        fetched_at = epos_client.fetched_at(customer_id=customer.get('Id'))
+        last_updated = fetched_at.strftime('%d %b %Y, %H:%M')
+        remember_last_known(customer, fetched_at)
+
+    response = Response(render_template('dashboard.html',
+                                        customer=customer,
+                                        form=form,
+                                        points_balance=format_points(customer),
+                                        last_updated=last_updated,
+                                        show_edit_form=show_edit_form,
+                                        has_profile=customer is not None,
+                                        degraded=degraded,
+                                        code_url=code_url))
+    if etag:
+        _private_revalidate(response, etag)
+    return response
+
+def degraded_dashboard(snapshot):
+    """The summary view from the session's last known record, rendered without calling EPOS."""
+    last_updated = datetime.datetime.fromtimestamp(snapshot['FetchedAt']).strftime('%d %b %Y, %H:%M')
+    response = Response(render_template('dashboard.html',
+                                        customer=snapshot,
+                                        form=None,
+                                        points_balance=format_points(snapshot),
+                                        last_updated=last_updated,
+                                        show_edit_form=False,
+                                        has_profile=True,
+                                        degraded=True,
+                                        code_url=code_url_for(snapshot)))
+    response.cache_control.no_store = True
+    return response
+
+def _private_revalidate(response, etag):
+    # Weak: the "last updated" time may differ while everything else is identical.
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+@bp.route('/code/<symbology>/<digest>.<fmt>')
+def loyalty_code(symbology, digest, fmt):
+    if symbology not in SYMBOLOGIES or fmt not in MIMETYPES:
+        abort(404)
+    return _code_response(digest, symbology, fmt, etag=f'{digest}-{symbology}-{fmt}')
+
+def _code_response(digest, symbology, fmt, etag):
+    card_number = session.get('card_number')
+    if not card_number or card_digest(card_number) != digest:
+        abort(404)
+
+    response = Response(render_code(card_number, symbology, fmt), mimetype=MIMETYPES[fmt])
+    # The image only depends on the card number, so the digest is a strong validator.
+    # It is private because the image encodes the member's card number.
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = CODE_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
@@ -0,0 +1,117 @@
+"""
+Boot-time helpers: explicit schema creation, warm-up for preloaded gunicorn
+masters, and an import-time report to keep cold starts in check.
+"""
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import click
+from flask.cli import with_appcontext
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def create_schema():
+    """
+    Creates missing tables, upgrades tables from an older schema, then creates any
+    indexes that are missing. Returns {table: rows copied} for the tables upgraded.
+    """
+    from app.housekeeping import ensure_indexes
+    from app.migrations import migrate_schema
+
+    db.create_all()
+    migrated = migrate_schema()
+    ensure_indexes()
+    return migrated
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the database tables and indexes, upgrading an older schema in place."""
+    for table, rows in create_schema().items():
+        click.echo(f'Migrated {table}: {rows} rows.')
+    click.echo('Database schema is up to date.')
+
+
+def warm_up(app):
+    """
+    Does the first-use work up front: compiles every Jinja template and parses the
+    pass signing material. Called once in the gunicorn master when preloading, so
+    forked workers start with it done.
+    """
+    start = time.monotonic()
+    templates = 0
+    for name in app.jinja_env.list_templates(extensions=('html',)):
+        app.jinja_env.get_template(name)
+        templates += 1
+
+    pass_builder = app.extensions.get('pass_builder')
+    if pass_builder is not None and pass_builder.signing_material is not None:
+        try:
+            pass_builder.warm()
+        except Exception as e:
+            logger.warning('Could not warm pass signer: %s', e)
+    logger.info('Warmed up %d templates in %.3fs', templates, time.monotonic() - start)
+
+
+def parse_importtime(output):
+    """Parses `python -X importtime` output into (module, self_us, cumulative_us) rows."""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # the header line
+        rows.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return rows
+
+
+def summarize_importtime(rows):
+    """Self time per top-level package, largest first, and the total in microseconds."""
+    by_package = defaultdict(int)
+    for module, self_us, _ in rows:
+        by_package[module.split('.')[0]] += self_us
+    return sorted(by_package.items(), key=lambda item: item[1], reverse=True), sum(by_package.values())
+
+
+@click.command('startup-report')
+@click.option('--top', type=int, default=15, help='Packages and modules to list.')
+@click.option('--module', default='main', help='Module whose import is measured.')
+def startup_report_command(top, module):
+    """Measure how long importing the app takes, broken down by package."""
+    start = time.monotonic()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True)
+    wall = time.monotonic() - start
+    if result.returncode != 0:
+        raise click.ClickException(f'import {module} failed:\n{result.stderr[-2000:]}')
+
+    rows = parse_importtime(result.stderr)
+    packages, total = summarize_importtime(rows)
+    click.echo(f'import {module}: {total / 1000:.1f} ms in imports, {wall:.2f}s wall clock for the process\n')
+    click.echo(f"{'package':<32}{'self ms':>10}")
+    for name, self_us in packages[:top]:
+        click.echo(f'{name:<32}{self_us / 1000:>10.1f}')
+    click.echo(f"\n{'slowest modules (cumulative)':<48}{'ms':>10}")
+    for name, _, cumulative_us in sorted(rows, key=lambda row: row[2], reverse=True)[:top]:
+        click.echo(f'{name:<48}{cumulative_us / 1000:>10.1f}')
+
+
+def init_app(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(startup_report_command)
+    if app.config['AUTO_CREATE_SCHEMA']:
+        with app.app_context():
+            create_schema()
+            # Don't hand pooled connections to workers forked from a preloaded master.
+            db.engine.dispose()
@@ -0,0 +1,160 @@
+"""
+Fingerprinted, precompressed static files.
+
+At startup every file under the static folder is read once, named after a hash
+of its content (`style.css` -> `style.3f2a9c1b7e4d.css`) and, for text types,
+compressed with gzip and, when the `brotli` package is installed, brotli.
+`url_for('static', filename='style.css')` then returns the hashed URL, which is
+served from memory with `Cache-Control: public, max-age=31536000, immutable`
+and the smallest encoding the client accepts. Unhashed URLs keep working with
+Flask's default revalidation.
+
+    flask build-assets dist/static
+
+writes the same files, with their `.gz`/`.br` variants and a manifest.json,
+for a reverse proxy or CDN to serve.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import time
+
+import click
+from flask import Response, current_app, request
+from flask.cli import with_appcontext
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+# Preferred first when the client accepts several.
+ENCODINGS = ('br', 'gzip')
+
+
+def fingerprint(filename, data):
+    """`images/logo.png` -> `images/logo.<12 hex digits of sha256>.png`."""
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    base, ext = os.path.splitext(filename)
+    return f'{base}.{digest}{ext}', digest
+
+
+def compress(data, mimetype, min_size=256):
+    """{encoding: bytes} for the encodings that make a compressible file meaningfully smaller."""
+    if len(data) < min_size or not mimetype.startswith(COMPRESSIBLE_TYPES):
+        return {}
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data) * 0.9}
+
+
+class Asset:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.hashed_name, self.digest = fingerprint(filename, data)
+        self.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self.data = data
+        self.variants = {}
+
+
+class StaticAssets:
+    """Maps static filenames to hashed names and serves the hashed ones from memory."""
+
+    def __init__(self):
+        self.enabled = False
+        self.max_age = 31536000
+        self.assets = {}  # filename -> Asset
+        self.by_hashed_name = {}
+        self.version = ''  # digest of the manifest, for validators of pages that link the hashed names
+        self._send_static_file = None
+
+    def init_app(self, app):
+        self.enabled = app.config['STATIC_FINGERPRINT']
+        self.max_age = app.config['STATIC_MAX_AGE']
+        app.cli.add_command(build_assets_command)
+        app.extensions['static_assets'] = self
+        if not self.enabled or not app.static_folder:
+            return
+        self.build(app.static_folder, app.config['STATIC_COMPRESS_MIN_SIZE'])
+        self._send_static_file = app.view_functions['static']
+        app.view_functions['static'] = self.send_static_file
+        app.url_defaults(self.inject_hashed_name)
+
+    def build(self, folder, min_size=256):
+        start = time.monotonic()
+        assets = {}
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for name in sorted(files):
+                if name.startswith('.') or name.endswith(('.gz', '.br')):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    asset = Asset(os.path.relpath(path, folder).replace(os.sep, '/'), f.read())
+                asset.variants = compress(asset.data, asset.mimetype, min_size)
+                assets[asset.filename] = asset
+        self.assets = assets
+        self.by_hashed_name = {asset.hashed_name: asset for asset in assets.values()}
+        self.version = hashlib.sha256(json.dumps(self.manifest()).encode('utf-8')).hexdigest()[:16]
+        logger.info('Fingerprinted %d static files in %.3fs', len(assets), time.monotonic() - start)
+
+    def manifest(self):
+        return {filename: asset.hashed_name for filename, asset in sorted(self.assets.items())}
+
+    def inject_hashed_name(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.assets:
+            values['filename'] = self.assets[values['filename']].hashed_name
+
+    def send_static_file(self, filename):
+        asset = self.by_hashed_name.get(filename)
+        if asset is None:
+            return self._send_static_file(filename=filename)
+
+        encoding = next((e for e in ENCODINGS if e in asset.variants and request.accept_encodings[e]), None)
+        response = Response(asset.variants[encoding] if encoding else asset.data, mimetype=asset.mimetype)
+        if encoding:
+            response.content_encoding = encoding
+        if asset.variants:
+            response.vary.add('Accept-Encoding')
+        # The name changes with the content, so a cached copy never needs revalidating.
+        response.set_etag(f'{asset.digest}-{encoding}' if encoding else asset.digest)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
+
+    def export(self, directory):
+        """Writes every hashed file, its compressed variants and manifest.json to `directory`."""
+        for asset in self.assets.values():
+            path = os.path.join(directory, *asset.hashed_name.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(asset.data)
+            for encoding, body in asset.variants.items():
+                with open(f"{path}.{'gz' if encoding == 'gzip' else encoding}", 'wb') as f:
+                    f.write(body)
+        with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+            json.dump(self.manifest(), f, indent=2)
+
+
+static_assets = StaticAssets()
+
+
+@click.command('build-assets')
+@click.argument('output_dir', type=click.Path(file_okay=False))
+@with_appcontext
+def build_assets_command(output_dir):
+    """Write fingerprinted and precompressed static files to OUTPUT_DIR."""
+    assets = current_app.extensions['static_assets']
+    if not assets.assets:
+        assets.build(current_app.static_folder, current_app.config['STATIC_COMPRESS_MIN_SIZE'])
+    assets.export(output_dir)
+    variants = sum(len(asset.variants) for asset in assets.assets.values())
+    click.echo(f'Wrote {len(assets.assets)} files and {variants} compressed variants to {output_dir}.')
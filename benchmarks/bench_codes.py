@@ -0,0 +1,63 @@
+"""
+Compares render time and payload size of the old dashboard QR path
+(`qrcode.make_image` rasterized through PIL at box_size=10) with the matrix
+renderers in app.codes, uncached, over distinct card numbers.
+
+    python -m benchmarks.bench_codes --cards 200
+"""
+import argparse
+import io
+import statistics
+import time
+
+from app.codes import render_code
+
+
+def pil_qr_png(data):
+    """The pre-app.codes dashboard renderer."""
+    import qrcode
+
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buf = io.BytesIO()
+    img.save(buf)
+    return buf.getvalue()
+
+
+def measure(render, cards):
+    timings, sizes = [], []
+    for card in cards:
+        start = time.perf_counter()
+        payload = render(card)
+        timings.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(payload))
+    return timings, sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cards', type=int, default=200, help='distinct card numbers rendered per renderer')
+    args = parser.parse_args()
+
+    cards = [str(9000000000 + i) for i in range(args.cards)]
+    renderers = {
+        'qrcode.make_image (PIL PNG)': pil_qr_png,
+        'qr svg': lambda card: render_code.__wrapped__(card, 'qr', 'svg'),
+        'qr png (zlib)': lambda card: render_code.__wrapped__(card, 'qr', 'png'),
+        'code128 svg': lambda card: render_code.__wrapped__(card, 'code128', 'svg'),
+        'code128 png (zlib)': lambda card: render_code.__wrapped__(card, 'code128', 'png'),
+    }
+    for render in renderers.values():
+        render(cards[0])  # import and warm up outside the timings
+
+    print(f"{'renderer':<30}{'mean ms':>10}{'p95 ms':>10}{'bytes':>10}")
+    for name, render in renderers.items():
+        timings, sizes = measure(render, cards)
+        p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+        print(f'{name:<30}{statistics.mean(timings):>10.3f}{p95:>10.3f}{statistics.mean(sizes):>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Compares get_customer_by_email latency with a fresh connection per call
+(the old module-level `requests.request` path) against the pooled transport.
+
+    python -m benchmarks.bench_epos_client --calls 500 --latency 0.002
+"""
+import argparse
+import statistics
+import time
+
+import requests
+
+from app import epos_client
+from app.epos_client import EposNowClient
+from tests.stubs import FakeEposServer
+
+
+class UnpooledEposNowClient(EposNowClient):
+    """The pre-pooling behaviour: a new TCP connection for every call."""
+
+    def _make_request(self, method, endpoint, **kwargs):
+        url = f'{self.base_url}/{endpoint}'
+        headers = {'Authorization': f'Basic {self.access_token}', 'Content-Type': 'application/json'}
+        response = requests.request(method, url, headers=headers, **kwargs)
+        response.raise_for_status()
+        if response.status_code == 204 or not response.content:
+            return None
+        return response.json()
+
+
+def measure(client, email, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        client.get_customer_by_email(email)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f'{name:<10} mean {statistics.mean(timings):7.3f} ms   '
+          f'p50 {statistics.median(timings):7.3f} ms   p95 {p95:7.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help='stub server latency in seconds')
+    args = parser.parse_args()
+
+    with FakeEposServer(latency=args.latency) as stub:
+        email = stub.add_customer({'EmailAddress': 'bench@example.com', 'Forename': 'Bench'})['EmailAddress']
+        epos_client.configure_transport(EPOS_BASE_URL=stub.base_url)
+
+        unpooled = UnpooledEposNowClient(api_key='bench', api_secret='bench')
+        pooled = EposNowClient(api_key='bench', api_secret='bench')
+        # Warm both paths once so imports and the first pool connection are excluded.
+        measure(unpooled, email, 5)
+        measure(pooled, email, 5)
+
+        print(f'{args.calls} sequential get_customer_by_email calls against {stub.base_url}')
+        report('unpooled', measure(unpooled, email, args.calls))
+        report('pooled', measure(pooled, email, args.calls))
+
+
+if __name__ == '__main__':
+    main()
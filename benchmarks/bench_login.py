@@ -0,0 +1,123 @@
+"""
+Login throughput against SQLite under gunicorn with N workers, comparing the old
+engine setup (rollback journal, synchronous=FULL, a new connection per request)
+with the tuned one (WAL, synchronous=NORMAL, pooled connections).
+
+Each virtual user loops over POST /login and GET /login/verify/<token>, which
+write a RateLimit row (database backend), a MagicLinkToken and its used_at.
+
+    python -m benchmarks.bench_login --workers 1,4 --users 16 --duration 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmarks.loadtest import CSRF_RE, ROOT, MailboxReader, Recorder, free_port, start_gunicorn, summarize
+from tests.stubs import FakeEposServer, SMTPSink
+
+PROFILES = {
+    'before': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'DATABASE_POOL_SIZE': '0'},
+    'after': {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'NORMAL', 'DATABASE_POOL_SIZE': '5'},
+}
+
+
+def login(base_url, email, recorder, mailbox):
+    http = requests.Session()
+    page = http.get(f'{base_url}/login')
+    token = CSRF_RE.search(page.text)
+    data = {'email': email}
+    if token:
+        data['csrf_token'] = token.group(1)
+    seen = len(mailbox.sink.messages)
+    recorder.timed('POST /login', http.post, f'{base_url}/login', data=data, allow_redirects=False)
+    link = mailbox.wait_for_link(email, seen)
+    recorder.timed('GET /login/verify/<token>', http.get, link, allow_redirects=False)
+
+
+def run_profile(name, workers, args, stub, sink, emails):
+    port = free_port()
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+    env = dict(
+        os.environ,
+        SECRET_KEY='bench',
+        DATABASE_URL=f'sqlite:///{database}',
+        EPOS_BASE_URL=stub.base_url,
+        EPOS_API_KEY='bench',
+        EPOS_API_SECRET='bench',
+        MAIL_SERVER=sink.host,
+        MAIL_PORT=str(sink.port),
+        MAIL_USE_TLS='False',
+        MJ_APIKEY_PUBLIC='bench',
+        MJ_APIKEY_PRIVATE='bench',
+        RATE_LIMIT_BACKEND='database',
+        RATE_LIMIT_EMAIL_HOUR='1000000',
+        RATE_LIMIT_IP_HOUR='1000000',
+        FLASK_DEBUG='0',
+        **PROFILES[name],
+    )
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', 'init-db'], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    process = start_gunicorn(workers, args.threads, port, env, verbose=args.verbose)
+
+    recorder = Recorder()
+    mailbox = MailboxReader(sink)
+    base_url = f'http://127.0.0.1:{port}'
+    stop_at = time.monotonic() + args.duration
+    logins = [0]
+
+    def user(index):
+        email = emails[index % len(emails)]
+        while time.monotonic() < stop_at:
+            try:
+                login(base_url, email, recorder, mailbox)
+                logins[0] += 1
+            except (requests.RequestException, TimeoutError):
+                pass
+
+    started = time.monotonic()
+    users = [threading.Thread(target=user, args=(i,)) for i in range(args.users)]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    process.terminate()
+    process.wait(timeout=10)
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(database + suffix):
+            os.unlink(database + suffix)
+    return summarize(recorder, elapsed, logins[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,4', help='comma-separated gunicorn worker counts')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--users', type=int, default=16, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per run')
+    parser.add_argument('--verbose', action='store_true', help='show the app servers\' log output')
+    args = parser.parse_args()
+
+    with FakeEposServer() as stub, SMTPSink() as sink:
+        emails = [stub.add_customer({'EmailAddress': f'user{i}@example.com', 'Forename': f'User{i}'})['EmailAddress']
+                  for i in range(args.users)]
+        print(f"{'profile':<10}{'workers':>8}{'logins/s':>10}{'errors':>8}{'p50 ms':>9}{'p99 ms':>9}")
+        for workers in [int(w) for w in args.workers.split(',')]:
+            for name in PROFILES:
+                result = run_profile(name, workers, args, stub, sink, emails)
+                rows = result['endpoints'].values()
+                errors = sum(row['errors'] for row in rows)
+                post = result['endpoints'].get('POST /login', {'p50_ms': 0.0, 'p99_ms': 0.0})
+                print(f"{name:<10}{workers:>8}{result['journeys'] / result['elapsed']:>10.1f}{errors:>8}"
+                      f"{post['p50_ms']:>9.1f}{post['p99_ms']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Storage size and lookup latency of the token and rate-limit tables at scale,
+comparing the old layout (hex token_hash, inline user_agent, (key, window_start)
+index) with the current one (32-byte digests, a user_agent table, the covering
+(key, window_start, count) index). Both are filled with the same rows in SQLite
+files, and then the old one is upgraded with `create_schema` to time the
+migration.
+
+    python -m benchmarks.bench_schema --tokens 1000000 --rate-limits 1000000
+"""
+import argparse
+import datetime
+import hashlib
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+# As `flask init-db` created it before binary digests.
+LEGACY_SCHEMA = """
+CREATE TABLE magic_link_token (
+    id INTEGER NOT NULL, email VARCHAR(120) NOT NULL, token_hash VARCHAR(128) NOT NULL, created_at DATETIME,
+    expires_at DATETIME NOT NULL, used_at DATETIME, request_ip VARCHAR(45) NOT NULL,
+    user_agent VARCHAR(200) NOT NULL, PRIMARY KEY (id), UNIQUE (token_hash));
+CREATE INDEX ix_magic_link_token_email ON magic_link_token (email);
+CREATE INDEX ix_magic_link_token_expires_at ON magic_link_token (expires_at);
+CREATE TABLE rate_limit (
+    id INTEGER NOT NULL, "key" VARCHAR(120) NOT NULL, count INTEGER, window_start DATETIME, PRIMARY KEY (id));
+CREATE INDEX ix_rate_limit_key_window_start ON rate_limit ("key", window_start);
+CREATE INDEX ix_rate_limit_window_start ON rate_limit (window_start);
+CREATE TABLE used_token (token_digest VARCHAR(64) NOT NULL, expires_at DATETIME NOT NULL, PRIMARY KEY (token_digest));
+CREATE INDEX ix_used_token_expires_at ON used_token (expires_at);
+"""
+
+# The statements the app runs per login, before and after.
+QUERIES = {
+    'before': {
+        'token': 'SELECT * FROM magic_link_token WHERE token_hash = ? LIMIT 1',
+        'rate_limit': 'SELECT id, "key", count, window_start FROM rate_limit WHERE "key" = ? AND window_start >= ? '
+                      'LIMIT 1',
+    },
+    'after': {
+        'token': 'SELECT * FROM magic_link_token WHERE token_digest = ? LIMIT 1',
+        'rate_limit': 'SELECT id, count FROM rate_limit WHERE "key" = ? AND window_start >= ? LIMIT 1',
+    },
+}
+
+USER_AGENT = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_{} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) ' \
+             'Version/17.0 Mobile/15E148 Safari/604.1'
+
+
+def generate(args):
+    """The same rows for both layouts: tokens as (digest, email, created, expires, ip, user agent) and windows."""
+    rng = random.Random(1)
+    now = datetime.datetime(2024, 1, 1)
+    tokens = []
+    for i in range(args.tokens):
+        created = now - datetime.timedelta(seconds=rng.randrange(3 * 24 * 3600))
+        tokens.append((hashlib.sha256(f'token-{i}'.encode()).digest(), f'user{i % (args.tokens // 3 + 1)}@example.com',
+                       created, created + datetime.timedelta(minutes=15), f'10.{i % 256}.{i // 256 % 256}.7',
+                       USER_AGENT.format(rng.randrange(args.user_agents))))
+    windows = []
+    for i in range(args.rate_limits):
+        key = f'email:user{i // 2}@example.com' if i % 2 else f'ip:10.{i % 256}.{i // 256 % 256}.{i // 65536 % 256}'
+        windows.append((key, rng.randrange(1, 5), now - datetime.timedelta(seconds=rng.randrange(2 * 3600))))
+    return tokens, windows
+
+
+def fill_before(path, tokens, windows):
+    connection = sqlite3.connect(path)
+    connection.executescript(LEGACY_SCHEMA)
+    connection.executemany(
+        'INSERT INTO magic_link_token (token_hash, email, created_at, expires_at, request_ip, user_agent) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        ((digest.hex(), email, str(created), str(expires), ip, agent)
+         for digest, email, created, expires, ip, agent in tokens))
+    connection.executemany('INSERT INTO rate_limit ("key", count, window_start) VALUES (?, ?, ?)',
+                           ((key, count, str(start)) for key, count, start in windows))
+    connection.commit()
+    connection.close()
+
+
+def fill_after(path, tokens, windows):
+    from app import db
+    import app.models  # noqa: F401 (registers the tables)
+
+    db.Model.metadata.create_all(create_engine(f'sqlite:///{path}'))
+    connection = sqlite3.connect(path)
+    agents = {agent: i for i, agent in enumerate(sorted({token[5] for token in tokens}), 1)}
+    connection.executemany('INSERT INTO user_agent (id, value) VALUES (?, ?)', ((i, a) for a, i in agents.items()))
+    connection.executemany(
+        'INSERT INTO magic_link_token (token_digest, email, created_at, expires_at, request_ip, user_agent_id) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        ((digest, email, str(created), str(expires), ip, agents[agent])
+         for digest, email, created, expires, ip, agent in tokens))
+    connection.executemany('INSERT INTO rate_limit ("key", count, window_start) VALUES (?, ?, ?)',
+                           ((key, count, str(start)) for key, count, start in windows))
+    connection.commit()
+    connection.close()
+
+
+def sizes(path):
+    """Bytes per table and index, from SQLite's dbstat table."""
+    connection = sqlite3.connect(path)
+    connection.execute('ANALYZE')
+    rows = connection.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name').fetchall()
+    connection.close()
+    return dict(rows)
+
+
+def lookups(path, name, tokens, windows, count):
+    """p50 and p95 microseconds per query over random existing keys, and each query's plan."""
+    connection = sqlite3.connect(path)
+    rng = random.Random(2)
+    queries = QUERIES[name]
+    since = str(datetime.datetime(2024, 1, 1) - datetime.timedelta(hours=1))
+    params = {
+        'token': [((digest if name == 'after' else digest.hex()),) for digest, *_ in rng.sample(tokens, min(count, len(tokens)))],
+        'rate_limit': [(key, since) for key, _, _ in rng.sample(windows, min(count, len(windows)))],
+    }
+    results = {}
+    for query_name, sql in queries.items():
+        plan = ' / '.join(row[-1] for row in connection.execute(f'EXPLAIN QUERY PLAN {sql}', params[query_name][0]))
+        timings = []
+        for values in params[query_name]:
+            start = time.perf_counter()
+            connection.execute(sql, values).fetchone()
+            timings.append((time.perf_counter() - start) * 1e6)
+        results[query_name] = (statistics.median(timings), statistics.quantiles(timings, n=20)[-1], plan)
+    connection.close()
+    return results
+
+
+def migrate(path):
+    from app import create_app
+    from app.startup import create_schema
+    from config import Config
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        STATIC_FINGERPRINT = False
+        LOG_LEVEL = 'WARNING'
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        start = time.monotonic()
+        migrated = create_schema()
+        return migrated, time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=1000000, help='magic link token rows')
+    parser.add_argument('--rate-limits', type=int, default=1000000, help='rate limit window rows')
+    parser.add_argument('--user-agents', type=int, default=200, help='distinct user agent strings')
+    parser.add_argument('--lookups', type=int, default=2000, help='timed lookups per query')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-schema-')
+    try:
+        tokens, windows = generate(args)
+        paths = {name: os.path.join(directory, f'{name}.db') for name in QUERIES}
+        fill_before(paths['before'], tokens, windows)
+        fill_after(paths['after'], tokens, windows)
+        shutil.copy(paths['before'], os.path.join(directory, 'migrated.db'))
+
+        measured = {name: sizes(path) for name, path in paths.items()}
+        objects = sorted(set(measured['before']) | set(measured['after']))
+        print(f"{'table or index':<40}{'before MB':>12}{'after MB':>12}")
+        for name in objects:
+            if any(table in name for table in ('magic_link_token', 'rate_limit', 'user_agent', 'used_token')):
+                before, after = measured['before'].get(name), measured['after'].get(name)
+                print(f"{name:<40}{(f'{before / 1e6:.1f}' if before else '-'):>12}"
+                      f"{(f'{after / 1e6:.1f}' if after else '-'):>12}")
+        print(f"{'file total':<40}{sum(measured['before'].values()) / 1e6:>12.1f}"
+              f"{sum(measured['after'].values()) / 1e6:>12.1f}\n")
+
+        print(f"{'query':<24}{'p50 us':>10}{'p95 us':>10}  plan")
+        for name, path in paths.items():
+            for query_name, (p50, p95, plan) in lookups(path, name, tokens, windows, args.lookups).items():
+                print(f'{name + " " + query_name:<24}{p50:>10.1f}{p95:>10.1f}  {plan}')
+
+        migrated, seconds = migrate(os.path.join(directory, 'migrated.db'))
+        print(f'\nMigrated {migrated} in {seconds:.1f}s')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
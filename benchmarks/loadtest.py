@@ -0,0 +1,234 @@
+"""
+End-to-end load test of the portal under gunicorn, against a local fake EPOS Now
+API and SMTP sink. Each virtual user repeatedly runs the full journey:
+
+    GET /login -> POST /login -> (magic link from the SMTP sink) -> GET /login/verify/<token>
+    -> GET /dashboard -> GET /code/<symbology>/<digest>.<fmt> -> GET /wallet/generate_pass
+
+and the report gives requests/sec and p50/p95/p99 latency per endpoint for every
+gunicorn configuration tried.
+
+    python -m benchmarks.loadtest --workers 1,4 --threads 1 --users 8 --duration 20 \\
+        --epos-latency 0.05 --epos-error-rate 0.01 --json run.json
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+from tests.stubs import FakeEposServer, SMTPSink
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+LINK_RE = re.compile(r'https?://\S+?/login/verify/[\w.-]+')
+CODE_RE = re.compile(r'src="(/code/\w+/[0-9a-f]+\.\w+)"')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def timed(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = func(*args, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self.errors[name] += 1
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples[name].append(elapsed)
+            if response.status_code >= 500:
+                self.errors[name] += 1
+        return response
+
+
+class MailboxReader:
+    """Finds the newest magic link the SMTP sink received for an address."""
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def wait_for_link(self, email, after, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for _, recipients, body in self.sink.messages[after:]:
+                if email in recipients:
+                    match = LINK_RE.search(body)
+                    if match:
+                        return match.group(0)
+            time.sleep(0.005)
+        raise TimeoutError(f'No magic link for {email}')
+
+
+def run_journey(base_url, email, recorder, mailbox):
+    http = requests.Session()
+    page = recorder.timed('GET /login', http.get, f'{base_url}/login')
+    token = CSRF_RE.search(page.text)
+    data = {'email': email}
+    if token:
+        data['csrf_token'] = token.group(1)
+
+    seen = len(mailbox.sink.messages)
+    recorder.timed('POST /login', http.post, f'{base_url}/login', data=data, allow_redirects=False)
+    link = mailbox.wait_for_link(email, seen)
+    recorder.timed('GET /login/verify/<token>', http.get, link, allow_redirects=False)
+
+    dashboard = recorder.timed('GET /dashboard', http.get, f'{base_url}/dashboard')
+    code = CODE_RE.search(dashboard.text)
+    if code:
+        recorder.timed('GET /code/<symbology>/<digest>.<fmt>', http.get, f'{base_url}{code.group(1)}')
+    recorder.timed('GET /wallet/generate_pass', http.get, f'{base_url}/wallet/generate_pass', allow_redirects=False)
+
+
+def start_gunicorn(workers, threads, port, env, verbose=False):
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+               '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'main:app']
+    output = None if verbose else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=output, stderr=output)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/login', timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def benchmark_config(workers, threads, args, stub, sink, customers):
+    port = free_port()
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+    env = dict(
+        os.environ,
+        SECRET_KEY='loadtest',
+        DATABASE_URL=f'sqlite:///{database}',
+        EPOS_BASE_URL=stub.base_url,
+        EPOS_API_KEY='loadtest',
+        EPOS_API_SECRET='loadtest',
+        MAIL_SERVER=sink.host,
+        MAIL_PORT=str(sink.port),
+        MAIL_USE_TLS='False',
+        MJ_APIKEY_PUBLIC='loadtest',
+        MJ_APIKEY_PRIVATE='loadtest',
+        RATE_LIMIT_EMAIL_HOUR='1000000',
+        RATE_LIMIT_IP_HOUR='1000000',
+        FLASK_DEBUG='0',
+    )
+    # Create the schema once up front so workers don't race to create it.
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', 'init-db'], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    process = start_gunicorn(workers, threads, port, env, verbose=args.verbose)
+
+    recorder = Recorder()
+    mailbox = MailboxReader(sink)
+    base_url = f'http://127.0.0.1:{port}'
+    stop_at = time.monotonic() + args.duration
+    journeys = [0]
+
+    def user(index):
+        email = customers[index % len(customers)]
+        while time.monotonic() < stop_at:
+            try:
+                run_journey(base_url, email, recorder, mailbox)
+                journeys[0] += 1
+            except (requests.RequestException, TimeoutError):
+                pass
+
+    started = time.monotonic()
+    users = [threading.Thread(target=user, args=(i,)) for i in range(args.users)]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    process.terminate()
+    process.wait(timeout=10)
+    os.unlink(database)
+    return summarize(recorder, elapsed, journeys[0])
+
+
+def summarize(recorder, elapsed, journeys):
+    endpoints = {}
+    total = 0
+    for name, samples in recorder.samples.items():
+        samples = sorted(samples)
+        total += len(samples)
+        endpoints[name] = {
+            'requests': len(samples),
+            'errors': recorder.errors.get(name, 0),
+            'rps': len(samples) / elapsed,
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+        }
+    return {'elapsed': elapsed, 'journeys': journeys, 'rps': total / elapsed, 'endpoints': endpoints}
+
+
+def print_report(label, result):
+    print(f"\n== {label}: {result['journeys']} journeys, {result['rps']:.1f} req/s overall")
+    print(f"{'endpoint':<28}{'reqs':>7}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, row in sorted(result['endpoints'].items()):
+        print(f"{name:<28}{row['requests']:>7}{row['errors']:>6}{row['rps']:>9.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2', help='comma-separated gunicorn worker counts')
+    parser.add_argument('--threads', default='1', help='comma-separated gunicorn thread counts')
+    parser.add_argument('--users', type=int, default=8, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=15, help='seconds per configuration')
+    parser.add_argument('--customers', type=int, default=50, help='distinct customers in the fake EPOS')
+    parser.add_argument('--epos-latency', type=float, default=0.02, help='fake EPOS latency in seconds')
+    parser.add_argument('--epos-error-rate', type=float, default=0.0, help='fraction of EPOS calls answered 503')
+    parser.add_argument('--smtp-latency', type=float, default=0.0, help='fake SMTP acceptance latency in seconds')
+    parser.add_argument('--verbose', action='store_true', help='show the app servers\' log output')
+    parser.add_argument('--json', help='also write the results to this file for run-to-run comparison')
+    args = parser.parse_args()
+
+    results = {}
+    with FakeEposServer(latency=args.epos_latency, error_rate=args.epos_error_rate) as stub, \
+            SMTPSink(latency=args.smtp_latency) as sink:
+        customers = [stub.add_customer({'EmailAddress': f'user{i}@example.com', 'Forename': f'User{i}'})['EmailAddress']
+                     for i in range(args.customers)]
+        for workers in [int(w) for w in args.workers.split(',')]:
+            for threads in [int(t) for t in args.threads.split(',')]:
+                label = f'workers={workers} threads={threads}'
+                results[label] = benchmark_config(workers, threads, args, stub, sink, customers)
+                print_report(label, results[label])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
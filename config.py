@@ -3,9 +3,146 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+basedir = os.path.abspath(os.path.dirname(__file__))
+certificates_dir = os.path.join(basedir, 'app', 'certificates')
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///app.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool per worker (ignored for in-memory SQLite; 0 means no pooling for SQLite files)
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+    # SQLite pragmas applied to every new connection
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # milliseconds
+    # The schema is created by `flask init-db`; set this to create it on every boot instead.
+    AUTO_CREATE_SCHEMA = os.environ.get('AUTO_CREATE_SCHEMA', 'False').lower() in ('1', 'true', 'yes')
     EPOS_API_KEY = os.environ.get('EPOS_API_KEY')
     EPOS_API_SECRET = os.environ.get('EPOS_API_SECRET')
+
+    # EPOS Now HTTP transport (one pooled session per worker process)
+    EPOS_BASE_URL = os.environ.get('EPOS_BASE_URL') or 'https://api.eposnowhq.com/api/v4'
+    EPOS_CONNECT_TIMEOUT = float(os.environ.get('EPOS_CONNECT_TIMEOUT', 3.05))
+    EPOS_READ_TIMEOUT = float(os.environ.get('EPOS_READ_TIMEOUT', 10))
+    EPOS_POOL_SIZE = int(os.environ.get('EPOS_POOL_SIZE', 10))
+    EPOS_MAX_RETRIES = int(os.environ.get('EPOS_MAX_RETRIES', 2))
+    EPOS_RETRY_BACKOFF = float(os.environ.get('EPOS_RETRY_BACKOFF', 0.3))
+    # Per-process cap on EPOS calls in flight; further requests queue up to EPOS_QUEUE_TIMEOUT
+    # seconds, then get a 503. Keep concurrency + queue below the gunicorn thread count.
+    EPOS_MAX_CONCURRENCY = int(os.environ.get('EPOS_MAX_CONCURRENCY', 6))
+    EPOS_QUEUE_SIZE = int(os.environ.get('EPOS_QUEUE_SIZE', 4))
+    EPOS_QUEUE_TIMEOUT = float(os.environ.get('EPOS_QUEUE_TIMEOUT', 2.0))
+    EPOS_RETRY_AFTER = int(os.environ.get('EPOS_RETRY_AFTER', 5))
+    # Per-process circuit breaker: over the last EPOS_CIRCUIT_WINDOW seconds (and at least
+    # EPOS_CIRCUIT_MIN_CALLS calls), this failure rate or rate of calls slower than
+    # EPOS_CIRCUIT_SLOW_CALL_SECONDS stops EPOS calls for EPOS_CIRCUIT_OPEN_SECONDS.
+    EPOS_CIRCUIT_ENABLED = os.environ.get('EPOS_CIRCUIT_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+    EPOS_CIRCUIT_FAILURE_RATE = float(os.environ.get('EPOS_CIRCUIT_FAILURE_RATE', 0.5))
+    EPOS_CIRCUIT_SLOW_CALL_SECONDS = float(os.environ.get('EPOS_CIRCUIT_SLOW_CALL_SECONDS', 5.0))
+    EPOS_CIRCUIT_SLOW_CALL_RATE = float(os.environ.get('EPOS_CIRCUIT_SLOW_CALL_RATE', 0.8))
+    EPOS_CIRCUIT_MIN_CALLS = int(os.environ.get('EPOS_CIRCUIT_MIN_CALLS', 10))
+    EPOS_CIRCUIT_WINDOW = float(os.environ.get('EPOS_CIRCUIT_WINDOW', 30))
+    EPOS_CIRCUIT_OPEN_SECONDS = float(os.environ.get('EPOS_CIRCUIT_OPEN_SECONDS', 30))
+    EPOS_CIRCUIT_HALF_OPEN_PROBES = int(os.environ.get('EPOS_CIRCUIT_HALF_OPEN_PROBES', 1))
+
+    # In-process customer cache in front of Customer/GetByEmail (size 0 disables it)
+    CUSTOMER_CACHE_SIZE = int(os.environ.get('CUSTOMER_CACHE_SIZE', 1024))
+    CUSTOMER_CACHE_TTL = float(os.environ.get('CUSTOMER_CACHE_TTL', 60))
+    CUSTOMER_CACHE_STALE_TTL = float(os.environ.get('CUSTOMER_CACHE_STALE_TTL', 300))
+
+    # Local mirror of EPOS customers, filled by `flask sync-customers`. When enabled,
+    # lookups use rows synced within CUSTOMER_MIRROR_MAX_STALENESS seconds before calling EPOS.
+    CUSTOMER_MIRROR_ENABLED = os.environ.get('CUSTOMER_MIRROR_ENABLED', 'False').lower() in ('1', 'true', 'yes')
+    CUSTOMER_MIRROR_MAX_STALENESS = int(os.environ.get('CUSTOMER_MIRROR_MAX_STALENESS', 900))
+    CUSTOMER_MIRROR_SYNC_BATCH = int(os.environ.get('CUSTOMER_MIRROR_SYNC_BATCH', 500))
+    CUSTOMER_MIRROR_REFRESH_AGE = int(os.environ.get('CUSTOMER_MIRROR_REFRESH_AGE', 300))
+
+    # Loyalty card codes (see app/codes.py for the symbologies): qr or code128, as svg or png
+    DASHBOARD_CODE_SYMBOLOGY = os.environ.get('DASHBOARD_CODE_SYMBOLOGY') or 'qr'
+    DASHBOARD_CODE_FORMAT = os.environ.get('DASHBOARD_CODE_FORMAT') or 'svg'
+    PASS_BARCODE_SYMBOLOGY = os.environ.get('PASS_BARCODE_SYMBOLOGY') or 'code128'
+
+    # Apple Wallet passes
+    PASS_TYPE_ID = os.environ.get('PASS_TYPE_ID') or 'pass.com.example.loyalty'
+    PASS_TEAM_ID = os.environ.get('PASS_TEAM_ID') or 'YOUR_TEAM_ID'
+    PASS_ORGANIZATION_NAME = os.environ.get('PASS_ORGANIZATION_NAME') or 'LoyaltyHI'
+    PASS_CERT_PATH = os.environ.get('PASS_CERT_PATH') or os.path.join(certificates_dir, 'pass.com.example.loyalty.pem')
+    PASS_KEY_PATH = os.environ.get('PASS_KEY_PATH') or os.path.join(certificates_dir, 'pass.com.example.loyalty.key')
+    PASS_WWDR_CERT_PATH = os.environ.get('PASS_WWDR_CERT_PATH') or os.path.join(certificates_dir, 'AppleWWDRCA.pem')
+    PASS_CERT_PASSWORD = os.environ.get('PASS_CERT_PASSWORD')
+    PASS_SIGNING_WORKERS = int(os.environ.get('PASS_SIGNING_WORKERS', 2))  # 0 signs inside the request
+    PASS_SIGNING_TIMEOUT = float(os.environ.get('PASS_SIGNING_TIMEOUT', 10))
+    PASS_CACHE_SIZE = int(os.environ.get('PASS_CACHE_SIZE', 512))
+    PASS_CACHE_TTL = float(os.environ.get('PASS_CACHE_TTL', 3600))
+
+    # Magic links: 'database' stores each token; 'signed' puts email and expiry in an
+    # HMAC-signed token and only records redeemed tokens (in UsedToken) for single use.
+    MAGIC_LINK_MODE = os.environ.get('MAGIC_LINK_MODE') or 'database'
+
+    # Login rate limiting: 'database' (RateLimit table, shared by all workers), 'redis' (shared,
+    # needs the redis package and RATE_LIMIT_STORAGE_URL) or 'memory' (no storage, but each worker
+    # keeps its own budget and a restart resets it, so limits become WEB_CONCURRENCY times looser)
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND') or 'database'
+    RATE_LIMIT_STORAGE_URL = os.environ.get('RATE_LIMIT_STORAGE_URL')
+    RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+    RATE_LIMIT_EMAIL_HOUR = int(os.environ.get('RATE_LIMIT_EMAIL_HOUR', 5))
+    RATE_LIMIT_IP_HOUR = int(os.environ.get('RATE_LIMIT_IP_HOUR', 20))
+
+    # Outbound mail (MailJet SMTP). The API key pair doubles as SMTP username/password.
+    MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'in-v3.mailjet.com'
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'True').lower() in ('1', 'true', 'yes')
+    MAIL_USERNAME = os.environ.get('MJ_APIKEY_PUBLIC') or os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MJ_APIKEY_PRIVATE') or os.environ.get('MAIL_PASSWORD')
+    MAIL_QUEUE_ENABLED = os.environ.get('MAIL_QUEUE_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+    MAIL_QUEUE_MAXSIZE = int(os.environ.get('MAIL_QUEUE_MAXSIZE', 10000))
+    MAIL_MAX_RETRIES = int(os.environ.get('MAIL_MAX_RETRIES', 3))
+    MAIL_RETRY_BACKOFF = float(os.environ.get('MAIL_RETRY_BACKOFF', 1.0))
+    # Seconds a stopping worker waits for queued emails to go out (keep under gunicorn's graceful_timeout)
+    MAIL_DRAIN_TIMEOUT = float(os.environ.get('MAIL_DRAIN_TIMEOUT', 10))
+    # `flask send-campaign`: links point at PORTAL_URL; sends are paced across a pool of connections
+    PORTAL_URL = os.environ.get('PORTAL_URL')
+    CAMPAIGN_BATCH_SIZE = int(os.environ.get('CAMPAIGN_BATCH_SIZE', 500))
+    CAMPAIGN_SMTP_CONNECTIONS = int(os.environ.get('CAMPAIGN_SMTP_CONNECTIONS', 4))
+    CAMPAIGN_SEND_RATE = float(os.environ.get('CAMPAIGN_SEND_RATE', 10))  # messages per second, 0 for no limit
+    CAMPAIGN_LINK_EXPIRY_HOURS = float(os.environ.get('CAMPAIGN_LINK_EXPIRY_HOURS', 72))
+
+    # Housekeeping of MagicLinkToken / RateLimit rows (`flask housekeeping`).
+    # HOUSEKEEPING_INTERVAL > 0 also runs it in-process every that many seconds.
+    HOUSEKEEPING_INTERVAL = int(os.environ.get('HOUSEKEEPING_INTERVAL', 0))
+    HOUSEKEEPING_BATCH_SIZE = int(os.environ.get('HOUSEKEEPING_BATCH_SIZE', 500))
+    HOUSEKEEPING_TOKEN_RETENTION = int(os.environ.get('HOUSEKEEPING_TOKEN_RETENTION', 24 * 3600))
+    HOUSEKEEPING_RATE_LIMIT_RETENTION = int(os.environ.get('HOUSEKEEPING_RATE_LIMIT_RETENTION', 3600))
+
+    # Prometheus text metrics at /metrics, served only with METRICS_TOKEN as a bearer token
+    # (or in debug). Under several gunicorn workers set METRICS_DIR to a shared writable
+    # directory so every worker's numbers are merged into one scrape.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+    # Logging goes through a bounded queue and a writer thread; a full queue drops records
+    # instead of blocking requests. LOG_SAMPLE_RATES keeps a fraction of tagged events.
+    LOG_LEVEL = (os.environ.get('LOG_LEVEL') or 'INFO').upper()
+    LOG_FORMAT = os.environ.get('LOG_FORMAT') or 'json'  # json or text
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', 'epos.request=0.1')
+    LOG_REDACT = os.environ.get('LOG_REDACT', 'True').lower() in ('1', 'true', 'yes')
+
+    # Request profiling: every request (PROFILE_ENABLED), a random sample, or requests sent
+    # with an X-Profile-Token header from `flask profile-token`. See `flask profile-report`.
+    PROFILE_ENABLED = os.environ.get('PROFILE_ENABLED', 'False').lower() in ('1', 'true', 'yes')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_ALLOW_TOKEN = os.environ.get('PROFILE_ALLOW_TOKEN', 'True').lower() in ('1', 'true', 'yes')
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(basedir, 'profiles')
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+
+    # Static files are served under content-hashed names with a one-year immutable
+    # Cache-Control, gzip/brotli precompressed at startup. `flask build-assets` exports them.
+    STATIC_FINGERPRINT = os.environ.get('STATIC_FINGERPRINT', 'True').lower() in ('1', 'true', 'yes')
+    STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 31536000))
+    STATIC_COMPRESS_MIN_SIZE = int(os.environ.get('STATIC_COMPRESS_MIN_SIZE', 256))
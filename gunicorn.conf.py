@@ -0,0 +1,45 @@
+"""
+gunicorn settings. With preload (the default) the app is imported and warmed up
+once in the master, and workers are forked with templates compiled and the pass
+signer parsed, so scaling up a dyno does not pay for it per worker.
+
+Workers are threaded (gthread) by default. EPOS-bound views can hold at most
+EPOS_MAX_CONCURRENCY + EPOS_QUEUE_SIZE threads per worker (see config.py); the
+remaining threads keep serving /login and static files while EPOS Now is slow.
+Set GUNICORN_WORKER_CLASS=sync to go back to one request per process.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 12 if worker_class == 'gthread' else 1))
+# Shed queued connections rather than let them pile up behind busy threads.
+backlog = int(os.environ.get('GUNICORN_BACKLOG', 256))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() in ('1', 'true', 'yes')
+
+
+def _warm_up(wsgi_app):
+    from app.startup import warm_up
+
+    warm_up(wsgi_app)
+
+
+def when_ready(server):
+    if preload_app:
+        _warm_up(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        _warm_up(worker.wsgi)
+
+
+def child_exit(server, worker):
+    # A dead worker's metrics snapshot must not stay in the merged /metrics totals.
+    directory = os.environ.get('METRICS_DIR')
+    if directory:
+        from app.metrics import remove_snapshot
+
+        remove_snapshot(directory, worker.pid)
@@ -0,0 +1,29 @@
+import pytest
+from app import create_app, db, epos_client
+from config import Config
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    WTF_CSRF_ENABLED = False
+    SECRET_KEY = 'test-secret-key'
+    PASS_SIGNING_WORKERS = 0
+
+@pytest.fixture(autouse=True)
+def transport_settings():
+    """Puts back every EPOS transport setting a test, or an app it created, changed."""
+    saved = dict(epos_client.TRANSPORT_SETTINGS)
+    yield
+    epos_client.TRANSPORT_SETTINGS.clear()
+    epos_client.TRANSPORT_SETTINGS.update(saved)
+    epos_client.reset_transport()
+
+@pytest.fixture
+def client():
+    app = create_app(TestConfig)
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+    with app.app_context():
+        db.drop_all()
@@ -0,0 +1,241 @@
+"""Local stand-ins for the external services the portal talks to."""
+import json
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class _EposHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload=None):
+        body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'null')
+
+    def _simulate(self):
+        """Applies the configured latency; returns False if this call should fail."""
+        stub = self.server.stub
+        stub.request_count += 1
+        if stub.latency:
+            time.sleep(stub.latency)
+        if stub.error_rate and random.random() < stub.error_rate:
+            self._send_json(503, {'Message': 'Service Unavailable'})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._simulate():
+            return
+        stub = self.server.stub
+        url = urlparse(self.path)
+        path = url.path[len(stub.prefix):].strip('/')
+        query = parse_qs(url.query)
+        if path == 'Customer/GetByEmail':
+            email = query.get('email', [''])[0].lower()
+            customer = stub.find_by_email(email)
+            return self._send_json(200, [customer] if customer else [])
+        if path == 'Customer':
+            page = int(query.get('page', ['1'])[0])
+            customers = sorted(stub.customers.values(), key=lambda c: c['Id'])
+            start = (page - 1) * stub.page_size
+            return self._send_json(200, customers[start:start + stub.page_size])
+        if path.startswith('Customer/'):
+            customer = stub.customers.get(int(path.split('/', 1)[1]))
+            if customer is None:
+                return self._send_json(404, {'Message': 'Not Found'})
+            return self._send_json(200, customer)
+        self._send_json(404, {'Message': 'Not Found'})
+
+    def do_PUT(self):
+        if not self._simulate():
+            return
+        stub = self.server.stub
+        updated = []
+        for record in self._read_json():
+            if record.get('Id') not in stub.customers:
+                return self._send_json(400, {'Message': f"Customer {record.get('Id')} does not exist"})
+            stub.customers[record['Id']].update(record)
+            updated.append(stub.customers[record['Id']])
+        self._send_json(200, updated)
+
+    def do_POST(self):
+        if not self._simulate():
+            return
+        stub = self.server.stub
+        self._send_json(201, [stub.add_customer(record) for record in self._read_json()])
+
+
+class FakeEposServer:
+    """
+    An in-memory EPOS Now Customer API served over HTTP on localhost.
+    `latency` (seconds) and `error_rate` (0-1, answered with 503) shape every response.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, page_size=200, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.prefix = '/api/v4'
+        self.customers = {}
+        self.request_count = 0
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _EposHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}{self.prefix}'
+
+    def add_customer(self, data):
+        with self._lock:
+            customer = {
+                'Id': self._next_id,
+                'Forename': '',
+                'Surname': '',
+                'EmailAddress': '',
+                'ContactNumber': '',
+                'CardNumber': f'{9000000000 + self._next_id}',
+                'CurrentPoints': 0,
+                'MarketingConsent': {'Email': False, 'Text': False},
+            }
+            customer.update(data)
+            customer['Id'] = self._next_id
+            self.customers[customer['Id']] = customer
+            self._next_id += 1
+            return customer
+
+    def find_by_email(self, email):
+        for customer in self.customers.values():
+            if customer['EmailAddress'].lower() == email:
+                return customer
+        return None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def _reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode('ascii'))
+
+    def handle(self):
+        sink = self.server.sink
+        with sink._lock:
+            sink.connections += 1
+        self._reply('220 localhost SMTP sink ready')
+        mail_from, recipients = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            verb = line.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self._reply('250-localhost')
+                self._reply('250-AUTH PLAIN LOGIN')
+                self._reply('250 8BITMIME')
+            elif verb == 'AUTH':
+                self._reply('235 Authentication successful')
+            elif verb == 'MAIL':
+                mail_from, recipients = line.split(':', 1)[1].strip(' <>'), []
+                self._reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(line.split(':', 1)[1].strip(' <>'))
+                self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(chunk[1:] if chunk.startswith(b'..') else chunk)
+                if sink.latency:
+                    time.sleep(sink.latency)
+                with sink._lock:
+                    if sink.fail_next > 0:
+                        sink.fail_next -= 1
+                        self._reply('451 Temporary failure, try again')
+                        continue
+                    sink.messages.append((mail_from, recipients, b''.join(data).decode('utf-8', 'replace')))
+                self._reply('250 OK queued')
+            elif verb in ('RSET', 'NOOP'):
+                self._reply('250 OK')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
+
+
+class SMTPSink:
+    """
+    A minimal SMTP server that accepts any login and keeps delivered messages in
+    `messages` as (sender, recipients, raw message). `fail_next` answers that many
+    DATA commands with a transient 451; `latency` delays every acceptance.
+    """
+
+    def __init__(self, latency=0.0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.messages = []
+        self.connections = 0
+        self.fail_next = 0
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer((host, port), _SMTPHandler)
+        self._server.daemon_threads = True
+        self._server.sink = self
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,27 +1,7 @@
-import pytest
 import datetime
-import hashlib
 import secrets
-from app import create_app, db
-from app.models import MagicLinkToken
-from config import Config
-from flask import session
-
-class TestConfig(Config):
-    TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
-    WTF_CSRF_ENABLED = False
-    SECRET_KEY = 'test-secret-key'
-
-@pytest.fixture
-def client():
-    app = create_app(TestConfig)
-    with app.test_client() as client:
-        with app.app_context():
-            db.create_all()
-        yield client
-    with app.app_context():
-        db.drop_all()
+from app import db, magic_links
+from app.models import MagicLinkToken, UserAgent
 
 def test_magic_link_creation_and_expiry(client):
     """Test that a magic link is created and expires correctly."""
@@ -34,6 +14,8 @@ def test_magic_link_creation_and_expiry(client):
         token_entry = MagicLinkToken.query.filter_by(email='test@example.com').first()
         assert token_entry is not None
         assert token_entry.is_valid()
+        assert len(token_entry.token_digest) == 32
+        assert token_entry.user_agent.startswith('werkzeug/')
 
         # 3. Simulate token expiry
         token_entry.expires_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
@@ -46,14 +28,14 @@ def test_magic_link_single_use(client):
         # 1. Create a valid token
         email = 'single-use@example.com'
         token = secrets.token_urlsafe(32)
-        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        token_digest = magic_links.token_digest(token)
         expires_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=15)
         new_token = MagicLinkToken(
             email=email,
-            token_hash=token_hash,
+            token_digest=token_digest,
             expires_at=expires_at,
             request_ip='127.0.0.1',
-            user_agent='pytest'
+            user_agent_id=UserAgent.id_for('pytest')
         )
         db.session.add(new_token)
         db.session.commit()
@@ -68,7 +50,7 @@ def test_magic_link_single_use(client):
             assert sess['user_email'] == email
 
         # 3. Check that the token is marked as used
-        used_token = MagicLinkToken.query.filter_by(token_hash=token_hash).first()
+        used_token = MagicLinkToken.query.filter_by(token_digest=token_digest).first()
         assert used_token.used_at is not None
         assert not used_token.is_valid()
 
@@ -82,14 +64,14 @@ def test_login_session_creation(client):
     with client.application.app_context():
         email = 'session@example.com'
         token = secrets.token_urlsafe(32)
-        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        token_digest = magic_links.token_digest(token)
         expires_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=15)
         new_token = MagicLinkToken(
             email=email,
-            token_hash=token_hash,
+            token_digest=token_digest,
             expires_at=expires_at,
             request_ip='127.0.0.1',
-            user_agent='pytest'
+            user_agent_id=UserAgent.id_for('pytest')
         )
         db.session.add(new_token)
         db.session.commit()
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+from app import create_app, db, epos_client
+from app.backpressure import CircuitBreaker, CircuitOpen, ConcurrencyLimiter, UpstreamSaturated
+from tests.conftest import TestConfig
+from tests.stubs import FakeEposServer
+
+def test_limiter_queues_then_sheds():
+    """Test that callers beyond the limit wait for a slot, and overflow is rejected."""
+    limiter = ConcurrencyLimiter('upstream', max_concurrency=1, max_waiting=1, timeout=5)
+    limiter.acquire()
+
+    acquired = threading.Event()
+    def waiter():
+        with limiter.slot():
+            acquired.set()
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while limiter.waiting == 0:
+        time.sleep(0.001)
+
+    with pytest.raises(UpstreamSaturated):
+        limiter.acquire()  # the queue is full
+    limiter.release()
+    thread.join(timeout=5)
+    assert acquired.is_set()
+    assert limiter.stats() == {'in_flight': 0, 'waiting': 0, 'rejected': 1}
+
+def test_limiter_wait_deadline():
+    """Test that a queued caller gives up at its deadline."""
+    limiter = ConcurrencyLimiter('upstream', max_concurrency=1, max_waiting=5, timeout=0.05, retry_after=7)
+    limiter.acquire()
+    with pytest.raises(UpstreamSaturated) as info:
+        limiter.acquire()
+    assert info.value.retry_after == 7
+    assert limiter.waiting == 0
+
+def test_saturated_epos_sheds_dashboard_but_not_login(monkeypatch):
+    """Test that a saturated EPOS answers the dashboard with a fast 503 while /login still works."""
+    monkeypatch.setenv('EPOS_API_KEY', 'key')
+    monkeypatch.setenv('EPOS_API_SECRET', 'secret')
+    with FakeEposServer() as stub:
+        class SaturatedConfig(TestConfig):
+            EPOS_BASE_URL = stub.base_url
+            EPOS_MAX_CONCURRENCY = 1
+            EPOS_QUEUE_SIZE = 0
+            EPOS_RETRY_AFTER = 3
+        app = create_app(SaturatedConfig)
+        with app.app_context():
+            db.create_all()
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_email'] = 'busy@example.com'
+
+        epos_client.upstream_limiter.acquire()  # a slow call holding the only slot
+        try:
+            response = client.get('/dashboard')
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == '3'
+            assert b'a little busy' in response.data
+            assert stub.request_count == 0
+            assert client.get('/login').status_code == 200
+        finally:
+            epos_client.upstream_limiter.release()
+        assert client.get('/dashboard').status_code == 200
+    epos_client.customer_cache.clear()
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_circuit_opens_on_error_rate_then_probes():
+    """Test that failures open the circuit, which fails fast, then closes after a good half-open probe."""
+    clock = FakeClock()
+    transitions = []
+    breaker = CircuitBreaker('upstream', failure_rate=0.5, min_calls=4, window=10, open_seconds=30,
+                             on_transition=lambda old, new: transitions.append(new), clock=clock)
+    for failed in (False, True, False, True):
+        breaker.before_call()
+        breaker.record(failed, 0.01)
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpen) as info:
+        breaker.before_call()
+    assert info.value.retry_after == 30
+
+    clock.now = 31
+    breaker.before_call()  # the probe
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()  # only one probe at a time
+    breaker.record(True, 0.01)
+    assert breaker.state == 'open'
+
+    clock.now = 62
+    breaker.before_call()
+    breaker.record(False, 0.01)
+    assert breaker.state == 'closed'
+    assert transitions == ['open', 'half_open', 'open', 'half_open', 'closed']
+
+def test_circuit_opens_on_slow_calls_and_forgets_old_outcomes():
+    """Test that slow successes count against the circuit, and outcomes outside the window are dropped."""
+    clock = FakeClock()
+    breaker = CircuitBreaker('upstream', slow_call_seconds=1.0, slow_call_rate=0.5, min_calls=2, window=10,
+                             clock=clock)
+    breaker.record(False, 2.0)
+    clock.now = 20
+    breaker.record(False, 2.0)
+    assert breaker.state == 'closed'
+    breaker.record(False, 3.0)
+    assert breaker.state == 'open'
+
+def test_open_circuit_fails_epos_calls_fast(monkeypatch):
+    """Test that an EPOS outage opens the circuit so later calls never reach the API."""
+    monkeypatch.setenv('EPOS_API_KEY', 'key')
+    monkeypatch.setenv('EPOS_API_SECRET', 'secret')
+    with FakeEposServer(error_rate=1.0) as stub:
+        epos_client.configure_transport(EPOS_BASE_URL=stub.base_url, EPOS_MAX_RETRIES=0)
+        epos_client.upstream_circuit.configure(min_calls=3, failure_rate=0.5)
+        client = epos_client.EposNowClient()
+        try:
+            for i in range(3):
+                with pytest.raises(Exception):
+                    client.get_customer_by_email(f'down{i}@example.com')
+            assert stub.request_count == 3
+            with pytest.raises(CircuitOpen):
+                client.get_customer_by_email('down@example.com')
+            assert stub.request_count == 3
+        finally:
+            epos_client.upstream_circuit.configure(min_calls=10)
+            epos_client.customer_cache.clear()
@@ -0,0 +1,53 @@
+import threading
+
+from app.cache import TTLCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_entries_go_stale_then_expire():
+    """Test that an entry is fresh, then stale, then gone."""
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=10, stale_ttl=20, clock=clock)
+    cache.set('a', 1)
+
+    assert cache.lookup('a') == (1, False)
+    clock.now = 15
+    assert cache.lookup('a') == (1, True)
+    clock.now = 31
+    assert cache.lookup('a') == (None, False)
+    assert len(cache) == 0
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['stale_hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_least_recently_used_entry_is_evicted():
+    """Test that the cache stays within maxsize by evicting the LRU entry."""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+def test_only_one_caller_claims_a_refresh():
+    """Test that concurrent revalidations of the same key are collapsed."""
+    cache = TTLCache()
+    claims = []
+    threads = [threading.Thread(target=lambda: claims.append(cache.begin_refresh('k'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert claims.count(True) == 1
+    cache.end_refresh('k')
+    assert cache.begin_refresh('k')
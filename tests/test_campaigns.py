@@ -0,0 +1,82 @@
+import pytest
+
+from app import create_app, db
+from app.campaigns import Throttle, read_emails, send_campaign_command
+from app.models import MagicLinkToken
+from tests.conftest import TestConfig
+from tests.stubs import SMTPSink
+
+@pytest.fixture
+def sink():
+    with SMTPSink() as server:
+        yield server
+
+@pytest.fixture
+def app(sink):
+    class CampaignConfig(TestConfig):
+        MAIL_SERVER = sink.host
+        MAIL_PORT = sink.port
+        MAIL_USE_TLS = False
+        MAIL_USERNAME = 'user'
+        MAIL_PASSWORD = 'secret'
+        MAIL_RETRY_BACKOFF = 0
+        PORTAL_URL = 'https://portal.example.com'
+        CAMPAIGN_SEND_RATE = 0
+    app = create_app(CampaignConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.drop_all()
+
+def write_list(tmp_path, count):
+    path = tmp_path / 'customers.csv'
+    path.write_text('email,name\n' + ''.join(f'User{i}@Example.com,User {i}\n' for i in range(count)) + '\n# done\n')
+    return str(path)
+
+def test_read_emails_streams_and_skips_headers_and_comments():
+    """Test that the first column is read, normalized, and non-addresses are skipped."""
+    lines = ['email,name\n', ' A@Example.com ,Ada\n', '\n', '# note\n', '"b@example.com"\n']
+    assert list(read_emails(lines)) == [(2, 'a@example.com'), (5, 'b@example.com')]
+    assert list(read_emails(lines, skip=2)) == [(5, 'b@example.com')]
+
+def test_campaign_bulk_inserts_tokens_and_reuses_connections(app, sink, tmp_path):
+    """Test that every address gets a stored token and an email, over at most `--connections` SMTP sessions."""
+    emails_file = write_list(tmp_path, 7)
+    result = app.test_cli_runner().invoke(send_campaign_command,
+                                          [emails_file, '--batch-size', '3', '--connections', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Sent 7 links (0 failed)' in result.output and 'msg/s' in result.output
+
+    assert sorted(recipients[0] for _, recipients, _ in sink.messages) == sorted(
+        f'user{i}@example.com' for i in range(7))
+    assert sink.connections <= 2
+    assert 'https://portal.example.com/login/verify/' in sink.messages[0][2]
+    tokens = MagicLinkToken.query.all()
+    assert len(tokens) == 7
+    assert tokens[0].user_agent == 'campaign:customers.csv'
+    assert (tokens[0].expires_at - tokens[0].created_at).total_seconds() == pytest.approx(72 * 3600)
+
+def test_campaign_resumes_after_the_last_finished_batch(app, sink, tmp_path):
+    """Test that a re-run skips addresses already sent, and --restart starts over."""
+    emails_file = write_list(tmp_path, 4)
+    runner = app.test_cli_runner()
+    runner.invoke(send_campaign_command, [emails_file, '--batch-size', '2'])
+    assert len(sink.messages) == 4
+
+    with open(emails_file, 'a') as f:
+        f.write('late@example.com\n')
+    result = runner.invoke(send_campaign_command, [emails_file, '--batch-size', '2'])
+    assert 'Resumed after line 5' in result.output
+    assert [recipients for _, recipients, _ in sink.messages[4:]] == [['late@example.com']]
+
+    runner.invoke(send_campaign_command, [emails_file, '--restart'])
+    assert len(sink.messages) == 10
+
+def test_throttle_spaces_sends():
+    """Test that the throttle hands out one slot per interval across callers."""
+    now = [0.0]
+    sleeps = []
+    throttle = Throttle(rate=4, clock=lambda: now[0], sleep=sleeps.append)
+    for _ in range(3):
+        throttle.acquire()
+    assert sleeps == [0.25, 0.5]
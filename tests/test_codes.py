@@ -0,0 +1,64 @@
+import re
+import subprocess
+import sys
+import xml.etree.ElementTree as ET
+
+import png
+
+from app.codes import SYMBOLOGIES, card_digest, render_code
+
+def log_in(client, card_number):
+    with client.session_transaction() as sess:
+        sess['user_email'] = 'code@example.com'
+        sess['card_number'] = card_number
+
+def test_qr_svg_is_drawn_from_the_module_matrix():
+    """Test that the SVG path covers exactly the dark modules of the QR matrix."""
+    matrix = SYMBOLOGIES['qr'].matrix('9000000001')
+    svg = ET.fromstring(render_code('9000000001', 'qr', 'svg'))
+    assert svg.get('viewBox') == f'0 0 {len(matrix)} {len(matrix)}'
+    assert svg.get('width') == str(len(matrix) * 10)
+    path = svg.find('{http://www.w3.org/2000/svg}path').get('d')
+    drawn = sum(int(length) for length in re.findall(r'h(\d+)', path))
+    assert drawn == sum(sum(row) for row in matrix)
+    assert path.count('M') == sum(1 for row in matrix if any(row))
+
+def test_png_matches_matrix_for_both_symbologies():
+    """Test that the PNG encodes the same modules at the symbology's scale."""
+    for name in ('qr', 'code128'):
+        spec = SYMBOLOGIES[name]
+        matrix = spec.matrix('9000000001')
+        width, height, rows, info = png.Reader(bytes=render_code('9000000001', name, 'png')).read()
+        rows = list(rows)
+        assert width == len(matrix[0]) * spec.scale
+        assert height == (spec.bar_height or len(matrix)) * spec.scale
+        assert info['bitdepth'] == 1
+        first_row = [not pixel for pixel in rows[0][::spec.scale]]
+        assert first_row == matrix[0]
+
+def test_code128_svg_has_full_height_bars():
+    """Test that a linear code is one row of bars stretched to its bar height."""
+    svg = ET.fromstring(render_code('9000000001', 'code128', 'svg'))
+    path = svg.find('{http://www.w3.org/2000/svg}path')
+    assert path.get('stroke-width') == '40'
+    assert path.get('d').count('M') == 1
+    assert svg.get('height') == str(40 * 2)
+
+def test_rendering_does_not_need_pil():
+    """Test that SVG and PNG rendering work with PIL unavailable."""
+    code = ("import sys\nsys.modules['PIL'] = None\nfrom app.codes import render_code\n"
+            "render_code('1', 'qr', 'svg'); render_code('1', 'qr', 'png'); render_code('1', 'code128', 'png')\n"
+            "print('ok')")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert result.stdout.strip() == 'ok', result.stderr
+
+def test_code_route_serves_svg(client):
+    """Test that /code/ serves the requested symbology and format for the session's card."""
+    log_in(client, card_number='9000000001')
+    digest = card_digest('9000000001')
+    response = client.get(f'/code/code128/{digest}.svg')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/svg+xml'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert client.get(f'/code/aztec/{digest}.svg').status_code == 404
+    assert client.get(f'/code/qr/{digest}.gif').status_code == 404
@@ -0,0 +1,87 @@
+import datetime
+
+import pytest
+
+from app import create_app, db, epos_client
+from app.customer_mirror import sync_customers_command
+from app.epos_client import EposNowClient
+from app.models import MirroredCustomer
+from tests.conftest import TestConfig
+from tests.stubs import FakeEposServer
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setenv('EPOS_API_KEY', 'key')
+    monkeypatch.setenv('EPOS_API_SECRET', 'secret')
+    with FakeEposServer(page_size=2) as server:
+        for i in range(5):
+            server.add_customer({'EmailAddress': f'user{i}@example.com', 'Forename': f'User{i}', 'CurrentPoints': i})
+        yield server
+    epos_client.customer_cache.clear()
+
+@pytest.fixture
+def app(stub):
+    class MirrorConfig(TestConfig):
+        EPOS_BASE_URL = stub.base_url
+        CUSTOMER_MIRROR_ENABLED = True
+        CUSTOMER_MIRROR_REFRESH_AGE = 0
+    app = create_app(MirrorConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.drop_all()
+
+def test_full_sync_pages_through_customers_and_drops_deleted(stub, app):
+    """Test that a full sync mirrors every page and removes customers gone from EPOS."""
+    result = app.test_cli_runner().invoke(sync_customers_command, ['--full'])
+    assert result.exit_code == 0, result.output
+    assert 'pages=3' in result.output and 'upserted=5' in result.output
+    row = MirroredCustomer.query.filter_by(email='user3@example.com').one()
+    assert (row.forename, row.current_points, row.card_number) == ('User3', 3, '9000000004')
+
+    del stub.customers[1]
+    result = app.test_cli_runner().invoke(sync_customers_command, ['--full'])
+    assert 'removed=1' in result.output
+    assert MirroredCustomer.query.count() == 4
+
+def test_incremental_sync_refreshes_stalest_rows(stub, app):
+    """Test that an incremental run re-fetches the oldest rows by Id."""
+    app.test_cli_runner().invoke(sync_customers_command, ['--full'])
+    stub.customers[2]['CurrentPoints'] = 500
+    del stub.customers[5]
+
+    result = app.test_cli_runner().invoke(sync_customers_command, ['--batch-size', '10'])
+    assert result.exit_code == 0, result.output
+    assert 'refreshed=4' in result.output and 'removed=1' in result.output
+    assert db.session.get(MirroredCustomer, 2).current_points == 500
+
+def test_lookup_is_served_from_fresh_mirror_rows(stub, app):
+    """Test that get_customer_by_email uses the mirror within max staleness and EPOS otherwise."""
+    app.test_cli_runner().invoke(sync_customers_command, ['--full'])
+    client = EposNowClient()
+    epos_client.customer_cache.clear()
+    calls = stub.request_count
+    assert client.get_customer_by_email('USER2@example.com')['Forename'] == 'User2'
+    assert stub.request_count == calls
+
+    MirroredCustomer.query.update({'synced_at': datetime.datetime.utcnow() - datetime.timedelta(hours=1)})
+    db.session.commit()
+    epos_client.customer_cache.clear()
+    stub.customers[3]['Forename'] = 'Renamed'
+    assert client.get_customer_by_email('user2@example.com')['Forename'] == 'Renamed'
+    assert stub.request_count == calls + 1
+    # The live answer was written back to the mirror.
+    assert db.session.get(MirroredCustomer, 3).forename == 'Renamed'
+
+def test_mirror_hits_report_when_they_were_synced(stub, app):
+    """Test that a record served from the mirror is reported as fetched when its row was synced, not now."""
+    app.test_cli_runner().invoke(sync_customers_command, ['--full'])
+    MirroredCustomer.query.update({'synced_at': datetime.datetime.utcnow() - datetime.timedelta(minutes=10)})
+    db.session.commit()
+    client = EposNowClient()
+    epos_client.customer_cache.clear()
+
+    customer = client.get_customer_by_email('user1@example.com')
+    age = datetime.datetime.now() - client.fetched_at(customer_id=customer['Id'])
+    assert datetime.timedelta(minutes=9) < age < datetime.timedelta(minutes=11)
+    assert client.get_customer_by_email('user1@example.com') == customer
@@ -0,0 +1,159 @@
+import shutil
+
+import pytest
+
+from app import create_app, db, epos_client
+from tests.conftest import TestConfig
+from tests.stubs import FakeEposServer
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setenv('EPOS_API_KEY', 'key')
+    monkeypatch.setenv('EPOS_API_SECRET', 'secret')
+    with FakeEposServer() as server:
+        yield server
+    epos_client.customer_cache.clear()
+
+@pytest.fixture
+def portal(stub):
+    class StubConfig(TestConfig):
+        EPOS_BASE_URL = stub.base_url
+    app = create_app(StubConfig)
+    with app.app_context():
+        db.create_all()
+    with app.test_client() as client:
+        yield client
+
+def test_dashboard_answers_unchanged_balance_with_304(stub, portal):
+    """Test that the dashboard revalidates on the displayed customer fields."""
+    customer = stub.add_customer({'EmailAddress': 'etag@example.com', 'Forename': 'Ada', 'Surname': 'Lovelace',
+                                  'CardNumber': '9000000003', 'CurrentPoints': 250})
+    with portal.session_transaction() as sess:
+        sess['user_email'] = 'etag@example.com'
+
+    first = portal.get('/dashboard')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    assert 'no-cache' in first.headers['Cache-Control'] and 'private' in first.headers['Cache-Control']
+    assert b'Last updated' in first.data
+
+    assert portal.get('/dashboard', headers={'If-None-Match': etag}).status_code == 304
+
+    customer['CurrentPoints'] = 300
+    epos_client.customer_cache.clear()
+    changed = portal.get('/dashboard', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert '£3.00' in changed.get_data(as_text=True)
+
+    portal.application.config['DASHBOARD_CODE_SYMBOLOGY'] = 'code128'
+    etag = changed.headers['ETag']
+    restyled = portal.get('/dashboard', headers={'If-None-Match': etag})
+    assert restyled.status_code == 200
+    assert '/code/code128/' in restyled.get_data(as_text=True)
+
+def test_dashboard_etag_changes_when_a_static_file_does(stub, portal, tmp_path):
+    """Test that a deploy with a new stylesheet is not answered with a 304 for HTML linking the old hashed file."""
+    stub.add_customer({'EmailAddress': 'deploy@example.com', 'Forename': 'Ada', 'CardNumber': '9000000005'})
+    with portal.session_transaction() as sess:
+        sess['user_email'] = 'deploy@example.com'
+    app = portal.application
+    etag = portal.get('/dashboard').headers['ETag']
+
+    static = tmp_path / 'static'
+    shutil.copytree(app.static_folder, static)
+    with open(static / 'style.css', 'a') as f:
+        f.write('\n.deployed { color: red; }\n')
+    assets = app.extensions['static_assets']
+    assets.build(str(static))
+    try:
+        response = portal.get('/dashboard', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert assets.assets['style.css'].hashed_name in response.get_data(as_text=True)
+    finally:
+        assets.build(app.static_folder)
+
+def test_dashboard_edit_form_and_flashes_are_not_cached(stub, portal):
+    """Test that views carrying a form or a flash message are always rendered."""
+    stub.add_customer({'EmailAddress': 'form@example.com', 'Forename': 'Ada', 'CardNumber': '9000000004'})
+    with portal.session_transaction() as sess:
+        sess['user_email'] = 'form@example.com'
+    etag = portal.get('/dashboard').headers['ETag']
+
+    assert 'ETag' not in portal.get('/dashboard?edit=true').headers
+    with portal.session_transaction() as sess:
+        sess['_flashes'] = [('success', 'Your profile has been updated successfully!')]
+    flashed = portal.get('/dashboard', headers={'If-None-Match': etag})
+    assert flashed.status_code == 200
+    assert b'updated successfully' in flashed.data
+
+def test_profile_save_reads_live_and_reuses_the_put(stub, portal):
+    """Test that saving reads the record live and PUTs it, and the redirected page uses the record the PUT returned."""
+    customer = stub.add_customer({'EmailAddress': 'save@example.com', 'Forename': 'Ada', 'Surname': 'Lovelace'})
+    with portal.session_transaction() as sess:
+        sess['user_email'] = 'save@example.com'
+        sess['customer_id'] = customer['Id']
+    portal.get('/dashboard?edit=true')
+    stub.request_count = 0
+
+    response = portal.post('/dashboard', data={'forename': 'Grace', 'surname': 'Hopper'}, follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Grace Hopper' in response.data
+    assert stub.request_count == 2
+    assert stub.customers[customer['Id']]['Forename'] == 'Grace'
+
+def test_profile_save_keeps_points_earned_since_the_page_was_viewed(stub, portal):
+    """Test that a save does not write back the balance the dashboard showed when points changed in between."""
+    customer = stub.add_customer({'EmailAddress': 'till@example.com', 'Forename': 'Ada', 'CurrentPoints': 100})
+    with portal.session_transaction() as sess:
+        sess['user_email'] = 'till@example.com'
+        sess['customer_id'] = customer['Id']
+    assert '£1.00' in portal.get('/dashboard').get_data(as_text=True)
+
+    customer['CurrentPoints'] = 500
+    response = portal.post('/dashboard', data={'forename': 'Grace', 'surname': 'Hopper'}, follow_redirects=True)
+    assert response.status_code == 200
+    assert stub.customers[customer['Id']]['CurrentPoints'] == 500
+    assert stub.customers[customer['Id']]['Forename'] == 'Grace'
+    assert '£5.00' in response.get_data(as_text=True)
+
+def test_invalid_profile_post_does_not_call_epos(stub, portal):
+    """Test that a form that fails validation is shown again without fetching the customer."""
+    customer = stub.add_customer({'EmailAddress': 'invalid@example.com', 'Forename': 'Ada'})
+    with portal.session_transaction() as sess:
+        sess['user_email'] = 'invalid@example.com'
+        sess['customer_id'] = customer['Id']
+
+    response = portal.post('/dashboard', data={'forename': '', 'surname': ''})
+    assert response.status_code == 200
+    assert b'Edit Your Profile' in response.data
+    assert stub.request_count == 0
+
+def test_dashboard_degrades_to_last_known_balance_when_circuit_is_open(stub, portal):
+    """Test that with the circuit open the dashboard shows the session's last known balance without calling EPOS."""
+    customer = stub.add_customer({'EmailAddress': 'outage@example.com', 'Forename': 'Ada', 'CurrentPoints': 450})
+    with portal.session_transaction() as sess:
+        sess['user_email'] = 'outage@example.com'
+        sess['customer_id'] = customer['Id']
+    assert portal.get('/dashboard').status_code == 200
+
+    epos_client.customer_cache.clear()
+    epos_client.upstream_circuit.configure(min_calls=1)
+    epos_client.upstream_circuit.record(True, 0.1)
+    stub.request_count = 0
+    try:
+        response = portal.get('/dashboard')
+        assert response.status_code == 200
+        text = response.get_data(as_text=True)
+        assert '£4.50' in text and "can't reach your loyalty account" in text
+        assert 'Edit my Profile' not in text
+        assert 'ETag' not in response.headers
+        assert stub.request_count == 0
+
+        with portal.session_transaction() as sess:
+            del sess['last_known_customer']
+        unavailable = portal.get('/dashboard')
+        assert unavailable.status_code == 503
+        assert b'Temporarily unavailable' in unavailable.data
+    finally:
+        epos_client.upstream_circuit.configure(min_calls=10)
@@ -0,0 +1,32 @@
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+from app import create_app, db
+from app.database import engine_options
+from tests.conftest import TestConfig
+
+def test_engine_options_per_backend():
+    """Test that pooling is chosen per backend and in-memory SQLite is left alone."""
+    config = {'DATABASE_POOL_SIZE': 5, 'DATABASE_MAX_OVERFLOW': 10, 'DATABASE_POOL_RECYCLE': 1800,
+              'SQLITE_BUSY_TIMEOUT': 2500}
+    assert engine_options(dict(config, SQLALCHEMY_DATABASE_URI='sqlite:///:memory:')) == {}
+    sqlite_file = engine_options(dict(config, SQLALCHEMY_DATABASE_URI='sqlite:////tmp/app.db'))
+    assert sqlite_file['poolclass'] is QueuePool
+    assert sqlite_file['connect_args'] == {'check_same_thread': False, 'timeout': 2.5}
+    postgres = engine_options(dict(config, SQLALCHEMY_DATABASE_URI='postgresql://db/loyalty'))
+    assert postgres['pool_pre_ping'] and postgres['pool_size'] == 5
+    assert engine_options(dict(config, DATABASE_POOL_SIZE=0, SQLALCHEMY_DATABASE_URI='sqlite:////tmp/app.db')) == {}
+
+def test_sqlite_file_uses_wal_and_busy_timeout(tmp_path):
+    """Test that the connection pragmas are applied to a file database."""
+    class FileConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'app.db'}"
+        SQLITE_BUSY_TIMEOUT = 1234
+    app = create_app(FileConfig)
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA busy_timeout')).scalar() == 1234
+            assert conn.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+        assert isinstance(db.engine.pool, QueuePool)
+        db.engine.dispose()
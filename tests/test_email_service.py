@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from app.email_service import MailQueue, build_magic_link_message
+from tests.stubs import SMTPSink
+
+@pytest.fixture
+def sink():
+    with SMTPSink() as server:
+        yield server
+
+def settings_for(sink):
+    return {'host': sink.host, 'port': sink.port, 'username': 'user', 'password': 'secret', 'use_tls': False}
+
+def test_queue_reuses_one_smtp_connection(sink):
+    """Test that queued messages are delivered over a single authenticated session."""
+    mail_queue = MailQueue(retry_backoff=0)
+    mail_queue.configure(settings_for(sink))
+    for i in range(3):
+        assert mail_queue.enqueue(f'user{i}@example.com', build_magic_link_message(f'user{i}@example.com', 'http://x/'))
+    assert mail_queue.join(timeout=5)
+
+    assert [recipients for _, recipients, _ in sink.messages] == [[f'user{i}@example.com'] for i in range(3)]
+    assert sink.connections == 1
+    assert mail_queue.stats()['sent'] == 3
+    assert mail_queue.stats()['depth'] == 0
+
+def test_queue_retries_transient_failures(sink):
+    """Test that a 4xx reply is retried and the message still delivered."""
+    sink.fail_next = 2
+    mail_queue = MailQueue(retry_backoff=0)
+    mail_queue.configure(settings_for(sink))
+    mail_queue.enqueue('retry@example.com', build_magic_link_message('retry@example.com', 'http://x/'))
+    assert mail_queue.join(timeout=5)
+
+    assert len(sink.messages) == 1
+    assert mail_queue.stats()['retried'] == 2
+    assert mail_queue.stats()['failed'] == 0
+
+def test_login_enqueues_the_magic_link(client, sink):
+    """Test that the login view hands the email to the queue instead of sending inline."""
+    app = client.application
+    app.config.update(MAIL_SERVER=sink.host, MAIL_PORT=sink.port, MAIL_USE_TLS=False,
+                      MAIL_USERNAME='user', MAIL_PASSWORD='secret')
+    mail_queue = app.extensions['mail_queue']
+    mail_queue.configure(settings_for(sink))
+
+    response = client.post('/login', data={'email': 'queued@example.com'})
+    assert response.status_code == 302
+    assert mail_queue.join(timeout=5)
+    assert '/login/verify/' in sink.messages[-1][2]
+
+def test_retry_backoff_does_not_hold_up_later_messages(sink):
+    """Test that a message waiting out its retry backoff does not block the ones queued behind it."""
+    sink.fail_next = 1
+    mail_queue = MailQueue(retry_backoff=0.5)
+    mail_queue.configure(settings_for(sink))
+    for i in range(3):
+        mail_queue.enqueue(f'user{i}@example.com', build_magic_link_message(f'user{i}@example.com', 'http://x/'))
+    assert mail_queue.join(timeout=5)
+
+    assert [recipients for _, recipients, _ in sink.messages] == [['user1@example.com'], ['user2@example.com'],
+                                                                  ['user0@example.com']]
+    assert mail_queue.stats()['sent'] == 3
+    assert mail_queue.stats()['retried'] == 1
+
+def test_drain_waits_for_queued_messages(sink):
+    """Test that draining at exit lets queued messages go out, but only for drain_timeout seconds."""
+    sink.latency = 0.1
+    mail_queue = MailQueue(retry_backoff=0, drain_timeout=5)
+    mail_queue.configure(settings_for(sink))
+    for i in range(3):
+        mail_queue.enqueue(f'user{i}@example.com', build_magic_link_message(f'user{i}@example.com', 'http://x/'))
+    mail_queue.drain()
+    assert len(sink.messages) == 3
+
+    sink.fail_next = 10
+    mail_queue.configure(settings_for(sink), retry_backoff=10, drain_timeout=0.2)
+    mail_queue.enqueue('late@example.com', build_magic_link_message('late@example.com', 'http://x/'))
+    start = time.monotonic()
+    mail_queue.drain()
+    assert time.monotonic() - start < 1
+    assert mail_queue.stats()['depth'] == 1
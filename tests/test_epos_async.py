@@ -0,0 +1,93 @@
+import asyncio
+import io
+import json
+import threading
+import time
+
+import pytest
+from flask import Flask, g
+
+from app import epos_client, logs
+from app.backpressure import UpstreamSaturated
+from app.epos_async import AsyncEposNowClient, CoalescingEposNowClient
+from tests.stubs import FakeEposServer
+
+@pytest.fixture
+def stub():
+    with FakeEposServer(latency=0.2) as server:
+        server.add_customer({'EmailAddress': 'flight@example.com', 'Forename': 'Ada'})
+        epos_client.configure_transport(EPOS_BASE_URL=server.base_url)
+        epos_client.customer_cache.clear()
+        yield server
+    epos_client.customer_cache.clear()
+
+def test_concurrent_async_lookups_share_one_request(stub):
+    """Test that gathered lookups for the same email make a single upstream call."""
+    client = AsyncEposNowClient(api_key='key', api_secret='secret')
+
+    async def lookups():
+        return await asyncio.gather(*[client.get_customer_by_email('flight@example.com') for _ in range(5)])
+
+    results = asyncio.run(lookups())
+    assert [r['Forename'] for r in results] == ['Ada'] * 5
+    assert results[0] is not results[1]
+    assert stub.request_count == 1
+
+def test_sync_facade_coalesces_across_threads(stub):
+    """Test that lookups from concurrent request threads are coalesced by the facade."""
+    results = []
+
+    def lookup():
+        results.append(CoalescingEposNowClient(api_key='key', api_secret='secret')
+                       .get_customer_by_email('Flight@example.com'))
+
+    threads = [threading.Thread(target=lookup) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 5 and all(r['Forename'] == 'Ada' for r in results)
+    assert stub.request_count == 1
+
+def test_facade_sheds_beyond_the_limiter_instead_of_queueing(stub):
+    """Test that lookups beyond EPOS_MAX_CONCURRENCY + EPOS_QUEUE_SIZE are refused, not queued behind the loop."""
+    stub.latency = 1.0
+    emails = [stub.add_customer({'EmailAddress': f'shed{i}@example.com'})['EmailAddress'] for i in range(20)]
+    epos_client.upstream_limiter.configure(max_concurrency=6, max_waiting=4, timeout=0.3)
+    outcomes = []
+
+    def lookup(email):
+        start = time.monotonic()
+        try:
+            CoalescingEposNowClient(api_key='key', api_secret='secret').get_customer_by_email(email)
+            outcomes.append(('ok', time.monotonic() - start))
+        except UpstreamSaturated:
+            outcomes.append(('shed', time.monotonic() - start))
+
+    try:
+        threads = [threading.Thread(target=lookup, args=(email,)) for email in emails]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        epos_client.upstream_limiter.configure(max_concurrency=6, max_waiting=4, timeout=2.0)
+
+    assert sum(1 for outcome, _ in outcomes if outcome == 'ok') == 6
+    assert sum(1 for outcome, _ in outcomes if outcome == 'shed') == 14
+    assert max(seconds for _, seconds in outcomes) < 2.0
+
+def test_facade_carries_the_request_id_to_epos_logs(stub):
+    """Test that EPOS call logs made on the loop's threads keep the calling request's ID."""
+    app = Flask(__name__)
+    stream = io.StringIO()
+    handler = logs.configure_logging(dict(LOG_LEVEL='INFO', LOG_FORMAT='json', LOG_QUEUE_SIZE=100,
+                                          LOG_SAMPLE_RATES='', LOG_REDACT=True), stream=stream)
+    with app.test_request_context():
+        g.request_id = 'req-42'
+        CoalescingEposNowClient(api_key='key', api_secret='secret').get_customer_by_email('flight@example.com')
+    handler.flush()
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [entry['request_id'] for entry in entries if entry.get('event') == 'epos.request'] == ['req-42']
@@ -0,0 +1,78 @@
+import pytest
+import requests
+
+from app import epos_client
+from app.epos_batch import CustomerBatchWriter
+from app.epos_client import EposNowClient
+from tests.stubs import FakeEposServer
+
+@pytest.fixture
+def stub():
+    with FakeEposServer() as server:
+        epos_client.configure_transport(EPOS_BASE_URL=server.base_url)
+        epos_client.customer_cache.clear()
+        yield server
+    epos_client.customer_cache.clear()
+
+@pytest.fixture
+def client(stub):
+    return EposNowClient(api_key='key', api_secret='secret')
+
+def test_writes_are_sent_as_chunked_arrays(stub, client):
+    """Test that many updates cost one call per chunk and map results per record."""
+    customers = [stub.add_customer({'EmailAddress': f'c{i}@example.com'}) for i in range(250)]
+    stub.request_count = 0
+
+    with CustomerBatchWriter(client, batch_size=100, flush_interval=60) as writer:
+        futures = [writer.update(dict(c, Forename=f'Name {c["Id"]}')) for c in customers]
+
+    assert stub.request_count == 3
+    assert [f.result()['Forename'] for f in futures] == [f'Name {c["Id"]}' for c in customers]
+    assert stub.customers[250]['Forename'] == 'Name 250'
+
+def test_a_rejected_record_only_fails_itself(stub, client):
+    """Test that a 4xx chunk is bisected so the valid records still go through."""
+    customers = [stub.add_customer({'EmailAddress': f'c{i}@example.com'}) for i in range(7)]
+    records = [dict(c, Surname='Synced') for c in customers]
+    records.insert(3, {'Id': 999, 'EmailAddress': 'ghost@example.com'})
+
+    with CustomerBatchWriter(client, batch_size=8, flush_interval=60) as writer:
+        futures = [writer.update(record) for record in records]
+
+    assert isinstance(futures[3].exception(), requests.exceptions.HTTPError)
+    assert all(f.result()['Surname'] == 'Synced' for i, f in enumerate(futures) if i != 3)
+
+def test_partial_batches_flush_on_interval(stub, client):
+    """Test that a batch below the size threshold is still sent after flush_interval."""
+    writer = CustomerBatchWriter(client, batch_size=100, flush_interval=0.05)
+    future = writer.create({'EmailAddress': 'late@example.com', 'Forename': 'Late'})
+
+    assert future.result(timeout=5)['Id'] == 1
+    assert stub.request_count == 1
+    writer.close()
+
+@pytest.mark.parametrize('status', [401, 403, 404, 408, 429])
+def test_request_level_errors_are_not_bisected(status):
+    """Test that a 4xx about the request as a whole fails the chunk in one call instead of splitting it."""
+    class RejectingClient:
+        def update_customers(self, records):
+            response = requests.Response()
+            response.status_code = status
+            raise requests.exceptions.HTTPError(f'{status} Client Error', response=response)
+
+    with CustomerBatchWriter(RejectingClient(), batch_size=8, flush_interval=60) as writer:
+        futures = [writer.update({'Id': i}) for i in range(8)]
+
+    assert writer.calls == 1
+    assert all(f.exception().response.status_code == status for f in futures)
+
+def test_creates_fail_when_the_response_does_not_line_up():
+    """Test that created records without a matching response are failed rather than reported as created."""
+    class ShortClient:
+        def create_customers(self, records):
+            return [dict(records[0], Id=1)]
+
+    with CustomerBatchWriter(ShortClient(), batch_size=3, flush_interval=60) as writer:
+        futures = [writer.create({'EmailAddress': f'c{i}@example.com'}) for i in range(3)]
+
+    assert all(isinstance(f.exception(), RuntimeError) for f in futures)
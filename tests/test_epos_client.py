@@ -0,0 +1,83 @@
+import time
+
+import pytest
+import requests
+
+from app import epos_client
+from app.epos_client import EposNowClient
+from tests.stubs import FakeEposServer
+
+@pytest.fixture
+def stub():
+    with FakeEposServer() as server:
+        epos_client.configure_transport(EPOS_BASE_URL=server.base_url, EPOS_MAX_RETRIES=2, EPOS_RETRY_BACKOFF=0)
+        epos_client.customer_cache.clear()
+        yield server
+
+@pytest.fixture
+def client(stub):
+    return EposNowClient(api_key='key', api_secret='secret')
+
+def test_requests_share_one_pooled_session(stub, client):
+    """Test that consecutive clients reuse the process-wide session."""
+    stub.add_customer({'EmailAddress': 'pool@example.com'})
+    session = epos_client.get_transport()
+    assert client.get_customer_by_email('pool@example.com')['EmailAddress'] == 'pool@example.com'
+    assert EposNowClient(api_key='key', api_secret='secret').get_customer_by_email('missing@example.com') is None
+    assert epos_client.get_transport() is session
+    assert client.timeout == (epos_client.TRANSPORT_SETTINGS['EPOS_CONNECT_TIMEOUT'],
+                              epos_client.TRANSPORT_SETTINGS['EPOS_READ_TIMEOUT'])
+
+def test_only_idempotent_requests_are_retried(stub, client):
+    """Test that GETs are retried on 503 while writes are sent exactly once."""
+    stub.error_rate = 1.0
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.get_customer_by_email('retry@example.com')
+    assert stub.request_count == 3  # first attempt + 2 retries
+
+    stub.request_count = 0
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.create_customer({'EmailAddress': 'retry@example.com'})
+    assert stub.request_count == 1
+
+def test_customer_lookups_are_cached_and_written_through(stub, client):
+    """Test that repeat lookups skip EPOS and writes refresh the cached record."""
+    customer = stub.add_customer({'EmailAddress': 'cache@example.com', 'Forename': 'Ada'})
+    assert client.get_customer_by_email('Cache@Example.com ')['Forename'] == 'Ada'
+    assert client.get_customer_by_email('cache@example.com')['Forename'] == 'Ada'
+    assert stub.request_count == 1
+
+    client.update_customer(dict(customer, Forename='Grace'))
+    assert client.get_customer_by_email('cache@example.com')['Forename'] == 'Grace'
+    assert stub.request_count == 2
+
+    created = client.create_customer({'EmailAddress': 'new@example.com', 'Forename': 'New'})
+    assert client.get_customer_by_email('new@example.com')['Id'] == created['Id']
+    assert stub.request_count == 3
+
+def test_lookups_by_id_share_the_cache(stub, client):
+    """Test that Id lookups are cached alongside email lookups and refetched when older than fresh_after."""
+    customer = stub.add_customer({'EmailAddress': 'id@example.com', 'Forename': 'Ada'})
+    assert client.get_customer_by_id(customer['Id'])['Forename'] == 'Ada'
+    assert client.get_customer_by_email('id@example.com')['Id'] == customer['Id']
+    assert client.get_customer_by_id(customer['Id'])['Forename'] == 'Ada'
+    assert stub.request_count == 1
+
+    customer['Forename'] = 'Grace'
+    assert client.get_customer_by_id(customer['Id'], fresh_after=time.time() + 1)['Forename'] == 'Grace'
+    assert stub.request_count == 2
+    assert client.get_customer_by_id(10 ** 6) is None
+
+def test_fresh_lookups_bypass_the_cache_and_mirror(stub, client):
+    """Test that fresh=True always reads EPOS, and the live record replaces the cached one."""
+    customer = stub.add_customer({'EmailAddress': 'fresh@example.com', 'CurrentPoints': 100})
+    assert client.get_customer_by_email('fresh@example.com')['CurrentPoints'] == 100
+
+    customer['CurrentPoints'] = 500
+    assert client.get_customer_by_email('fresh@example.com')['CurrentPoints'] == 100
+    assert client.get_customer_by_email('fresh@example.com', fresh=True)['CurrentPoints'] == 500
+    assert client.get_customer_by_id(customer['Id'])['CurrentPoints'] == 500
+
+    customer['CurrentPoints'] = 700
+    assert client.get_customer_by_id(customer['Id'], fresh=True)['CurrentPoints'] == 700
+    assert stub.request_count == 3
@@ -0,0 +1,92 @@
+import datetime
+
+from sqlalchemy import event
+
+from app import db
+from app.housekeeping import housekeeping_command, run_housekeeping
+from app.models import MagicLinkToken, RateLimit, UsedToken, UserAgent
+
+def add_token(suffix, expires_in, used_ago=None):
+    now = datetime.datetime.utcnow()
+    db.session.add(MagicLinkToken(
+        email=f'{suffix}@example.com',
+        token_digest=suffix.encode(),
+        expires_at=now + datetime.timedelta(seconds=expires_in),
+        used_at=None if used_ago is None else now - datetime.timedelta(seconds=used_ago),
+        request_ip='127.0.0.1',
+        user_agent_id=UserAgent.id_for(f'agent-{suffix}' if suffix.startswith('expired') else 'pytest')
+    ))
+
+def seed():
+    now = datetime.datetime.utcnow()
+    add_token('live', 600)
+    add_token('just-used', 600, used_ago=10)
+    for i in range(7):
+        add_token(f'expired-{i}', -2 * 24 * 3600)
+    add_token('used-long-ago', 600, used_ago=2 * 24 * 3600)
+    db.session.add(UsedToken(token_digest=b'redeemed-live', expires_at=now + datetime.timedelta(minutes=5)))
+    db.session.add(UsedToken(token_digest=b'redeemed-expired', expires_at=now - datetime.timedelta(minutes=5)))
+    db.session.add(RateLimit(key='ip:1', count=3, window_start=now))
+    for i in range(4):
+        db.session.add(RateLimit(key=f'ip:old-{i}', count=1, window_start=now - datetime.timedelta(hours=3)))
+    db.session.commit()
+
+def test_housekeeping_purges_in_batches(client):
+    """Test that only rows past their retention are removed, across several batches."""
+    app = client.application
+    with app.app_context():
+        seed()
+        stats = run_housekeeping(dict(app.config, HOUSEKEEPING_BATCH_SIZE=3))
+
+        assert stats['magic_link_tokens'] == 8
+        assert stats['rate_limits'] == 4
+        assert stats['used_tokens'] == 1
+        assert stats['user_agents'] == 7
+        assert [t.token_digest for t in UsedToken.query] == [b'redeemed-live']
+        assert {t.token_digest for t in MagicLinkToken.query} == {b'live', b'just-used'}
+        assert [a.value for a in UserAgent.query] == ['pytest']
+        assert [r.key for r in RateLimit.query] == ['ip:1']
+
+def test_housekeeping_cli_reports_reclaimed_rows(client):
+    """Test that the flask CLI command runs the purge and prints its stats."""
+    app = client.application
+    with app.app_context():
+        seed()
+    result = app.test_cli_runner().invoke(housekeeping_command, ['--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Deleted 8 magic link tokens, 1 used signed tokens and 4 rate limit windows' in result.output
+
+def test_user_agent_ids_are_cached_until_purged(client):
+    """Test that repeat lookups of a user agent skip the database, and a purge drops the cached ids."""
+    app = client.application
+    with app.app_context():
+        agent_id = UserAgent.id_for('cached')
+        db.session.execute(UserAgent.__table__.update().values(value='renamed'))
+        db.session.commit()
+        assert UserAgent.id_for('cached') == agent_id
+
+        stats = run_housekeeping(app.config)
+        assert stats['user_agents'] == 1
+        agent_id = UserAgent.id_for('cached')
+        assert UserAgent.query.filter_by(value='cached').one().id == agent_id
+
+def test_token_purge_selects_through_indexes(client):
+    """Test that each batch of the token purge is found through an index rather than a table scan."""
+    app = client.application
+    with app.app_context():
+        seed()
+        selects = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('SELECT magic_link_token.id'):
+                selects.append((statement, parameters))
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            run_housekeeping(dict(app.config, HOUSEKEEPING_BATCH_SIZE=3))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        assert selects
+        for statement, parameters in selects:
+            plan = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+            assert 'USING COVERING INDEX' in plan[0][-1], plan
@@ -0,0 +1,88 @@
+import io
+import json
+import logging
+
+from app import logs
+
+
+def capture(client, **overrides):
+    """Reinstalls the app's log handler writing to a buffer."""
+    config = dict(client.application.config, **overrides)
+    stream = io.StringIO()
+    handler = logs.configure_logging(config, stream=stream)
+    return handler, stream
+
+
+def dropped():
+    samples = logs.LOG_RECORDS_DROPPED.snapshot()['samples']
+    return samples[0][1] if samples else 0
+
+
+def entries(handler, stream):
+    handler.flush()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_records_are_json_with_request_id(client):
+    """Test that a record logged during a request is written as JSON carrying the request's ID."""
+    handler, stream = capture(client)
+    with client.application.test_request_context(headers={'X-Request-ID': 'abc-123'}):
+        logs._assign_request_id()
+        logging.getLogger('app.test').warning('Order %s of %d', 'A1', 3, extra={'event': 'test.order'})
+
+    entry = entries(handler, stream)[-1]
+    assert entry['message'] == 'Order A1 of 3'
+    assert entry['level'] == 'WARNING'
+    assert entry['logger'] == 'app.test'
+    assert entry['request_id'] == 'abc-123'
+    assert entry['event'] == 'test.order'
+
+
+def test_emails_and_tokens_are_redacted(client):
+    """Test that emails, magic-link tokens and secrets are masked unless a record opts out."""
+    handler, stream = capture(client)
+    log = logging.getLogger('app.test')
+    log.info('Link for jane.doe@example.com: https://x.test/login/verify/abc.def token=s3cret')
+    log.info('Dev link /login/verify/abc.def', extra={'unredacted': True})
+
+    redacted, unredacted = entries(handler, stream)[-2:]
+    assert 'jane.doe' not in redacted['message']
+    assert 'j***@example.com' in redacted['message']
+    assert 'abc.def' not in redacted['message']
+    assert 's3cret' not in redacted['message']
+    assert unredacted['message'] == 'Dev link /login/verify/abc.def'
+
+
+def test_sampled_events_are_dropped(client):
+    """Test that events with a zero sample rate never reach the queue, while untagged records do."""
+    handler, stream = capture(client, LOG_SAMPLE_RATES='epos.request=0')
+    log = logging.getLogger('app.test')
+    for _ in range(20):
+        log.info('EPOS call', extra={'event': 'epos.request'})
+    log.info('kept')
+
+    assert [entry['message'] for entry in entries(handler, stream)] == ['kept']
+
+
+def test_full_queue_drops_instead_of_blocking(client):
+    """Test that when the queue is full, records are counted as dropped and logging returns immediately."""
+    handler, stream = capture(client, LOG_QUEUE_SIZE=1)
+    log = logging.getLogger('app.test')
+    log.warning('start')  # starts the listener
+    handler.listener.stop()  # nothing drains the queue now
+    before = dropped()
+    for _ in range(5):
+        log.warning('burst')
+
+    assert dropped() >= before + 4
+    handler.listener.start()
+
+
+def test_request_id_header_is_echoed(client):
+    """Test that responses carry the incoming X-Request-ID, or a generated one."""
+    response = client.get('/login', headers={'X-Request-ID': 'trace-42'})
+    assert response.headers['X-Request-ID'] == 'trace-42'
+
+    generated = client.get('/login', headers={'X-Request-ID': 'bad id with spaces'})
+    assert generated.headers['X-Request-ID'] != 'bad id with spaces'
+    assert len(generated.headers['X-Request-ID']) == 32
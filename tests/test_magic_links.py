@@ -0,0 +1,46 @@
+from app import magic_links
+from app.models import MagicLinkToken, UsedToken
+
+def test_signed_token_round_trip_and_tampering():
+    """Test that a signed token only verifies unmodified and with the right key."""
+    token = magic_links.issue_token('a.b@example.com', 900, 'secret')
+    assert magic_links.is_signed_token(token)
+    email, _ = magic_links.read_token(token, 'secret')
+    assert email == 'a.b@example.com'
+
+    payload, mac = token.split('.')
+    other = magic_links.issue_token('mallory@example.com', 900, 'secret').split('.')[0]
+    assert magic_links.read_token(f'{other}.{mac}', 'secret') is None
+    assert magic_links.read_token(token, 'another-secret') is None
+    assert magic_links.read_token(magic_links.issue_token('late@example.com', -1, 'secret'), 'secret') is None
+
+def test_signed_login_is_stateless_and_single_use(client):
+    """Test that signed mode issues links without a DB write and redeems each once."""
+    app = client.application
+    app.config['MAGIC_LINK_MODE'] = 'signed'
+    with app.app_context():
+        assert client.post('/login', data={'email': 'signed@example.com'}).status_code == 302
+        assert MagicLinkToken.query.count() == 0
+
+        token = magic_links.issue_token('signed@example.com', 900, app.config['SECRET_KEY'])
+        first = client.get(f'/login/verify/{token}')
+        assert first.location == '/dashboard'
+        with client.session_transaction() as sess:
+            assert sess['user_email'] == 'signed@example.com'
+        assert UsedToken.query.count() == 1
+
+        replay = client.get(f'/login/verify/{token}')
+        assert replay.location == '/login'
+
+def test_non_ascii_tokens_are_rejected_in_both_modes(client):
+    """Test that links with non-ASCII characters are treated as invalid rather than raising."""
+    app = client.application
+    with app.app_context():
+        assert magic_links.read_token('abc.é', 'secret') is None
+        assert magic_links.read_token('é.abc', 'secret') is None
+        for mode in ('signed', 'database'):
+            app.config['MAGIC_LINK_MODE'] = mode
+            for path in ('/login/verify/abc.%C3%A9', '/login/verify/%C3%A9.abc', '/login/verify/%C3%A9'):
+                response = client.get(path)
+                assert response.status_code == 302, (mode, path)
+                assert response.location == '/login'
@@ -0,0 +1,86 @@
+import json
+import os
+import time
+
+import pytest
+
+from app import db, metrics
+
+def sample(text, prefix):
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line.rsplit(' ', 1)[1])
+    return 0.0
+
+def test_requests_and_queries_are_recorded(client):
+    """Test that request latency and per-request SQL counts appear at /metrics."""
+    series = 'loyalty_http_request_duration_seconds_count{endpoint="auth.login",method="POST",status="302"}'
+    before = sample(client.get('/metrics').get_data(as_text=True), series)
+
+    client.post('/login', data={'email': 'metrics@example.com'})
+    text = client.get('/metrics').get_data(as_text=True)
+
+    assert sample(text, series) == before + 1
+    assert '# TYPE loyalty_http_request_duration_seconds histogram' in text
+    assert sample(text, 'loyalty_db_queries_per_request_count{endpoint="auth.login"}') >= 1
+    assert 'loyalty_customer_cache{stat="hits"}' in text
+
+def test_worker_snapshots_are_merged(client, tmp_path):
+    """Test that with METRICS_DIR set, other workers' snapshots are summed into the scrape."""
+    client.application.config['METRICS_DIR'] = str(tmp_path)
+    other = metrics.REGISTRY.snapshot()
+    for metric in other.values():
+        metric['samples'] = []
+    other['loyalty_epos_request_duration_seconds']['samples'] = [
+        [['GET', 'Customer/GetByEmail', '200'], [[1] * len(metrics.DEFAULT_BUCKETS), 0.004, 1]]]
+    with open(os.path.join(tmp_path, 'metrics_999999.json'), 'w') as f:
+        json.dump(other, f)
+
+    text = client.get('/metrics').get_data(as_text=True)
+    series = 'loyalty_epos_request_duration_seconds_count{method="GET",endpoint="Customer/GetByEmail",status="200"}'
+    local = metrics.REGISTRY.snapshot()['loyalty_epos_request_duration_seconds']['samples']
+    local_count = sum(v[2] for labels, v in local if labels == ['GET', 'Customer/GetByEmail', '200'])
+    assert sample(text, series) == local_count + 1
+    assert os.path.exists(os.path.join(tmp_path, f'metrics_{os.getpid()}.json'))
+
+def test_metrics_token_is_enforced(client):
+    """Test that a configured bearer token protects the endpoint."""
+    client.application.config['METRICS_TOKEN'] = 's3cret'
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+def test_exited_and_stale_worker_snapshots_are_left_out(client, tmp_path):
+    """Test that removed snapshots and ones older than a few flush intervals are not merged."""
+    client.application.config.update(METRICS_DIR=str(tmp_path), METRICS_FLUSH_INTERVAL=1)
+    gauge = metrics.REGISTRY.snapshot()
+    gauge = {'loyalty_log_records_dropped_total': dict(gauge['loyalty_log_records_dropped_total'],
+                                                        samples=[[[], 1000]])}
+    for pid in (999997, 999998):
+        with open(os.path.join(tmp_path, f'metrics_{pid}.json'), 'w') as f:
+            json.dump(gauge, f)
+    old = time.time() - 60
+    os.utime(os.path.join(tmp_path, 'metrics_999997.json'), (old, old))
+    metrics.remove_snapshot(str(tmp_path), 999998)
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert sample(text, 'loyalty_log_records_dropped_total') < 1000
+    assert not os.path.exists(os.path.join(tmp_path, 'metrics_999998.json'))
+
+def test_metrics_need_a_token_outside_debug(client):
+    """Test that without METRICS_TOKEN the endpoint is hidden unless debugging or testing."""
+    client.application.testing = False
+    try:
+        assert client.get('/metrics').status_code == 404
+    finally:
+        client.application.testing = True
+
+def test_failed_statements_do_not_leak_timer_entries(client):
+    """Test that a statement that raises leaves no start time behind on the connection."""
+    with client.application.app_context():
+        connection = db.engine.connect()
+        try:
+            with pytest.raises(Exception):
+                connection.exec_driver_sql('SELECT * FROM no_such_table')
+            assert not connection.info.get('metrics_query_start')
+        finally:
+            connection.close()
@@ -0,0 +1,91 @@
+import hashlib
+import sqlite3
+
+from sqlalchemy import inspect
+
+from app import create_app, db
+from app.models import MagicLinkToken, UsedToken, UserAgent
+from app.startup import init_db_command
+from benchmarks.bench_schema import LEGACY_SCHEMA
+from tests.conftest import TestConfig
+
+# As the first release's db.create_all() made it: hex token_hash, inline user_agent, a plain index on rate_limit.key.
+BASELINE_SCHEMA = """
+CREATE TABLE magic_link_token (
+    id INTEGER NOT NULL, email VARCHAR(120) NOT NULL, token_hash VARCHAR(128) NOT NULL, created_at DATETIME,
+    expires_at DATETIME NOT NULL, used_at DATETIME, request_ip VARCHAR(45) NOT NULL,
+    user_agent VARCHAR(200) NOT NULL, PRIMARY KEY (id), UNIQUE (token_hash));
+CREATE INDEX ix_magic_link_token_email ON magic_link_token (email);
+CREATE TABLE rate_limit (
+    id INTEGER NOT NULL, "key" VARCHAR(120) NOT NULL, count INTEGER, window_start DATETIME, PRIMARY KEY (id));
+CREATE INDEX ix_rate_limit_key ON rate_limit ("key");
+"""
+
+
+def legacy_database(path, tokens):
+    connection = sqlite3.connect(path)
+    connection.executescript(LEGACY_SCHEMA)
+    for token, user_agent in tokens:
+        connection.execute(
+            "INSERT INTO magic_link_token (email, token_hash, created_at, expires_at, request_ip, user_agent) "
+            "VALUES ('old@example.com', ?, '2030-01-01 00:00:00', '2030-01-01 00:15:00', '127.0.0.1', ?)",
+            (hashlib.sha256(token.encode()).hexdigest(), user_agent))
+    connection.execute("INSERT INTO used_token VALUES (?, '2030-01-01 00:00:00')", ('ab' * 32,))
+    connection.execute("INSERT INTO rate_limit (key, count, window_start) VALUES ('ip:1', 2, '2030-01-01 00:00:00')")
+    connection.commit()
+    connection.close()
+
+
+def test_init_db_upgrades_a_legacy_database(tmp_path):
+    """Test that hex digests become binary, user agents are deduplicated and the old index is replaced."""
+    path = tmp_path / 'legacy.db'
+    legacy_database(path, [('first', 'Safari'), ('second', 'Safari'), ('third', 'Firefox')])
+
+    class LegacyConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+    app = create_app(LegacyConfig)
+    runner = app.test_cli_runner()
+    result = runner.invoke(init_db_command)
+    assert result.exit_code == 0, result.output
+    assert 'Migrated magic_link_token: 3 rows.' in result.output
+
+    with app.app_context():
+        token = MagicLinkToken.query.filter_by(token_digest=hashlib.sha256(b'second').digest()).one()
+        assert token.user_agent == 'Safari' and token.is_valid()
+        assert sorted(agent.value for agent in UserAgent.query) == ['Firefox', 'Safari']
+        assert UsedToken.query.one().token_digest == b'\xab' * 32
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('rate_limit')}
+        assert indexes == {'ix_rate_limit_key_window_start_count', 'ix_rate_limit_window_start'}
+        assert 'magic_link_token_pre_migration' not in inspect(db.engine).get_table_names()
+
+    again = runner.invoke(init_db_command)
+    assert 'Migrated' not in again.output
+
+    response = app.test_client().get('/login/verify/first')
+    assert response.location == '/dashboard'
+
+
+def test_init_db_upgrades_a_baseline_database(tmp_path):
+    """Test that a database from the first release loses its key-only index and gains the new tables."""
+    path = tmp_path / 'baseline.db'
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.execute(
+        "INSERT INTO magic_link_token (email, token_hash, created_at, expires_at, request_ip, user_agent) "
+        "VALUES ('old@example.com', ?, '2030-01-01 00:00:00', '2030-01-01 00:15:00', '127.0.0.1', 'Safari')",
+        (hashlib.sha256(b'first').hexdigest(),))
+    connection.commit()
+    connection.close()
+
+    class BaselineConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+    app = create_app(BaselineConfig)
+    result = app.test_cli_runner().invoke(init_db_command)
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        inspector = inspect(db.engine)
+        assert {'used_token', 'user_agent'} <= set(inspector.get_table_names())
+        indexes = {index['name'] for index in inspector.get_indexes('rate_limit')}
+        assert indexes == {'ix_rate_limit_key_window_start_count', 'ix_rate_limit_window_start'}
+        assert MagicLinkToken.query.one().user_agent == 'Safari'
@@ -0,0 +1,101 @@
+import json
+import os
+import time
+
+from app import create_app, db, epos_client, profiling
+from tests.conftest import TestConfig
+from tests.stubs import FakeEposServer
+
+
+def profile_files(directory):
+    return sorted(name for name in os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+def test_enabled_profiles_are_written_with_categories(client, tmp_path):
+    """Test that with PROFILE_ENABLED each request leaves a pstats file and a summary with a time breakdown."""
+    client.application.config.update(PROFILE_ENABLED=True, PROFILE_DIR=str(tmp_path))
+    client.get('/login')
+
+    files = profile_files(tmp_path)
+    assert [name.rsplit('.', 1)[1] for name in files] == ['json', 'prof']
+    with open(tmp_path / files[0]) as f:
+        meta = json.load(f)
+    assert meta['endpoint'] == 'auth.login'
+    assert meta['trigger'] == 'config'
+    assert set(meta['categories_ms']) == set(profiling.CATEGORIES)
+    assert 0 < meta['categories_ms']['templates'] <= meta['duration_ms']
+
+
+def test_profile_directory_is_a_bounded_ring(client, tmp_path):
+    """Test that only the newest PROFILE_MAX_FILES profiles are kept."""
+    client.application.config.update(PROFILE_ENABLED=True, PROFILE_DIR=str(tmp_path), PROFILE_MAX_FILES=2)
+    for _ in range(4):
+        client.get('/login')
+        time.sleep(0.002)
+
+    files = profile_files(tmp_path)
+    assert len(files) == 4  # two .json and two .prof
+    assert len(profiling.load_profiles(str(tmp_path))) == 2
+
+
+def test_signed_header_profiles_a_single_request(client, tmp_path):
+    """Test that only a valid, unexpired X-Profile-Token turns profiling on for a request."""
+    app = client.application
+    app.config['PROFILE_DIR'] = str(tmp_path)
+    secret = app.config['SECRET_KEY']
+
+    client.get('/login')
+    client.get('/login', headers={profiling.TOKEN_HEADER: 'not-a-token'})
+    client.get('/login', headers={profiling.TOKEN_HEADER: profiling.issue_token(secret, -1)})
+    client.get('/login', headers={profiling.TOKEN_HEADER: profiling.issue_token('other-secret', 60)})
+    assert client.get('/login', headers={profiling.TOKEN_HEADER: '99999999999.\xe9'}).status_code == 200
+    assert profile_files(tmp_path) == []
+
+    client.get('/login', headers={profiling.TOKEN_HEADER: profiling.issue_token(secret, 60)})
+    profiles = profiling.load_profiles(str(tmp_path))
+    assert [meta['trigger'] for meta in profiles] == ['token']
+
+
+def test_profile_report_summarizes_by_endpoint(client, tmp_path):
+    """Test that profile-report lists each endpoint's timings and the top functions."""
+    app = client.application
+    app.config.update(PROFILE_ENABLED=True, PROFILE_DIR=str(tmp_path))
+    client.get('/login')
+    client.get('/login')
+    client.get('/login/check-inbox')
+
+    rows = {row['endpoint']: row for row in profiling.summarize(profiling.load_profiles(str(tmp_path)))}
+    assert rows['auth.login']['count'] == 2
+    assert 'other' in rows['auth.login']['categories_ms']
+
+    result = app.test_cli_runner().invoke(profiling.profile_report_command, ['--endpoint', 'auth.login', '--top', '5'])
+    assert result.exit_code == 0
+    assert 'auth.login' in result.output and 'auth.check_inbox' not in result.output
+    assert 'across 2 profiles' in result.output
+
+
+def test_epos_time_is_attributed_for_coalesced_lookups(monkeypatch, tmp_path):
+    """Test that a dashboard lookup made on the EPOS event loop still counts as EPOS time."""
+    monkeypatch.setenv('EPOS_API_KEY', 'key')
+    monkeypatch.setenv('EPOS_API_SECRET', 'secret')
+    with FakeEposServer(latency=0.2) as stub:
+        customer = stub.add_customer({'EmailAddress': 'slow@example.com', 'Forename': 'Ada', 'CardNumber': '9000000009'})
+
+        class SlowEposConfig(TestConfig):
+            EPOS_BASE_URL = stub.base_url
+            PROFILE_ENABLED = True
+            PROFILE_DIR = str(tmp_path)
+        app = create_app(SlowEposConfig)
+        with app.app_context():
+            db.create_all()
+        try:
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_email'] = 'slow@example.com'
+                sess['customer_id'] = customer['Id']
+            assert client.get('/dashboard').status_code == 200
+        finally:
+            epos_client.customer_cache.clear()
+
+    meta = profiling.load_profiles(str(tmp_path), endpoint='main.dashboard')[-1]
+    assert meta['categories_ms']['epos'] >= 150
@@ -0,0 +1,82 @@
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.rate_limit import MemoryRateLimiter, DatabaseRateLimiter, create_rate_limiter
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_memory_limiter_slides_over_the_window():
+    """Test that hits from the previous window still count while they overlap."""
+    clock = FakeClock()
+    limiter = MemoryRateLimiter(clock=clock)
+    assert all(limiter.hit('email:a', 5, 100) for _ in range(5))
+    assert not limiter.hit('email:a', 5, 100)
+    assert limiter.hit('email:b', 5, 100)
+
+    clock.now = 150  # half of the previous window still overlaps: 5 * 0.5 = 2.5
+    assert all(limiter.hit('email:a', 5, 100) for _ in range(3))
+    assert not limiter.hit('email:a', 5, 100)
+
+    clock.now = 300  # more than a full window later, the budget is fresh
+    assert all(limiter.hit('email:a', 5, 100) for _ in range(5))
+
+def test_memory_limiter_bounds_its_keys():
+    """Test that idle keys are evicted and the key count is capped."""
+    clock = FakeClock()
+    limiter = MemoryRateLimiter(max_keys=3, clock=clock)
+    for i in range(5):
+        limiter.hit(f'ip:{i}', 10, 60)
+    assert len(limiter) == 3
+
+    clock.now = 500
+    limiter.hit('ip:new', 10, 60)
+    assert len(limiter) == 1
+
+def test_database_limiter_keeps_fixed_windows(client):
+    """Test that the database backend still enforces the limit per key."""
+    with client.application.app_context():
+        limiter = DatabaseRateLimiter()
+        assert limiter.hit('ip:127.0.0.1', 2, 3600)
+        assert limiter.hit('ip:127.0.0.1', 2, 3600)
+        assert not limiter.hit('ip:127.0.0.1', 2, 3600)
+
+def test_login_is_throttled_without_revealing_it(client):
+    """Test that a throttled login still redirects to the check-inbox page."""
+    client.application.extensions['rate_limiter'] = limiter = MemoryRateLimiter()
+    for _ in range(5):
+        client.post('/login', data={'email': 'throttle@example.com'})
+    assert not limiter.hit('email:throttle@example.com', 5, 3600)
+
+    response = client.post('/login', data={'email': 'throttle@example.com'})
+    assert response.status_code == 302
+    assert response.location == '/login/check-inbox'
+
+def test_database_limiter_reads_only_the_covering_index(client):
+    """Test that the window lookup is answered from the (key, window_start, count) index alone."""
+    with client.application.app_context():
+        selects = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('SELECT'):
+                selects.append((statement, parameters))
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            DatabaseRateLimiter().hit('ip:127.0.0.1', 5, 3600)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        statement, parameters = selects[0]
+        plan = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+        assert 'USING COVERING INDEX ix_rate_limit_key_window_start_count' in plan[0][-1]
+
+def test_default_backend_is_shared_by_workers(client):
+    """Test that limits are kept in the database by default, and redis refuses to start without a URL."""
+    assert isinstance(client.application.extensions['rate_limiter'], DatabaseRateLimiter)
+    with pytest.raises(ValueError, match='RATE_LIMIT_STORAGE_URL'):
+        create_rate_limiter(dict(client.application.config, RATE_LIMIT_BACKEND='redis', RATE_LIMIT_STORAGE_URL=None))
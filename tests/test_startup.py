@@ -0,0 +1,46 @@
+import subprocess
+import sys
+
+from sqlalchemy import inspect
+
+from app import create_app, db
+from app.startup import init_db_command, parse_importtime, summarize_importtime, warm_up
+from tests.conftest import TestConfig
+
+def test_boot_does_not_import_heavy_libraries():
+    """Test that importing the app leaves QR, pass and crypto libraries for first use."""
+    code = ('import sys, main\n'
+            "print(','.join(m for m in ('qrcode', 'PIL', 'py_pkpass', 'cryptography') if m in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
+
+def test_create_app_does_not_create_schema():
+    """Test that booting leaves schema creation to init-db."""
+    app = create_app(TestConfig)
+    with app.app_context():
+        assert inspect(db.engine).get_table_names() == []
+        result = app.test_cli_runner().invoke(init_db_command)
+        assert result.exit_code == 0
+        tables = inspect(db.engine).get_table_names()
+        assert 'magic_link_token' in tables and 'rate_limit' in tables
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('rate_limit')}
+        assert 'ix_rate_limit_key_window_start_count' in indexes
+
+def test_warm_up_compiles_templates(client):
+    """Test that warm_up compiles every template into the Jinja cache."""
+    app = client.application
+    warm_up(app)
+    cached = {key[1] for key in app.jinja_env.cache.keys()}
+    assert 'dashboard.html' in cached and 'enter_email.html' in cached
+
+def test_parse_importtime():
+    """Test that -X importtime output is aggregated per top-level package."""
+    output = ('import time: self [us] | cumulative | imported package\n'
+              'import time:       100 |        100 |   qrcode.constants\n'
+              'import time:       250 |        350 | qrcode\n'
+              'import time:        40 |         40 | app.codes\n')
+    rows = parse_importtime(output)
+    assert rows[1] == ('qrcode', 250, 350)
+    packages, total = summarize_importtime(rows)
+    assert packages[0] == ('qrcode', 350)
+    assert total == 390
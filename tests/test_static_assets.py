@@ -0,0 +1,56 @@
+import gzip
+import json
+import re
+
+from app.static_assets import build_assets_command, fingerprint
+
+
+def stylesheet_url(client):
+    return re.search(r'href="(/static/style\.[0-9a-f]{12}\.css)"', client.get('/login').get_data(as_text=True)).group(1)
+
+
+def test_url_for_static_returns_the_hashed_name(client):
+    """Test that templates link to content-hashed static URLs."""
+    with open(client.application.static_folder + '/style.css', 'rb') as f:
+        hashed_name, _ = fingerprint('style.css', f.read())
+    assert stylesheet_url(client) == f'/static/{hashed_name}'
+
+
+def test_hashed_files_are_immutable_and_precompressed(client):
+    """Test that a hashed URL is cached for a year and sent gzipped only to clients that accept it."""
+    url = stylesheet_url(client)
+    with open(client.application.static_folder + '/style.css', 'rb') as f:
+        original = f.read()
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert gzip.decompress(response.data) == original
+
+    plain = client.get(url)
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.data == original
+
+    revalidated = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_unhashed_names_still_revalidate(client):
+    """Test that the original filename is still served, without the long-lived cache."""
+    response = client.get('/static/style.css')
+    assert response.status_code == 200
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+
+
+def test_build_assets_writes_files_and_manifest(client, tmp_path):
+    """Test that build-assets exports hashed files, their .gz variants and a manifest."""
+    result = client.application.test_cli_runner().invoke(build_assets_command, [str(tmp_path)])
+    assert result.exit_code == 0, result.output
+
+    manifest = json.loads((tmp_path / 'manifest.json').read_text())
+    assert set(manifest) >= {'style.css', 'images/logo.png'}
+    assert (tmp_path / manifest['images/logo.png']).exists()
+    assert (tmp_path / (manifest['style.css'] + '.gz')).exists()
+    assert not (tmp_path / (manifest['images/logo.png'] + '.gz')).exists()
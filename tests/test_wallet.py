@@ -0,0 +1,83 @@
+import datetime
+import io
+import json
+import zipfile
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from app import create_app
+from app.passes import PassBuilder, PassSigningError
+from tests.conftest import TestConfig
+
+CUSTOMER = {'CardNumber': '9000000001', 'CurrentPoints': 250, 'Forename': 'Ada'}
+
+def write_self_signed(directory, name):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+    now = datetime.datetime.utcnow()
+    cert = (x509.CertificateBuilder()
+            .subject_name(subject).issuer_name(subject)
+            .public_key(key.public_key()).serial_number(x509.random_serial_number())
+            .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    cert_path, key_path = directory / f'{name}.pem', directory / f'{name}.key'
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                           serialization.NoEncryption()))
+    return str(cert_path), str(key_path)
+
+@pytest.fixture
+def signing_config(tmp_path):
+    cert_path, key_path = write_self_signed(tmp_path, 'pass')
+    wwdr_path, _ = write_self_signed(tmp_path, 'wwdr')
+
+    class SigningConfig(TestConfig):
+        PASS_CERT_PATH = cert_path
+        PASS_KEY_PATH = key_path
+        PASS_WWDR_CERT_PATH = wwdr_path
+        PASS_CERT_PASSWORD = None
+    return SigningConfig
+
+def build_with(config):
+    builder = PassBuilder()
+    builder.init_app(create_app(config))
+    try:
+        return builder, builder.build(CUSTOMER)
+    finally:
+        builder.shutdown()
+
+def assert_valid_pkpass(pass_bytes):
+    archive = zipfile.ZipFile(io.BytesIO(pass_bytes))
+    assert set(archive.namelist()) == {'signature', 'manifest.json', 'pass.json', 'icon.png', 'icon@2x.png', 'logo.png'}
+    pass_json = json.loads(archive.read('pass.json'))
+    assert pass_json['serialNumber'] == '9000000001'
+    assert pass_json['barcodes'][0]['message'] == '9000000001'
+    assert pass_json['storeCard']['primaryFields'][0]['value'] == 'Ada'
+
+def test_pass_is_signed_inline_and_cached(signing_config):
+    """Test that a pass is built from preloaded material and reused while unchanged."""
+    builder, pass_bytes = build_with(signing_config)
+    assert_valid_pkpass(pass_bytes)
+    assert builder.build(dict(CUSTOMER)) is pass_bytes
+    assert builder.build(dict(CUSTOMER, CurrentPoints=300)) is not pass_bytes
+
+def test_pass_is_signed_in_worker_pool(signing_config):
+    """Test that signing can be delegated to the process pool."""
+    signing_config.PASS_SIGNING_WORKERS = 1
+    _, pass_bytes = build_with(signing_config)
+    assert_valid_pkpass(pass_bytes)
+
+def test_missing_certificates_are_reported(tmp_path):
+    """Test that missing signing material raises instead of writing placeholder files."""
+    class MissingConfig(TestConfig):
+        PASS_CERT_PATH = str(tmp_path / 'missing.pem')
+
+    builder = PassBuilder()
+    builder.init_app(create_app(MissingConfig))
+    with pytest.raises(PassSigningError):
+        builder.build(CUSTOMER)
+    assert not (tmp_path / 'missing.pem').exists()